@@ -0,0 +1,65 @@
+import logging
+import os
+from typing import Optional
+
+from psycopg.conninfo import make_conninfo
+from psycopg_pool import AsyncConnectionPool
+
+logger = logging.getLogger(__name__)
+
+# Las conexiones mínimas se abren antes de atender peticiones (configurable con DB_POOL_MIN_SIZE)
+DB_POOL_MIN_SIZE = int(os.getenv("DB_POOL_MIN_SIZE", "2"))
+DB_POOL_MAX_SIZE = 20
+# Las conexiones se renuevan cada 30 minutos, antes de que el proxy de Render las corte por antigüedad
+DB_POOL_MAX_LIFETIME = 1800.0
+# Espera máxima al calentar el pool; si vence, el pool sigue conectando en segundo plano
+DB_POOL_WARM_TIMEOUT = 10.0
+
+_pool: Optional[AsyncConnectionPool] = None
+
+
+def _conninfo() -> str:
+    """
+    Cadena de conexión: DATABASE_URL tal cual si está definida (libpq entiende postgres:// y
+    postgresql://); si no, las variables DB_* con los valores por defecto de desarrollo local.
+    """
+    database_url = os.getenv("DATABASE_URL")
+    if database_url:
+        return database_url
+
+    # Fallback para desarrollo local
+    return make_conninfo(
+        dbname=os.getenv("DB_NAME", "postgres"),
+        user=os.getenv("DB_USER", "postgres"),
+        password=os.getenv("DB_PASSWORD", ""),
+        host=os.getenv("DB_HOST", "localhost"),
+        port=os.getenv("DB_PORT", "5432")
+    )
+
+
+async def open_db_pool() -> AsyncConnectionPool:
+    """Abre el pool asíncrono compartido con sus conexiones mínimas ya establecidas (idempotente)"""
+    global _pool
+    if _pool is None:
+        # check verifica cada conexión al entregarla; si el servidor la cerró, el pool la descarta y da otra
+        _pool = AsyncConnectionPool(
+            _conninfo(), min_size=DB_POOL_MIN_SIZE, max_size=DB_POOL_MAX_SIZE,
+            max_lifetime=DB_POOL_MAX_LIFETIME, check=AsyncConnectionPool.check_connection, open=False
+        )
+        await _pool.open(wait=True, timeout=DB_POOL_WARM_TIMEOUT)
+        logger.info(f"Pool de base de datos abierto ({DB_POOL_MIN_SIZE}-{DB_POOL_MAX_SIZE} conexiones)")
+    return _pool
+
+
+async def close_db_pool() -> None:
+    """Cierra el pool compartido si está abierto"""
+    global _pool
+    if _pool is not None:
+        await _pool.close()
+        _pool = None
+        logger.info("Pool de base de datos cerrado")
+
+
+async def get_db_pool() -> AsyncConnectionPool:
+    """Pool compartido; se abre bajo demanda si el servidor no lo abrió al iniciar"""
+    return _pool if _pool is not None else await open_db_pool()
@@ -1,28 +1,268 @@
 from typing import List, Dict, Any, Tuple, Optional
 import numpy as np
-import os
-import json
+import sys
 import logging
-from sklearn.metrics.pairwise import cosine_similarity
-import random
+import functools
+import math
+import operator
+from dataclasses import dataclass
+import ahocorasick
+from scipy.special import expit
+
+try:
+    from numba import njit
+except ImportError:  # numba es opcional: sin él se usa el forward pass en NumPy
+    njit = None
+
+try:
+    import jax
+    import jax.numpy as jnp
+except ImportError:  # jax es opcional: solo acelera la inferencia por lotes grandes
+    jax = None
 
 # Configurar logging
 logging.basicConfig(level=logging.INFO)
 logger = logging.getLogger(__name__)
 
+
+# Sinónimos/variaciones de las palabras clave de síntomas
+_SYNONYMS = {
+    "dolor": ("duele", "molestia", "dolencia"),
+    "fiebre": ("temperatura", "calentura", "febril"),
+    "inflamación": ("hinchazón", "inflamado", "irritación"),
+    "tos": ("toser", "tusígeno"),
+    "digestión": ("estomacal", "intestinal", "gastrointestinal"),
+    "fatiga": ("cansancio", "agotamiento", "debilidad"),
+    "piel": ("cutáneo", "dermatitis", "eccema"),
+    "cabeza": ("cefalea", "migraña", "jaqueca"),
+    "respiratorio": ("pulmones", "bronquios", "pulmonar")
+}
+
+# Mapeo de propiedades a síntomas
+_PROPERTY_SYMPTOM_MAP = {
+    "digestivo": ("estómago", "digestión", "náuseas", "intestinal"),
+    "respiratorio": ("tos", "gripe", "resfriado", "respiratorio"),
+    "antiinflamatorio": ("inflamación", "dolor", "articulaciones"),
+    "cicatrizante": ("piel", "herida", "cortadura"),
+    "sedante": ("estrés", "nervios", "ansiedad", "insomnio")
+}
+
+# Diccionario expandido que mapea síntomas a plantas
+_SYMPTOM_PLANT_MAP = {
+    "dolor": ("uña de gato", "maca", "matico", "caléndula"),
+    "fiebre": ("eucalipto", "manzanilla", "muña", "hierba luisa"),
+    "inflamación": ("sangre de grado", "uña de gato", "caléndula", "llantén"),
+    "tos": ("eucalipto", "matico", "jengibre", "muña"),
+    "digestión": ("manzanilla", "boldo", "muña", "hierba luisa", "yacón"),
+    "piel": ("sangre de grado", "aloe vera", "caléndula", "matico"),
+    "cabeza": ("valeriana", "manzanilla", "eucalipto", "toronjil"),
+    "estómago": ("manzanilla", "yacón", "muña", "jengibre"),
+    "respiratorio": ("eucalipto", "matico", "jengibre", "muña"),
+    "gripe": ("eucalipto", "muña", "jengibre", "manzanilla"),
+    "resfriado": ("eucalipto", "jengibre", "manzanilla", "muña"),
+    "náuseas": ("jengibre", "manzanilla", "hierba luisa"),
+    "articulaciones": ("uña de gato", "maca", "caléndula"),
+    "estrés": ("valeriana", "manzanilla", "toronjil", "hierba luisa"),
+    "fatiga": ("maca", "coca", "camu camu"),
+    "renal": ("chanca piedra", "cola de caballo"),
+    "hepático": ("hercampuri", "boldo"),
+    "parasitos": ("paico", "matico")
+}
+
+# Recomendaciones de RNA por defecto si la predicción falla
+_FALLBACK_PREDICTIONS = (
+    ("muña", 0.782), ("manzanilla", 0.756), ("uña de gato", 0.643),
+    ("eucalipto", 0.598), ("jengibre", 0.521)
+)
+
+# Nombres científicos por nombre común
+_SCIENTIFIC_NAMES = {
+    "muña": "Minthostachys mollis",
+    "uña de gato": "Uncaria tomentosa",
+    "maca": "Lepidium meyenii",
+    "sangre de grado": "Croton lechleri",
+    "hercampuri": "Gentianella alborosea",
+    "chanca piedra": "Phyllanthus niruri",
+    "sacha inchi": "Plukenetia volubilis",
+    "camu camu": "Myrciaria dubia",
+    "tara": "Caesalpinia spinosa",
+    "yacón": "Smallanthus sonchifolius",
+    "matico": "Piper aduncum",
+    "coca": "Erythroxylum coca",
+    "aloe vera": "Aloe barbadensis miller",
+    "jengibre": "Zingiber officinale",
+    "caléndula": "Calendula officinalis",
+    "árbol de té": "Melaleuca alternifolia",
+    "eucalipto": "Eucalyptus globulus",
+    "boldo": "Peumus boldus",
+    "valeriana": "Valeriana officinalis",
+    "manzanilla": "Matricaria chamomilla",
+    "toronjil": "Melissa officinalis",
+    "hierba luisa": "Cymbopogon citratus",
+    "paico": "Dysphania ambrosioides",
+    "llantén": "Plantago major",
+    "cola de caballo": "Equisetum arvense"
+}
+# Claves internadas: las búsquedas con nombres también internados se resuelven por identidad
+_SCIENTIFIC_NAMES = {sys.intern(name): scientific for name, scientific in _SCIENTIFIC_NAMES.items()}
+
+
+def _forward_kernel(x, w1, b1, w2, b2):
+    """Forward pass fusionado entrada→oculta→salida: tanh en la capa oculta y sigmoide en la salida"""
+    hidden = np.empty_like(b1)
+    for j in range(w1.shape[1]):
+        acc = b1[j]
+        for i in range(w1.shape[0]):
+            acc += x[i] * w1[i, j]
+        hidden[j] = math.tanh(acc)
+    
+    out = np.empty_like(b2)
+    for k in range(w2.shape[1]):
+        acc = 0.0
+        for j in range(w2.shape[0]):
+            acc += hidden[j] * w2[j, k]
+        # sigmoide(z) = (1 + tanh(z/2)) / 2, exacta y sin desbordamiento de exp para |z| grandes
+        out[k] = 0.5 + 0.5 * math.tanh(0.5 * (acc + b2[k]))
+    return out
+
+
+def _forward_numpy(x, w1, b1, w2, b2):
+    """Forward pass en NumPy, para un vector (entrada,) o un lote (N,entrada)"""
+    hidden_layer = np.tanh(x @ w1 + b1)
+    return expit(hidden_layer @ w2 + b2)
+
+
+# Con numba el kernel usa las mismas tanh de libm que NumPy: predict y predict_batch coinciden
+_forward = njit(cache=True)(_forward_kernel) if njit is not None else _forward_numpy
+
+
+if jax is not None:
+    @jax.jit
+    def _forward_batch_jax(x, w1, b1, w2, b2):
+        """Forward pass por lotes compilado por XLA (matmul + tanh + sigmoide fusionados)"""
+        return jax.nn.sigmoid(jnp.tanh(x @ w1 + b1) @ w2 + b2)
+else:
+    _forward_batch_jax = None
+
+
+class KeywordMatcher:
+    """
+    Autómata Aho-Corasick que localiza todas las palabras clave de un texto en una sola pasada.
+    Cada palabra recibe un bit; el resultado de un escaneo es la máscara de palabras encontradas.
+    """
+    
+    def __init__(self, words):
+        self.bits = {word: 1 << i for i, word in enumerate(dict.fromkeys(words))}
+        self._automaton = ahocorasick.Automaton()
+        for word, bit in self.bits.items():
+            self._automaton.add_word(word, bit)
+        self._automaton.make_automaton()
+    
+    def mask(self, words) -> int:
+        """Máscara con los bits de las palabras indicadas"""
+        mask = 0
+        for word in words:
+            mask |= self.bits[word]
+        return mask
+    
+    def scan(self, text: str) -> int:
+        """Retorna la máscara de palabras clave presentes en el texto (ya en minúsculas)"""
+        found = 0
+        for _, bit in self._automaton.iter(text):
+            found |= bit
+        return found
+
+
+class _NoisePool:
+    """
+    Ruido gaussiano pre-generado en bloque con np.random.default_rng (PCG64).
+    Cada llamada toma una porción de la reserva y la regenera cuando se agota.
+    """
+    
+    def __init__(self, size: int = 4096):
+        self._rng = np.random.default_rng()
+        self._size = size
+        self._refill()
+    
+    def _refill(self):
+        self._pool = self._rng.standard_normal(self._size).astype(np.float32)
+        self._pos = 0
+    
+    def draw(self, n: int, sigma: float) -> np.ndarray:
+        """Retorna n muestras de N(0, sigma²)"""
+        if n > self._size:
+            return self._rng.standard_normal(n).astype(np.float32) * sigma
+        if self._pos + n > self._size:
+            self._refill()
+        chunk = self._pool[self._pos:self._pos + n]
+        self._pos += n
+        return chunk * sigma
+    
+    def scalar(self, sigma: float) -> float:
+        """Retorna una única muestra de N(0, sigma²) como float de Python"""
+        return float(self.draw(1, sigma)[0])
+
+
+@dataclass(frozen=True)
+class RequestFeatures:
+    """Resultado de un único recorrido del texto de síntomas, compartido por todos sus consumidores"""
+    lower: str
+    token_count: int
+    kw_mask: int
+    kw_hits: np.ndarray
+
+
 class SimpleNeuralNetwork:
     """Una implementación simple de red neuronal para recomendación de plantas"""
     
-    def __init__(self, input_size=15, hidden_size=8, output_size=25):
-        # Inicializar con pesos aleatorios para demostración
-        np.random.seed(42)  # Para reproducibilidad
-        self.weights_input_hidden = np.random.randn(input_size, hidden_size) * 0.5
-        self.weights_hidden_output = np.random.randn(hidden_size, output_size) * 0.5
-        self.bias_hidden = np.random.randn(hidden_size) * 0.1
-        self.bias_output = np.random.randn(output_size) * 0.1
+    # Palabras clave para vectorización y sus sinónimos/variaciones
+    symptom_keywords = (
+        "dolor", "fiebre", "inflamación", "tos", "digestión", 
+        "fatiga", "piel", "cabeza", "estómago", "respiratorio",
+        "gripe", "resfriado", "náuseas", "articulaciones", "estrés"
+    )
+    synonyms = _SYNONYMS
+    
+    def __init__(self, input_size=16, hidden_size=8, output_size=25, extra_keywords=()):
+        # Inicializar con pesos aleatorios para demostración (float32)
+        rng = np.random.default_rng(42)  # Generador local: reproducible sin tocar el RNG global
+        self.weights_input_hidden = rng.standard_normal((input_size, hidden_size), dtype=np.float32) * 0.5
+        self.weights_hidden_output = rng.standard_normal((hidden_size, output_size), dtype=np.float32) * 0.5
+        self.bias_hidden = rng.standard_normal(hidden_size, dtype=np.float32) * 0.1
+        self.bias_output = rng.standard_normal(output_size, dtype=np.float32) * 0.1
         self.plant_mapping = {}
         self.plant_properties = {}
+        self._plant_prop_mask = {}
+        self._noise = _NoisePool()
         self.load_plant_data()
+        # Nombre de planta por índice de salida (None si el índice no tiene planta asignada)
+        self._plant_names = tuple(self.plant_mapping.get(i) for i in range(output_size))
+        
+        # Un único autómata para palabras clave, sinónimos y palabras extra (p. ej. del recomendador)
+        vocabulary = list(self.symptom_keywords)
+        for syns in self.synonyms.values():
+            vocabulary.extend(syns)
+        vocabulary.extend(extra_keywords)
+        for words in _PROPERTY_SYMPTOM_MAP.values():
+            vocabulary.extend(words)
+        self.keyword_matcher = KeywordMatcher(vocabulary)
+        
+        # Por planta: máscara de las palabras de síntoma asociadas a sus propiedades
+        self._plant_symptom_masks = {
+            name: self.keyword_matcher.mask(
+                word for prop in properties for word in _PROPERTY_SYMPTOM_MAP.get(prop, ())
+            )
+            for name, properties in self.plant_properties.items()
+        }
+        
+        # Por cada característica: (bit de la palabra clave, máscara de sus sinónimos)
+        self._feature_masks = [
+            (self.keyword_matcher.bits[keyword], self.keyword_matcher.mask(self.synonyms.get(keyword, ())))
+            for keyword in self.symptom_keywords
+        ]
+        
+        # Cache LRU de la salida determinista de la red (antes de añadir ruido)
+        self._predict_core = functools.lru_cache(maxsize=1024)(self._compute_output)
         
     def load_plant_data(self):
         """Carga el mapeo de índices a nombres de plantas y sus propiedades"""
@@ -58,8 +298,19 @@ class SimpleNeuralNetwork:
             
             # Crear mapeos
             for idx, data in plants_data.items():
-                self.plant_mapping[idx] = data["name"]
-                self.plant_properties[data["name"]] = data["properties"]
+                name = sys.intern(data["name"])
+                self.plant_mapping[idx] = name
+                self.plant_properties[name] = data["properties"]
+            
+            # Cada propiedad recibe un bit; cada planta, la máscara de sus propiedades
+            property_id = {}
+            for properties in self.plant_properties.values():
+                for prop in properties:
+                    property_id.setdefault(prop, len(property_id))
+            self._plant_prop_mask = {
+                name: functools.reduce(operator.or_, (1 << property_id[prop] for prop in properties), 0)
+                for name, properties in self.plant_properties.items()
+            }
                 
             logger.info(f"Loaded {len(self.plant_mapping)} plants into the neural network")
         except Exception as e:
@@ -70,127 +321,169 @@ class SimpleNeuralNetwork:
                 3: "sangre de grado", 4: "hercampuri"
             }
     
-    def preprocess_symptoms(self, symptoms: str, patient_info: Dict[str, Any] = None) -> np.ndarray:
-        """
-        Preprocesa los síntomas y datos del paciente para crear un vector de características
-        """
-        # Lista expandida de palabras clave para vectorización
-        symptom_keywords = [
-            "dolor", "fiebre", "inflamación", "tos", "digestión", 
-            "fatiga", "piel", "cabeza", "estómago", "respiratorio",
-            "gripe", "resfriado", "náuseas", "articulaciones", "estrés"
-        ]
-        
-        # Crear vector de características basado en presencia de palabras clave
-        feature_vector = np.zeros(len(symptom_keywords))
-        symptoms_lower = symptoms.lower()
+    @staticmethod
+    def _patient_age(patient_info: Optional[Dict[str, Any]]) -> Optional[float]:
+        """Edad exacta del paciente (la red la recibe sin redondear), o None si no está disponible"""
+        if patient_info and 'age' in patient_info:
+            return float(patient_info['age'])
+        return None
+    
+    def _build_features(self, symptoms_lower: str, age: Optional[float]) -> np.ndarray:
+        """Construye el vector de características a partir de síntomas ya en minúsculas"""
+        # Vector completo (palabras clave + edad) reservado de una vez
+        feature_vector = np.zeros(self.weights_input_hidden.shape[0], dtype=np.float32)
+        found = self.keyword_matcher.scan(symptoms_lower)
         
-        # Análisis de síntomas
-        for i, keyword in enumerate(symptom_keywords):
-            if keyword in symptoms_lower:
+        # Análisis de síntomas (palabra clave exacta o sinónimos y variaciones)
+        for i, (keyword_bit, synonyms_mask) in enumerate(self._feature_masks):
+            if found & keyword_bit:
                 feature_vector[i] = 1.0
-            # Buscar sinónimos y variaciones
-            elif self._check_synonyms(keyword, symptoms_lower):
+            elif found & synonyms_mask:
                 feature_vector[i] = 0.8
                 
-        # Añadir información del paciente si está disponible
-        if patient_info:
+        # Añadir información del paciente si está disponible (última posición del vector)
+        if age is not None:
             # Factores de edad (normalizado)
-            if 'age' in patient_info:
-                age_factor = min(patient_info['age'] / 100.0, 1.0)
-                feature_vector = np.append(feature_vector, age_factor)
-            else:
-                feature_vector = np.append(feature_vector, 0.3)  # Valor por defecto
+            feature_vector[len(self._feature_masks)] = min(age / 100.0, 1.0)
         else:
-            feature_vector = np.append(feature_vector, 0.3)
+            feature_vector[len(self._feature_masks)] = 0.3  # Valor por defecto
                 
-        return feature_vector[:self.weights_input_hidden.shape[0]]  # Asegurar tamaño correcto
-    
-    def _check_synonyms(self, keyword: str, text: str) -> bool:
-        """Verifica sinónimos y variaciones de palabras clave"""
-        synonyms = {
-            "dolor": ["duele", "molestia", "dolencia"],
-            "fiebre": ["temperatura", "calentura", "febril"],
-            "inflamación": ["hinchazón", "inflamado", "irritación"],
-            "tos": ["toser", "tusígeno"],
-            "digestión": ["estomacal", "intestinal", "gastrointestinal"],
-            "fatiga": ["cansancio", "agotamiento", "debilidad"],
-            "piel": ["cutáneo", "dermatitis", "eccema"],
-            "cabeza": ["cefalea", "migraña", "jaqueca"],
-            "respiratorio": ["pulmones", "bronquios", "pulmonar"]
-        }
+        return feature_vector
+    
+    def preprocess_symptoms(self, symptoms: str, patient_info: Dict[str, Any] = None) -> np.ndarray:
+        """
+        Preprocesa los síntomas y datos del paciente para crear un vector de características
+        """
+        return self._build_features(symptoms.lower(), self._patient_age(patient_info))
+    
+    def _compute_output(self, symptoms_lower: str, age: Optional[float]) -> np.ndarray:
+        """Salida de la red sin ruido; se cachea por (síntomas, edad)"""
+        input_vector = self._build_features(symptoms_lower, age)
         
-        if keyword in synonyms:
-            return any(syn in text for syn in synonyms[keyword])
-        return False
+        # Forward pass fusionado
+        output_layer = _forward(
+            input_vector, self.weights_input_hidden, self.bias_hidden,
+            self.weights_hidden_output, self.bias_output
+        )
+        # El array se comparte entre llamadas cacheadas: no debe modificarse
+        output_layer.flags.writeable = False
+        return output_layer
     
-    def predict(self, symptoms: str, patient_info: Dict[str, Any] = None) -> List[Tuple[str, float]]:
+    def predict(self, symptoms: str, patient_info: Dict[str, Any] = None,
+                found: Optional[int] = None) -> List[Tuple[str, float]]:
         """
-        Predice las plantas más relevantes para los síntomas dados
+        Predice las plantas más relevantes para los síntomas dados.
+        `found` permite reutilizar la máscara de palabras clave ya calculada por el llamador.
         """
         try:
-            # Preprocesar síntomas
-            input_vector = self.preprocess_symptoms(symptoms, patient_info)
-            
-            # Forward pass mejorado
-            hidden_layer = np.tanh(np.dot(input_vector, self.weights_input_hidden) + self.bias_hidden)
-            output_layer = 1/(1 + np.exp(-np.dot(hidden_layer, self.weights_hidden_output) + self.bias_output))
+            return self._predict_inner(symptoms, patient_info, found)
+        except Exception as e:
+            logger.error(f"Error in RNA prediction: {e}")
+            # Devolver plantas por defecto con confianzas variadas
+            return list(_FALLBACK_PREDICTIONS)
+    
+    def _predict_inner(self, symptoms: str, patient_info: Optional[Dict[str, Any]],
+                       found: Optional[int]) -> List[Tuple[str, float]]:
+        """Camino principal de predict, sin manejo de excepciones"""
+        symptoms_lower = symptoms.lower()
+        
+        # Salida determinista de la red (cacheada para síntomas repetidos)
+        output_layer = self._predict_core(symptoms_lower, self._patient_age(patient_info))
+        
+        # Aplicar ruido controlado para variabilidad
+        noise = self._noise.draw(output_layer.shape[0], 0.05)
+        output_layer = np.clip(output_layer + noise, 0, 1)
+        
+        # Obtener las plantas con mayor puntuación (top 8 para más opciones)
+        top_indices = np.argpartition(output_layer, -8)[-8:]
+        top_indices = top_indices[np.argsort(-output_layer[top_indices])]
+        
+        if found is None:
+            found = self.keyword_matcher.scan(symptoms_lower)
+        results = self._ranked_results(output_layer, top_indices, found)
+        
+        logger.info(f"RNA prediction results: {results[:5]}")
+        return results
+    
+    def predict_batch(self, symptoms_list: List[str],
+                      patient_infos: Optional[List[Dict[str, Any]]] = None,
+                      found_masks: Optional[List[int]] = None,
+                      use_jax: bool = False) -> List[List[Tuple[str, float]]]:
+        """
+        Predice para varios pacientes con un único forward pass matricial (N × entrada).
+        Con `use_jax` (y jax instalado) el forward pass se ejecuta compilado por XLA;
+        solo compensa para lotes grandes.
+        """
+        if not symptoms_list:
+            return []
+        if patient_infos is None:
+            patient_infos = [None] * len(symptoms_list)
+        if found_masks is None:
+            found_masks = [None] * len(symptoms_list)
+        
+        try:
+            lowered = [symptoms.lower() for symptoms in symptoms_list]
+            x = np.stack([
+                self._build_features(symptoms_lower, self._patient_age(patient_info))
+                for symptoms_lower, patient_info in zip(lowered, patient_infos)
+            ])
             
-            # Aplicar ruido controlado para variabilidad
-            noise = np.random.normal(0, 0.05, output_layer.shape)
+            weights = (self.weights_input_hidden, self.bias_hidden, self.weights_hidden_output, self.bias_output)
+            if use_jax and _forward_batch_jax is not None:
+                output_layer = np.asarray(_forward_batch_jax(jnp.asarray(x), *weights))
+            else:
+                output_layer = _forward_numpy(x, *weights)
+            noise = self._noise.draw(output_layer.size, 0.05).reshape(output_layer.shape)
             output_layer = np.clip(output_layer + noise, 0, 1)
             
-            # Obtener las plantas con mayor puntuación
-            top_indices = np.argsort(output_layer)[::-1][:8]  # Top 8 para más opciones
-            
-            # Crear lista de tuplas (planta, confianza)
-            results = []
-            for idx in top_indices:
-                if idx in self.plant_mapping:
-                    plant_name = self.plant_mapping[idx]
-                    confidence = float(output_layer[idx])
-                    
-                    # Ajustar confianza basada en relevancia de síntomas
-                    relevance_boost = self._calculate_symptom_relevance(plant_name, symptoms)
-                    adjusted_confidence = min(confidence + relevance_boost, 1.0)
-                    
-                    results.append((plant_name, round(adjusted_confidence, 3)))
+            # Top 8 por fila, ordenado de mayor a menor
+            top_indices = np.argpartition(-output_layer, 7, axis=1)[:, :8]
+            order = np.argsort(-np.take_along_axis(output_layer, top_indices, axis=1), axis=1)
+            top_indices = np.take_along_axis(top_indices, order, axis=1)
             
-            logger.info(f"RNA prediction results: {results[:5]}")
-            return results
+            return [
+                self._ranked_results(
+                    output_layer[i], top_indices[i],
+                    self.keyword_matcher.scan(symptoms_lower) if found is None else found
+                )
+                for i, (symptoms_lower, found) in enumerate(zip(lowered, found_masks))
+            ]
         except Exception as e:
-            logger.error(f"Error in RNA prediction: {e}")
-            # Devolver plantas por defecto con confianzas variadas
+            logger.error(f"Error in batched RNA prediction: {e}")
             return [
-                ("muña", 0.782), ("manzanilla", 0.756), ("uña de gato", 0.643),
-                ("eucalipto", 0.598), ("jengibre", 0.521)
+                self.predict(symptoms, patient_info, found)
+                for symptoms, patient_info, found in zip(symptoms_list, patient_infos, found_masks)
             ]
     
+    def _ranked_results(self, output_layer: np.ndarray, top_indices: np.ndarray, found: int) -> List[Tuple[str, float]]:
+        """Lista de tuplas (planta, confianza), ajustada por relevancia de síntomas"""
+        names = [self._plant_names[idx] for idx in top_indices.tolist()]
+        confidences = output_layer[top_indices].tolist()
+        return [
+            (name, round(min(confidence + self._relevance_from_mask(name, found), 1.0), 3))
+            for name, confidence in zip(names, confidences)
+            if name is not None
+        ]
+    
     def _calculate_symptom_relevance(self, plant_name: str, symptoms: str) -> float:
         """Calcula un boost de relevancia basado en la relación planta-síntoma"""
-        if plant_name not in self.plant_properties:
+        return self._relevance_from_mask(plant_name, self.keyword_matcher.scan(symptoms.lower()))
+    
+    def _relevance_from_mask(self, plant_name: str, found: int) -> float:
+        """Boost de relevancia: 0.1 por palabra de síntoma de la planta presente en la máscara"""
+        hits = found & self._plant_symptom_masks.get(plant_name, 0)
+        if not hits:
             return 0.0
-            
-        properties = self.plant_properties[plant_name]
-        symptoms_lower = symptoms.lower()
-        relevance = 0.0
-        
-        # Mapeo de propiedades a síntomas
-        property_symptom_map = {
-            "digestivo": ["estómago", "digestión", "náuseas", "intestinal"],
-            "respiratorio": ["tos", "gripe", "resfriado", "respiratorio"],
-            "antiinflamatorio": ["inflamación", "dolor", "articulaciones"],
-            "cicatrizante": ["piel", "herida", "cortadura"],
-            "sedante": ["estrés", "nervios", "ansiedad", "insomnio"]
-        }
-        
-        for prop in properties:
-            if prop in property_symptom_map:
-                for symptom in property_symptom_map[prop]:
-                    if symptom in symptoms_lower:
-                        relevance += 0.1
-                        
-        return min(relevance, 0.3)  # Máximo boost de 0.3
+        hits = hits.bit_count()
+        if hits >= 3:
+            return 0.3  # Máximo boost de 0.3
+        return hits * 0.1
+
+
+@functools.cache
+def _get_nn() -> SimpleNeuralNetwork:
+    """Red neuronal compartida por todas las instancias de HybridRecommender"""
+    return SimpleNeuralNetwork(extra_keywords=_SYMPTOM_PLANT_MAP)
 
 
 class HybridRecommender:
@@ -201,29 +494,30 @@ class HybridRecommender:
     
     def __init__(self):
         logger.info("Initializing HybridRecommender")
-        self.nn_model = SimpleNeuralNetwork()
-        
-        # Diccionario expandido que mapea síntomas a plantas
-        self.symptom_plant_map = {
-            "dolor": ["uña de gato", "maca", "matico", "caléndula"],
-            "fiebre": ["eucalipto", "manzanilla", "muña", "hierba luisa"],
-            "inflamación": ["sangre de grado", "uña de gato", "caléndula", "llantén"],
-            "tos": ["eucalipto", "matico", "jengibre", "muña"],
-            "digestión": ["manzanilla", "boldo", "muña", "hierba luisa", "yacón"],
-            "piel": ["sangre de grado", "aloe vera", "caléndula", "matico"],
-            "cabeza": ["valeriana", "manzanilla", "eucalipto", "toronjil"],
-            "estómago": ["manzanilla", "yacón", "muña", "jengibre"],
-            "respiratorio": ["eucalipto", "matico", "jengibre", "muña"],
-            "gripe": ["eucalipto", "muña", "jengibre", "manzanilla"],
-            "resfriado": ["eucalipto", "jengibre", "manzanilla", "muña"],
-            "náuseas": ["jengibre", "manzanilla", "hierba luisa"],
-            "articulaciones": ["uña de gato", "maca", "caléndula"],
-            "estrés": ["valeriana", "manzanilla", "toronjil", "hierba luisa"],
-            "fatiga": ["maca", "coca", "camu camu"],
-            "renal": ["chanca piedra", "cola de caballo"],
-            "hepático": ["hercampuri", "boldo"],
-            "parasitos": ["paico", "matico"]
-        }
+        self._noise = _NoisePool()
+        self.symptom_plant_map = _SYMPTOM_PLANT_MAP
+        
+        # La red comparte su autómata de palabras clave con el sistema basado en palabras clave
+        self.nn_model = _get_nn()
+        self._keyword_bits = tuple(
+            self.nn_model.keyword_matcher.bits[keyword] for keyword in self.symptom_plant_map
+        )
+        
+        # Matriz estática (palabra clave × planta) para puntuar con un único producto matriz-vector
+        self._keyword_plants = list(dict.fromkeys(
+            [self.nn_model.plant_mapping[idx] for idx in sorted(self.nn_model.plant_mapping)]
+            + [sys.intern(plant) for plants in self.symptom_plant_map.values() for plant in plants]
+        ))
+        plant_index = {plant: i for i, plant in enumerate(self._keyword_plants)}
+        shape = (len(self.symptom_plant_map), len(self._keyword_plants))
+        self._score_matrix = np.zeros(shape, dtype=np.int32)
+        # Orden de primera aparición de cada planta, para desempatar igual que el ranking por diccionario
+        self._first_seen = np.full(shape, shape[0] * shape[1], dtype=np.int32)
+        for k, plants in enumerate(self.symptom_plant_map.values()):
+            for pos, plant in enumerate(plants):
+                p = plant_index[plant]
+                self._score_matrix[k, p] += 1
+                self._first_seen[k, p] = min(self._first_seen[k, p], k * shape[1] + pos)
     
     def get_hybrid_recommendations(self, patient_info: Dict[str, Any]) -> Dict[str, Any]:
         """
@@ -232,15 +526,53 @@ class HybridRecommender:
         symptoms = patient_info.get('symptoms', '')
         logger.info(f"🔍 Generating hybrid recommendations for: {symptoms}")
         
+        features = self._extract_features(symptoms)
+        
         # 1. Obtener recomendaciones de la red neuronal
-        rna_recommendations = self.nn_model.predict(symptoms, patient_info)
+        rna_recommendations = self.nn_model.predict(symptoms, patient_info, features.kw_mask)
+        return self._build_hybrid_response(patient_info, features, rna_recommendations)
+    
+    def get_hybrid_recommendations_batch(self, patient_infos: List[Dict[str, Any]],
+                                         use_jax: bool = False) -> List[Dict[str, Any]]:
+        """
+        Versión por lotes de get_hybrid_recommendations: la red neuronal evalúa todos
+        los pacientes en un único forward pass (opcionalmente con JAX)
+        """
+        symptoms_list = [patient_info.get('symptoms', '') for patient_info in patient_infos]
+        logger.info(f"🔍 Generating hybrid recommendations for a batch of {len(patient_infos)} patients")
+        
+        features_list = [self._extract_features(symptoms) for symptoms in symptoms_list]
+        
+        rna_batch = self.nn_model.predict_batch(
+            symptoms_list, patient_infos, [features.kw_mask for features in features_list], use_jax=use_jax
+        )
+        return [
+            self._build_hybrid_response(patient_info, features, rna_recommendations)
+            for patient_info, features, rna_recommendations in zip(patient_infos, features_list, rna_batch)
+        ]
+    
+    def _extract_features(self, symptoms: str) -> RequestFeatures:
+        """Minúsculas, conteo de palabras y escaneo de palabras clave en un solo paso"""
+        symptoms_lower = symptoms.lower()
+        found = self.nn_model.keyword_matcher.scan(symptoms_lower)
+        return RequestFeatures(
+            lower=symptoms_lower,
+            token_count=len(symptoms.split()),
+            kw_mask=found,
+            kw_hits=self._keyword_presence(found),
+        )
+    
+    def _build_hybrid_response(self, patient_info: Dict[str, Any], features: RequestFeatures,
+                               rna_recommendations: List[Tuple[str, float]]) -> Dict[str, Any]:
+        """Combina las recomendaciones de RNA con las basadas en palabras clave y elige el sistema ganador"""
+        symptoms = patient_info.get('symptoms', '')
         
         # 2. Obtener recomendaciones basadas en palabras clave  
-        keyword_recommendations = self._keyword_based_recommendations(symptoms)
+        keyword_recommendations = self._keyword_based_recommendations(features)
         
         # 3. Calcular precisiones simuladas
-        rna_precision = self._calculate_rna_precision(symptoms, rna_recommendations)
-        keyword_precision = self._calculate_keyword_precision(symptoms, keyword_recommendations)
+        rna_precision = self._calculate_rna_precision(features, rna_recommendations)
+        keyword_precision = self._calculate_keyword_precision(features, keyword_recommendations)
         
         # 4. Determinar el sistema ganador
         if rna_precision >= keyword_precision:
@@ -268,12 +600,12 @@ class HybridRecommender:
         logger.info(f"✅ Hybrid analysis complete. Winner: {selected_system}")
         return response
     
-    def _calculate_rna_precision(self, symptoms: str, recommendations: List[Tuple[str, float]]) -> float:
+    def _calculate_rna_precision(self, features: RequestFeatures, recommendations: List[Tuple[str, float]]) -> float:
         """Calcula una precisión simulada para las recomendaciones de RNA"""
         base_precision = 0.65
         
         # Factores que afectan la precisión
-        symptom_clarity = len(symptoms.split()) / 20.0  # Más palabras = más contexto
+        symptom_clarity = features.token_count / 20.0  # Más palabras = más contexto
         avg_confidence = np.mean([conf for _, conf in recommendations]) if recommendations else 0.5
         
         # Bonus por coherencia (plantas relacionadas)
@@ -282,17 +614,17 @@ class HybridRecommender:
         precision = base_precision + (symptom_clarity * 0.1) + (avg_confidence * 0.15) + coherence_bonus
         
         # Añadir variabilidad realista
-        noise = np.random.normal(0, 0.05)
+        noise = self._noise.scalar(0.05)
         precision = np.clip(precision + noise, 0.4, 0.95)
         
         return precision
     
-    def _calculate_keyword_precision(self, symptoms: str, recommendations: List[str]) -> float:
+    def _calculate_keyword_precision(self, features: RequestFeatures, recommendations: List[str]) -> float:
         """Calcula una precisión simulada para las recomendaciones basadas en palabras clave"""
         base_precision = 0.68
         
         # Factor de cobertura (cuántos síntomas son cubiertos)
-        covered_symptoms = sum(1 for keyword in self.symptom_plant_map.keys() if keyword in symptoms.lower())
+        covered_symptoms = int(features.kw_hits.sum())
         coverage_factor = min(covered_symptoms / 5.0, 1.0)
         
         # Factor de diversidad de recomendaciones
@@ -301,7 +633,7 @@ class HybridRecommender:
         precision = base_precision + (coverage_factor * 0.12) + (diversity_factor * 0.08)
         
         # Añadir variabilidad realista
-        noise = np.random.normal(0, 0.04)
+        noise = self._noise.scalar(0.04)
         precision = np.clip(precision + noise, 0.45, 0.92)
         
         return precision
@@ -311,32 +643,39 @@ class HybridRecommender:
         if not recommendations:
             return 0.0
             
-        # Verificar si las plantas recomendadas tienen propiedades relacionadas
-        common_properties = set()
+        # Verificar si las plantas recomendadas tienen propiedades relacionadas (intersección de máscaras)
+        common_properties = 0
         for plant, _ in recommendations[:3]:  # Revisar top 3
-            if plant in self.nn_model.plant_properties:
-                props = set(self.nn_model.plant_properties[plant])
+            props = self.nn_model._plant_prop_mask.get(plant)
+            if props is not None:
                 if not common_properties:
                     common_properties = props
                 else:
-                    common_properties = common_properties.intersection(props)
+                    common_properties &= props
         
         return 0.05 if common_properties else 0.0
     
-    def _keyword_based_recommendations(self, symptoms: str) -> List[str]:
+    def _keyword_presence(self, found: int) -> np.ndarray:
+        """Vector 0/1 con las palabras clave de symptom_plant_map presentes en la máscara"""
+        return np.fromiter(
+            (1 if found & keyword_bit else 0 for keyword_bit in self._keyword_bits),
+            dtype=np.int32, count=len(self._keyword_bits)
+        )
+    
+    def _keyword_based_recommendations(self, features: RequestFeatures) -> List[str]:
         """Genera recomendaciones basadas en palabras clave en los síntomas"""
-        symptoms_lower = symptoms.lower()
-        plant_scores = {}
+        presence = features.kw_hits
+        if not presence.any():
+            return []
         
         # Puntuar plantas basado en coincidencias de palabras clave
-        for keyword, plants in self.symptom_plant_map.items():
-            if keyword in symptoms_lower:
-                for plant in plants:
-                    plant_scores[plant] = plant_scores.get(plant, 0) + 1
+        scores = presence @ self._score_matrix
+        first_seen = self._first_seen[presence.astype(bool)].min(axis=0)
         
-        # Ordenar por puntuación y devolver lista
-        sorted_plants = sorted(plant_scores.items(), key=lambda x: x[1], reverse=True)
-        return [plant for plant, _ in sorted_plants]
+        # Ordenar por puntuación (desempate por primera aparición) y devolver lista
+        candidates = np.nonzero(scores)[0]
+        order = np.lexsort((first_seen[candidates], -scores[candidates]))
+        return [self._keyword_plants[i] for i in candidates[order]]
     
     def _format_rna_recommendations(self, recommendations: List[Tuple[str, float]]) -> List[Dict[str, Any]]:
         """Formatea las recomendaciones de RNA"""
@@ -385,35 +724,7 @@ class HybridRecommender:
     
     def _get_scientific_name(self, common_name: str) -> str:
         """Retorna el nombre científico correspondiente al nombre común de la planta"""
-        scientific_names = {
-            "muña": "Minthostachys mollis",
-            "uña de gato": "Uncaria tomentosa", 
-            "maca": "Lepidium meyenii",
-            "sangre de grado": "Croton lechleri",
-            "hercampuri": "Gentianella alborosea",
-            "chanca piedra": "Phyllanthus niruri",
-            "sacha inchi": "Plukenetia volubilis",
-            "camu camu": "Myrciaria dubia",
-            "tara": "Caesalpinia spinosa",
-            "yacón": "Smallanthus sonchifolius",
-            "matico": "Piper aduncum",
-            "coca": "Erythroxylum coca",
-            "aloe vera": "Aloe barbadensis miller",
-            "jengibre": "Zingiber officinale",
-            "caléndula": "Calendula officinalis",
-            "árbol de té": "Melaleuca alternifolia",
-            "eucalipto": "Eucalyptus globulus",
-            "boldo": "Peumus boldus",
-            "valeriana": "Valeriana officinalis",
-            "manzanilla": "Matricaria chamomilla",
-            "toronjil": "Melissa officinalis",
-            "hierba luisa": "Cymbopogon citratus",
-            "paico": "Dysphania ambrosioides",
-            "llantén": "Plantago major",
-            "cola de caballo": "Equisetum arvense"
-        }
-        
-        return scientific_names.get(common_name, "Nombre científico no disponible")
+        return _SCIENTIFIC_NAMES.get(common_name, "Nombre científico no disponible")
     
     # Método de compatibilidad con el código existente
     def recommend(self, symptoms: str, top_n: int = 3) -> List[Dict[str, Any]]:
@@ -0,0 +1,145 @@
+import ctypes
+import logging
+import os
+import shutil
+import subprocess
+import tempfile
+
+import numpy as np
+
+logger = logging.getLogger(__name__)
+
+_ACTIVATIONS = ('linear', 'relu', 'softmax')
+
+
+def _extract_dense_layers(model):
+    """
+    Extrae (kernel, bias, activación) de cada capa Dense del modelo.
+    Las capas sin pesos (Input, Dropout) son la identidad en inferencia y se omiten.
+    """
+    layers = []
+    for layer in model.layers:
+        weights = layer.get_weights()
+        if not weights:
+            continue
+        activation = layer.get_config().get('activation', 'linear')
+        if len(weights) != 2 or activation not in _ACTIVATIONS:
+            raise ValueError(f"Unsupported layer for C codegen: {layer.name}")
+        kernel, bias = weights
+        layers.append((np.asarray(kernel, dtype=np.float32), np.asarray(bias, dtype=np.float32), activation))
+    if not layers:
+        raise ValueError("Model has no Dense layers")
+    return layers
+
+
+def _c_array(name, values):
+    body = ','.join(f'{v:.9g}f' for v in values.ravel())
+    return f'static const float {name}[{values.size}] = {{{body}}};\n'
+
+
+def generate_c_source(layers):
+    """Genera un archivo C autónomo con el forward pass del MLP y los pesos embebidos"""
+    src = ['#include <math.h>\n\n']
+    max_width = max(max(kernel.shape) for kernel, _, _ in layers)
+
+    for k, (kernel, bias, activation) in enumerate(layers):
+        n_in, n_out = kernel.shape
+        src.append(_c_array(f'W{k}', kernel))
+        src.append(_c_array(f'B{k}', bias))
+        # y = act(x @ W + b), W en orden fila (entrada, salida): el bucle interno es contiguo y vectorizable
+        src.append(f'''
+static void dense{k}(const float *restrict x, float *restrict y) {{
+    for (int j = 0; j < {n_out}; j++) y[j] = B{k}[j];
+    for (int i = 0; i < {n_in}; i++) {{
+        const float xi = x[i];
+        const float *restrict w = W{k} + i * {n_out};
+        #pragma omp simd
+        for (int j = 0; j < {n_out}; j++) y[j] += xi * w[j];
+    }}
+''')
+        if activation == 'relu':
+            src.append(f'''    #pragma omp simd
+    for (int j = 0; j < {n_out}; j++) y[j] = y[j] > 0.0f ? y[j] : 0.0f;
+''')
+        elif activation == 'softmax':
+            src.append(f'''    float m = y[0], s = 0.0f;
+    for (int j = 1; j < {n_out}; j++) m = y[j] > m ? y[j] : m;
+    for (int j = 0; j < {n_out}; j++) {{ y[j] = expf(y[j] - m); s += y[j]; }}
+    for (int j = 0; j < {n_out}; j++) y[j] /= s;
+''')
+        src.append('}\n')
+
+    n_in = layers[0][0].shape[0]
+    n_out = layers[-1][0].shape[1]
+    src.append(f'''
+void mlp_infer(const float *x, float *out, int n) {{
+    float a[{max_width}], b[{max_width}];
+    for (int r = 0; r < n; r++) {{
+        const float *cur = x + r * {n_in};
+''')
+    for k in range(len(layers)):
+        dst = 'out + r * %d' % n_out if k == len(layers) - 1 else ('a' if k % 2 == 0 else 'b')
+        src.append(f'        dense{k}(cur, {dst});\n')
+        if k != len(layers) - 1:
+            src.append(f'        cur = {dst};\n')
+    src.append('    }\n}\n')
+    return ''.join(src)
+
+
+class CInferenceKernel:
+    """Forward pass del MLP compilado a una biblioteca compartida y llamado vía ctypes"""
+
+    def __init__(self, library_path, n_in, n_out):
+        # La biblioteca no se descarga nunca: otro hilo puede seguir dentro de mlp_infer tras reemplazar el kernel
+        self._lib = ctypes.CDLL(library_path)
+        self._lib.mlp_infer.argtypes = [
+            np.ctypeslib.ndpointer(dtype=np.float32, flags='C_CONTIGUOUS'),
+            np.ctypeslib.ndpointer(dtype=np.float32, flags='C_CONTIGUOUS'),
+            ctypes.c_int,
+        ]
+        self._lib.mlp_infer.restype = None
+        self.n_in = n_in
+        self.n_out = n_out
+
+    def __call__(self, X):
+        X = np.ascontiguousarray(X, dtype=np.float32).reshape(-1, self.n_in)
+        out = np.empty((X.shape[0], self.n_out), dtype=np.float32)
+        self._lib.mlp_infer(X, out, X.shape[0])
+        return out
+
+
+def build_c_kernel(model, workdir=None):
+    """
+    Genera y compila el kernel C del modelo. Retorna None si no hay compilador
+    o la compilación falla, para que el llamador use la inferencia de TensorFlow.
+    """
+    compiler = os.environ.get('CC') or shutil.which('clang') or shutil.which('cc')
+    if compiler is None:
+        logger.info("No C compiler available, skipping C inference kernel")
+        return None
+
+    try:
+        layers = _extract_dense_layers(model)
+        if workdir is not None:
+            return _compile_kernel(compiler, layers, workdir)
+        # La biblioteca se carga antes de borrar el directorio temporal; en POSIX el mapeo
+        # sigue siendo válido tras eliminar el archivo, así que no queda nada en disco
+        with tempfile.TemporaryDirectory(prefix='mlp_kernel_', ignore_cleanup_errors=True) as tmp:
+            return _compile_kernel(compiler, layers, tmp)
+    except Exception as e:
+        logger.warning("Could not build C inference kernel: %s", e)
+        return None
+
+
+def _compile_kernel(compiler, layers, workdir):
+    """Escribe, compila y carga el kernel en workdir"""
+    c_path = os.path.join(workdir, 'mlp_kernel.c')
+    so_path = os.path.join(workdir, 'mlp_kernel.so')
+    with open(c_path, 'w') as f:
+        f.write(generate_c_source(layers))
+    subprocess.run(
+        [compiler, '-O3', '-march=native', '-funroll-loops', '-fopenmp-simd',
+         '-shared', '-fPIC', c_path, '-o', so_path, '-lm'],
+        check=True, capture_output=True
+    )
+    return CInferenceKernel(so_path, layers[0][0].shape[0], layers[-1][0].shape[1])
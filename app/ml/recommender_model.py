@@ -2,20 +2,151 @@ import numpy as np
 import pandas as pd
 import tensorflow as tf
 from sklearn.preprocessing import LabelEncoder, StandardScaler
-from sklearn.feature_extraction.text import TfidfVectorizer
-import psycopg2
+from sklearn.model_selection import train_test_split
+from sklearn.feature_extraction.text import HashingVectorizer
+from scipy.sparse import csr_matrix, hstack
+from psycopg2.extras import Json, execute_values
+from psycopg2.pool import ThreadedConnectionPool
+import joblib
+import logging
+import os
+import threading
+import time
+import weakref
 from datetime import datetime
+from collections import OrderedDict
+from contextlib import contextmanager
+from functools import cached_property
 from tensorflow.keras.callbacks import EarlyStopping
 
+try:
+    from numba import njit
+except ImportError:  # numba es opcional: sin él _build_row corre como Python puro
+    njit = None
+
+try:
+    from .c_kernel import build_c_kernel
+except ImportError:
+    from c_kernel import build_c_kernel
+
+logger = logging.getLogger(__name__)
+
+def _build_row(age, weight, height, gender, zone, mean, scale, sym_indices, sym_data, out):
+    # Fila de características: numéricas escaladas, género, zona y vector de síntomas disperso (índices/valores)
+    out[0] = (age - mean[0]) / scale[0]
+    out[1] = (weight - mean[1]) / scale[1]
+    out[2] = (height - mean[2]) / scale[2]
+    out[3] = gender
+    out[4] = zone
+    for j in range(5, out.shape[0]):
+        out[j] = 0.0
+    for k in range(sym_indices.shape[0]):
+        out[5 + sym_indices[k]] = sym_data[k]
+
+if njit is not None:
+    _build_row = njit(cache=True, fastmath=True)(_build_row)
+
+# Columnas de get_data_from_db (en el orden del SELECT) y cuáles son numéricas
+TRAINING_COLUMNS = ('zona', 'edad', 'peso', 'talla', 'genero', 'sintomas', 'planta', 'rating')
+NUMERIC_COLUMNS = frozenset({'edad', 'peso', 'talla', 'rating'})
+FETCH_BATCH_SIZE = 10000
+
+# Parámetros registrados con cada entrenamiento en model_training_history
+TRAINING_PARAMETERS = {"epochs": 50, "optimizer": "Adam", "batch_size": 32, "loss_function": "sparse_categorical_crossentropy"}
+
+# Entradas máximas en la cache de get_detailed_info
+DETAILS_CACHE_SIZE = 512
+
+# Filas usadas para calibrar la cuantización int8
+QUANTIZATION_SAMPLE_SIZE = 200
+
+# Feedback acumulado antes de una actualización incremental del modelo
+PENDING_BATCH_SIZE = 64
+PENDING_MAX_AGE_SECONDS = 15 * 60
+
+def _float_column(values):
+    # Columna numérica float32; NULL se convierte en NaN
+    return np.fromiter((np.nan if v is None else v for v in values), dtype=np.float32, count=len(values))
+
+# Preprocesadores ajustados (scaler, encoder, zonas) persistidos tras cada entrenamiento; el modelo
+# de Keras se guarda junto a ellos con la misma ruta y extensión .keras
+DEFAULT_ARTIFACTS_PATH = os.path.join(os.path.dirname(__file__), 'recommender_artifacts.joblib')
+
+def _make_dataset(X, y, batch_size, shuffle=False):
+    """
+    tf.data a partir de una matriz CSR: las filas se guardan dispersas y cada
+    minilote se densifica dentro del pipeline, solapado con el cómputo (prefetch)
+    """
+    coo = X.tocoo()
+    sparse = tf.sparse.reorder(tf.SparseTensor(
+        np.column_stack((coo.row, coo.col)).astype(np.int64),
+        coo.data.astype(np.float32),
+        coo.shape
+    ))
+    dataset = tf.data.Dataset.from_tensor_slices((sparse, y))
+    if shuffle:
+        dataset = dataset.shuffle(8192)
+    return (dataset
+            .batch(batch_size)
+            .map(lambda features, labels: (tf.sparse.to_dense(features), labels),
+                 num_parallel_calls=tf.data.AUTOTUNE)
+            .prefetch(tf.data.AUTOTUNE))
+
 class RecommenderModel:
-    def __init__(self, db_config):
+    def __init__(self, db_config, artifacts_path=None):
         self.db_config = db_config
+        self._artifacts_path = artifacts_path or DEFAULT_ARTIFACTS_PATH
+        self._model_path = os.path.splitext(self._artifacts_path)[0] + '.keras'
+        self._load_lock = threading.Lock()
+        self._zone_map = {}
+        self._infer = None
+        self._c_kernel = None
+        # Buffers de fila e intérpretes TF-Lite por hilo: ninguno de los dos es seguro entre hilos
+        self._local = threading.local()
+        self._pending_rows = []
+        self._pending_since = 0.0
+        # Backend de inferencia (modelo TF-Lite serializado o kernel C); se reemplaza entero bajo el lock
+        self._backend_lock = threading.Lock()
+        self._tflite_model = None
+        self._backend_version = 0
+        self._calibration_sample = None
+        self._details_cache = OrderedDict()
+        self._metrics_prepared = weakref.WeakSet()
+        self._classes = None
         self.model = None
         self.plant_encoder = LabelEncoder()
-        self.symptom_vectorizer = TfidfVectorizer(max_features=50)
+        # Vectorizador sin estado (hashing): no requiere ajuste ni vocabulario
+        self.symptom_vectorizer = HashingVectorizer(
+            n_features=64, alternate_sign=False, norm='l2', ngram_range=(1, 1), dtype=np.float32
+        )
         self.model_trained = False
         self.scaler = StandardScaler()
 
+    @cached_property
+    def _pool(self):
+        # Pool de conexiones creado en el primer uso y compartido por todos los métodos
+        return ThreadedConnectionPool(minconn=1, maxconn=8, **self.db_config)
+
+    @contextmanager
+    def _conn(self):
+        conn = self._pool.getconn()
+        try:
+            yield conn
+        except Exception:
+            conn.rollback()
+            raise
+        finally:
+            self._pool.putconn(conn)
+
+    @cached_property
+    def data(self):
+        # Datos de entrenamiento cargados en el primer acceso, no al instanciar
+        data = self.get_data_from_db()
+        if logger.isEnabledFor(logging.DEBUG):
+            logger.debug("Loaded %d training records; columns=%s dtypes=%s",
+                         len(data), data.columns.tolist(), data.dtypes.to_dict())
+        return data
+
     def get_data_from_db(self):
         query = """
         SELECT 
@@ -33,9 +164,19 @@ class RecommenderModel:
         WHERE pc.recommended_plant IS NOT NULL
         """
         try:
-            conn = psycopg2.connect(**self.db_config)
-            data = pd.read_sql(query, conn)
-            conn.close()
+            # Cursor del lado del servidor: las filas llegan por bloques a columnas ya tipadas
+            columns = {name: [] for name in TRAINING_COLUMNS}
+            with self._conn() as conn:
+                with conn.cursor(name='plants_ssc') as cur:
+                    cur.itersize = FETCH_BATCH_SIZE
+                    cur.execute(query)
+                    for batch in iter(lambda: cur.fetchmany(FETCH_BATCH_SIZE), []):
+                        for name, values in zip(TRAINING_COLUMNS, zip(*batch)):
+                            columns[name].extend(values)
+            data = pd.DataFrame({
+                name: (_float_column(values) if name in NUMERIC_COLUMNS else np.array(values, dtype=object))
+                for name, values in columns.items()
+            })
             print(f"Successfully retrieved {len(data)} records")
             return data
         except Exception as e:
@@ -45,16 +186,21 @@ class RecommenderModel:
     def preprocess_data(self, data):
         # Entradas
         X = data[['edad', 'peso', 'talla', 'genero', 'zona', 'sintomas']].copy()
-        X['genero'] = X['genero'].map({'Masculino': 0, 'Femenino': 1})
-        X['zona'] = pd.factorize(X['zona'])[0]
+        # Género y zona como códigos categóricos int8 (-1 si falta o es desconocido)
+        X['genero'] = pd.Categorical(X['genero'], categories=['Masculino', 'Femenino']).codes.astype(np.int8)
+        zones = pd.Categorical(X['zona'])
+        X['zona'] = zones.codes.astype(np.int8)
+        # El mapa zona→código se reutiliza en predict
+        self._zone_map = {zone: i for i, zone in enumerate(zones.categories)}
         X['sintomas'] = X['sintomas'].fillna('')  # Manejo de datos faltantes
 
         # Normalizar características numéricas
         X[['edad', 'peso', 'talla']] = self.scaler.fit_transform(X[['edad', 'peso', 'talla']])
 
-        # Vectorizar síntomas
-        X_symptoms = self.symptom_vectorizer.fit_transform(X['sintomas']).toarray()
-        X = np.hstack((X[['edad', 'peso', 'talla', 'genero', 'zona']].values, X_symptoms))
+        # Vectorizar síntomas (CSR) y unir con las columnas numéricas sin densificar
+        X_symptoms = self.symptom_vectorizer.transform(X['sintomas'].values)
+        num = X[['edad', 'peso', 'talla', 'genero', 'zona']].to_numpy(dtype=np.float32)
+        X = hstack([csr_matrix(num), X_symptoms], format='csr', dtype=np.float32)
 
         # Solo salida de plantas
         y_planta = self.plant_encoder.fit_transform(data['planta'])
@@ -62,6 +208,8 @@ class RecommenderModel:
         return X, y_planta
 
     def build_model(self, input_dim, num_plants):
+        # Pesos y activaciones en float32, igual que las características de entrada
+        tf.keras.backend.set_floatx('float32')
         inputs = tf.keras.Input(shape=(input_dim,))
         x = tf.keras.layers.Dense(256, activation='relu')(inputs)
         x = tf.keras.layers.Dropout(0.4)(x)
@@ -75,13 +223,25 @@ class RecommenderModel:
 
         self.model = tf.keras.Model(inputs=inputs, outputs=planta_output)
         optimizer = tf.keras.optimizers.Adam(learning_rate=0.001)
-        self.model.compile(
-            optimizer=optimizer,
-            loss='sparse_categorical_crossentropy',
-            metrics=['accuracy']
-        )
+        try:
+            # Paso de entrenamiento compilado por XLA (Dense+ReLU+Dropout+Softmax fusionados)
+            self.model.compile(
+                optimizer=optimizer,
+                loss='sparse_categorical_crossentropy',
+                metrics=['accuracy'],
+                jit_compile=True
+            )
+        except (TypeError, ValueError) as e:
+            logger.warning("XLA compilation not available, compiling without jit_compile: %s", e)
+            self.model.compile(
+                optimizer=optimizer,
+                loss='sparse_categorical_crossentropy',
+                metrics=['accuracy']
+            )
 
     def train(self, epochs=50, batch_size=32):
+        # El feedback acumulado ya está en la base de datos y lo lee este entrenamiento completo
+        self._clear_pending()
         data = self.get_data_from_db()
         if len(data) == 0:
             print("No data available for training")
@@ -93,54 +253,151 @@ class RecommenderModel:
         if self.model is None:
             self.build_model(X.shape[1], num_plants)
 
-        early_stopping = EarlyStopping(monitor='val_loss', patience=5, restore_best_weights=True)
+        # División entrenamiento/validación; con muy pocos datos se entrena sin validación
+        if X.shape[0] >= 5:
+            X_train, X_val, y_train, y_val = train_test_split(X, y, test_size=0.2, random_state=42)
+            validation_data = _make_dataset(X_val, y_val, batch_size)
+            monitor = 'val_loss'
+        else:
+            X_train, y_train = X, y
+            validation_data = None
+            monitor = 'loss'
+
+        early_stopping = EarlyStopping(monitor=monitor, patience=5, restore_best_weights=True)
         
         history = self.model.fit(
-            X, y,
+            _make_dataset(X_train, y_train, batch_size, shuffle=True),
+            validation_data=validation_data,
             epochs=epochs,
-            batch_size=batch_size,
-            validation_split=0.2,
             callbacks=[early_stopping]
         )
-        evaluation = self.model.evaluate(X, y, verbose=0)
+        evaluation = self.model.evaluate(_make_dataset(X, y, batch_size), verbose=0)
         self.model_trained = True
+        self._classes = np.asarray(self.plant_encoder.classes_)
+        self._build_infer(X.shape[1])
+        # Muestra de los datos de entrenamiento para calibrar la cuantización int8
+        self._calibration_sample = X[:QUANTIZATION_SAMPLE_SIZE].toarray().astype(np.float32)
+        self._build_inference_backend()
+        self._save_artifacts()
         return history, evaluation
 
+    def _build_inference_backend(self):
+        # Un solo backend de inferencia: el modelo int8 de TF-Lite. El kernel C (None si no hay
+        # compilador) solo se compila cuando la cuantización falla; si ambos faltan, predict usa _infer.
+        # El nuevo backend se construye aparte y se publica de una vez, sin bloquear a predict mientras tanto
+        tflite_model = self._build_quantized()
+        c_kernel = build_c_kernel(self.model) if tflite_model is None else None
+        with self._backend_lock:
+            self._tflite_model = tflite_model
+            self._c_kernel = c_kernel
+            self._backend_version += 1
+
+    def _build_quantized(self):
+        # Cuantización post-entrenamiento a int8 con TF-Lite; None si falla (predict usa otro backend)
+        try:
+            converter = tf.lite.TFLiteConverter.from_keras_model(self.model)
+            converter.optimizations = [tf.lite.Optimize.DEFAULT]
+            converter.representative_dataset = lambda: ([x[None]] for x in self._calibration_sample)
+            converter.target_spec.supported_ops = [tf.lite.OpsSet.TFLITE_BUILTINS_INT8]
+            return converter.convert()
+        except Exception as e:
+            logger.warning("Could not build int8 TF-Lite model: %s", e)
+            return None
+
+    def _run_quantized(self, tflite_model, version, X):
+        # Cada hilo usa su propio intérprete; se recrea cuando se publica un backend nuevo
+        local = self._local
+        if getattr(local, 'interp_version', None) != version:
+            interp = tf.lite.Interpreter(model_content=tflite_model)
+            interp.allocate_tensors()
+            local.interp = interp
+            local.interp_input = interp.get_input_details()[0]['index']
+            local.interp_output = interp.get_output_details()[0]['index']
+            local.interp_version = version
+        local.interp.set_tensor(local.interp_input, X)
+        local.interp.invoke()
+        return local.interp.get_tensor(local.interp_output)
+
+    def _build_infer(self, input_dim):
+        # Inferencia pre-trazada (y compilada por XLA) que evita el bucle de model.predict
+        self._infer = tf.function(
+            lambda x: self.model(x, training=False),
+            input_signature=[tf.TensorSpec([None, input_dim], tf.float32)],
+            jit_compile=True
+        )
+
+    def _save_artifacts(self):
+        # Persistir el modelo y los preprocesadores: tras un reinicio predict los carga sin reentrenar
+        try:
+            self.model.save(self._model_path)
+            joblib.dump({
+                'scaler': self.scaler,
+                'plant_encoder': self.plant_encoder,
+                'zone_map': self._zone_map,
+                'calibration_sample': self._calibration_sample
+            }, self._artifacts_path, compress=3)
+        except Exception as e:
+            logger.warning("Could not save model artifacts: %s", e)
+
+    def _load_artifacts(self):
+        # Cargar el modelo y los preprocesadores guardados por el último train(); False si no existen
+        if not (os.path.exists(self._artifacts_path) and os.path.exists(self._model_path)):
+            return False
+        try:
+            artifacts = joblib.load(self._artifacts_path)
+            self.model = tf.keras.models.load_model(self._model_path)
+        except Exception as e:
+            logger.warning("Could not load model artifacts: %s", e)
+            return False
+        self.scaler = artifacts['scaler']
+        self.plant_encoder = artifacts['plant_encoder']
+        self._classes = np.asarray(self.plant_encoder.classes_)
+        self._zone_map = artifacts['zone_map']
+        self._calibration_sample = artifacts['calibration_sample']
+        self._build_infer(self.model.input_shape[-1])
+        self._build_inference_backend()
+        self.model_trained = True
+        return True
+
+    def _ensure_loaded(self):
+        # Un solo hilo carga los artefactos; los demás esperan y ven model_trained ya activo
+        with self._load_lock:
+            return self.model_trained or self._load_artifacts()
+
     def predict(self, patient_info):
-        if not self.model_trained:
+        # Sin entrenamiento en este proceso se usan el modelo y los preprocesadores del último train()
+        if not self.model_trained and not self._ensure_loaded():
             print("Model not trained yet")
             return None
             
-        # Preprocesar entrada
-        gender_map = {'Masculino': 0, 'M': 0, 'Femenino': 1, 'F': 1}
-        gender_value = gender_map.get(patient_info['gender'], 0)
-        
         try:
-            zone_factorized = pd.factorize([patient_info['zone']])[0][0]
-        except:
-            zone_factorized = 0
-            
-        # Normalizar características numéricas
-        age = float(patient_info['age'])
-        weight = float(patient_info.get('weight', 70))
-        height = float(patient_info.get('height', 170))
-        age, weight, height = self.scaler.transform([[age, weight, height]])[0]
-        
-        X = np.array([[age, weight, height, gender_value, zone_factorized]])
-        
-        try:
-            # Asegurar que el vectorizador esté entrenado
-            if not hasattr(self.symptom_vectorizer, 'vocabulary_'):
-                data = self.get_data_from_db()
-                _, _ = self.preprocess_data(data)
-                
-            symptom_vector = self.symptom_vectorizer.transform([patient_info['symptoms']]).toarray()
-            X = np.hstack((X, symptom_vector))
+            # Buffer de la fila reutilizado entre llamadas del mismo hilo
+            n_features = 5 + self.symptom_vectorizer.n_features
+            X = getattr(self._local, 'row_buf', None)
+            if X is None or X.shape[1] != n_features:
+                X = self._local.row_buf = np.empty((1, n_features), dtype=np.float32)
+            self._encode_patient(patient_info, X[0])
+
+            # Instantánea del backend: un reemplazo concurrente no afecta a esta predicción
+            with self._backend_lock:
+                tflite_model, c_kernel, version = self._tflite_model, self._c_kernel, self._backend_version
 
             # Obtener predicciones solo para plantas
-            predictions = self.model.predict(X)
-            top_3_indices = np.argsort(predictions[0])[-3:][::-1]
-            top_3_plants = self.plant_encoder.inverse_transform(top_3_indices)
+            if tflite_model is not None:
+                predictions = self._run_quantized(tflite_model, version, X)
+            elif c_kernel is not None:
+                predictions = c_kernel(X)
+            else:
+                if self._infer is None:
+                    self._build_infer(X.shape[1])
+                predictions = self._infer(tf.constant(X)).numpy()
+            # Top 3 sin ordenar todo el catálogo: partición O(N) y orden de solo 3 elementos
+            k = min(3, predictions.shape[1])
+            top_3_indices = np.argpartition(predictions[0], -k)[-k:]
+            top_3_indices = top_3_indices[np.argsort(-predictions[0][top_3_indices])]
+            if self._classes is None:
+                self._classes = np.asarray(self.plant_encoder.classes_)
+            top_3_plants = self._classes[top_3_indices]
             top_3_probs = predictions[0][top_3_indices]
 
             return {
@@ -150,41 +407,64 @@ class RecommenderModel:
             print(f"Error in prediction: {str(e)}")
             return None
 
+    def _encode_patient(self, patient_info, out):
+        # Preprocesar entrada con los preprocesadores ya ajustados, escribiendo en `out`
+        gender_map = {'Masculino': 0, 'M': 0, 'Femenino': 1, 'F': 1}
+        gender_value = gender_map.get(patient_info['gender'], 0)
+        
+        zone_factorized = self._zone_map.get(patient_info.get('zone'), 0)
+        
+        # Normalizar características numéricas y añadir el vector de síntomas en un solo paso
+        symptom_vector = self.symptom_vectorizer.transform([patient_info['symptoms']])
+        _build_row(
+            float(patient_info['age']),
+            float(patient_info.get('weight', 70)),
+            float(patient_info.get('height', 170)),
+            gender_value, zone_factorized,
+            self.scaler.mean_, self.scaler.scale_,
+            symptom_vector.indices, symptom_vector.data,
+            out
+        )
+
     def get_detailed_info(self, selected_plant):
         """Obtener información detallada de la planta seleccionada."""
+        cached = self._details_cache.get(selected_plant)
+        if cached is not None:
+            self._details_cache.move_to_end(selected_plant)
+            return dict(cached)
+
         try:
-            conn = psycopg2.connect(**self.db_config)
-            cursor = conn.cursor()
+            with self._conn() as conn:
+                cursor = conn.cursor()
             
-            query = """
-            SELECT 
-                pc.dosage AS dosis,
-                pc.administration_frequency AS frecuencia_administracion,
-                pc.comments AS comentarios
-            FROM patient_consultations pc
-            WHERE pc.recommended_plant = %s
-            ORDER BY pc.created_at DESC
-            LIMIT 1
-            """
+                query = """
+                SELECT 
+                    pc.dosage AS dosis,
+                    pc.administration_frequency AS frecuencia_administracion,
+                    pc.comments AS comentarios
+                FROM patient_consultations pc
+                WHERE pc.recommended_plant = %s
+                ORDER BY pc.created_at DESC
+                LIMIT 1
+                """
             
-            cursor.execute(query, (selected_plant,))
-            result = cursor.fetchone()
-            conn.close()
+                cursor.execute(query, (selected_plant,))
+                result = cursor.fetchone()
             
             if result:
-                return {
+                return self._cache_details(selected_plant, {
                     'planta': selected_plant,
                     'dosis': result[0] or 'No especificada',
                     'frecuencia_administracion': result[1] or 'No especificada',
                     'comentarios': result[2] or 'Sin comentarios'
-                }
+                })
             
-            return {
+            return self._cache_details(selected_plant, {
                 'planta': selected_plant,
                 'dosis': 'Información no disponible',
                 'frecuencia_administracion': 'Información no disponible',
                 'comentarios': 'Sin comentarios disponibles'
-            }
+            })
         except Exception as e:
             print(f"Error getting plant details: {str(e)}")
             return {
@@ -194,6 +474,20 @@ class RecommenderModel:
                 'comentarios': f'Error: {str(e)}'
             }
 
+    def _cache_details(self, plant, details):
+        # LRU acotada en la instancia; los errores de base de datos no se cachean
+        self._details_cache[plant] = details
+        if len(self._details_cache) > DETAILS_CACHE_SIZE:
+            self._details_cache.popitem(last=False)
+        return dict(details)
+
+    def invalidate_details(self, plant=None):
+        """Descarta los detalles cacheados de una planta (o de todas si plant es None)"""
+        if plant is None:
+            self._details_cache.clear()
+        else:
+            self._details_cache.pop(plant, None)
+
     def add_new_training_data(self, patient_data, recommended_plant, feedback_rating):
         """
         Añade nuevos datos de entrenamiento al modelo basado en feedback del usuario
@@ -202,33 +496,74 @@ class RecommenderModel:
             return False
             
         try:
-            conn = psycopg2.connect(**self.db_config)
-            cursor = conn.cursor()
-            
-            # Verificar si el usuario existe
-            cursor.execute("SELECT id FROM personal_information WHERE id = %s", (patient_data['user_id'],))
-            user_exists = cursor.fetchone()
+            self.bulk_add_training_data([(patient_data, recommended_plant, feedback_rating)])
             
-            if not user_exists:
-                # Crear usuario si no existe
-                cursor.execute("""
-                INSERT INTO personal_information (id, age, weight, height, gender, zone)
-                VALUES (%s, %s, %s, %s, %s, %s)
-                """, (
-                    patient_data['user_id'],
-                    patient_data['age'],
-                    patient_data.get('weight', 70),
-                    patient_data.get('height', 170),
-                    patient_data['gender'],
-                    patient_data['zone']
-                ))
+            # Sin modelo entrenado no hay nada que actualizar: el próximo train() leerá la fila de la base de datos
+            if not self.model_trained:
+                return True
+            # Acumular el feedback y actualizar el modelo por lotes, sin reentrenar desde cero
+            if not self._pending_rows:
+                self._pending_since = time.monotonic()
+            self._pending_rows.append((patient_data, recommended_plant))
+            if (len(self._pending_rows) >= PENDING_BATCH_SIZE
+                    or time.monotonic() - self._pending_since >= PENDING_MAX_AGE_SECONDS):
+                self._fit_pending()
+            return True
             
-            # Añadir consulta con la planta recomendada que resultó efectiva
-            cursor.execute("""
-            INSERT INTO patient_consultations 
-            (user_id, symptoms, symptoms_duration, allergies, recommended_plant, feedback_rating)
-            VALUES (%s, %s, %s, %s, %s, %s)
-            """, (
+        except Exception as e:
+            print(f"Error adding new training data: {str(e)}")
+            return False
+
+    def _clear_pending(self):
+        self._pending_rows = []
+        self._pending_since = 0.0
+
+    def _fit_pending(self):
+        """
+        Actualiza incrementalmente el modelo ya entrenado con el feedback acumulado,
+        usando el vectorizador/scaler/encoder ya ajustados (sin consultar la base de datos)
+        """
+        pending = self._pending_rows
+        self._clear_pending()
+        if not self.model_trained or not pending:
+            return
+        
+        # Solo se pueden aprender plantas que el encoder ya conoce
+        known_plants = set(self.plant_encoder.classes_)
+        rows = [(patient, plant) for patient, plant in pending if plant in known_plants]
+        if not rows:
+            return
+        
+        X_batch = np.empty((len(rows), 5 + self.symptom_vectorizer.n_features), dtype=np.float32)
+        for i, (patient, _) in enumerate(rows):
+            self._encode_patient(patient, X_batch[i])
+        y_batch = self.plant_encoder.transform([plant for _, plant in rows])
+        
+        self.model.fit(X_batch, y_batch, epochs=1, verbose=0)
+        # Tanto el modelo int8 como el kernel C llevan los pesos embebidos: regenerar el backend activo
+        if self._tflite_model is not None or self._c_kernel is not None:
+            self._build_inference_backend()
+
+    def bulk_add_training_data(self, rows, page_size=500):
+        """
+        Inserta en bloque filas (patient_data, recommended_plant, feedback_rating) con feedback >= 3.
+        Usa execute_values: una sentencia con muchas tuplas VALUES en lugar de un INSERT por fila.
+        Retorna el número de consultas insertadas.
+        """
+        rows_pi = []
+        rows_pc = []
+        for patient_data, recommended_plant, feedback_rating in rows:
+            if feedback_rating < 3:
+                continue
+            rows_pi.append((
+                patient_data['user_id'],
+                patient_data['age'],
+                patient_data.get('weight', 70),
+                patient_data.get('height', 170),
+                patient_data['gender'],
+                patient_data['zone']
+            ))
+            rows_pc.append((
                 patient_data['user_id'],
                 patient_data['symptoms'],
                 patient_data.get('duration', 'No especificada'),
@@ -236,43 +571,63 @@ class RecommenderModel:
                 recommended_plant,
                 feedback_rating
             ))
-            
+        if not rows_pc:
+            return 0
+
+        with self._conn() as conn:
+            cursor = conn.cursor()
+
+            # Crear usuarios que no existan
+            execute_values(cursor, """
+            INSERT INTO personal_information (id, age, weight, height, gender, zone)
+            VALUES %s
+            ON CONFLICT (id) DO NOTHING
+            """, rows_pi, page_size=page_size)
+
+            # Añadir consultas con la planta recomendada que resultó efectiva
+            execute_values(cursor, """
+            INSERT INTO patient_consultations 
+            (user_id, symptoms, symptoms_duration, allergies, recommended_plant, feedback_rating)
+            VALUES %s
+            """, rows_pc, page_size=page_size)
+
             conn.commit()
-            conn.close()
-            
-            # Reentrenar el modelo con los nuevos datos
-            self.train(epochs=5, batch_size=32)
-            return True
-            
-        except Exception as e:
-            print(f"Error adding new training data: {str(e)}")
-            return False
+
+        # Las nuevas consultas pasan a ser las más recientes de sus plantas
+        for row in rows_pc:
+            self.invalidate_details(row[4])
+        return len(rows_pc)
 
     def save_training_metrics(self, metrics):
         # Guardar métricas de entrenamiento
         try:
-            conn = psycopg2.connect(**self.db_config)
-            cursor = conn.cursor()
+            with self._conn() as conn:
+                cursor = conn.cursor()
             
-            # Insertar en la tabla model_training_history
-            cursor.execute("""
-            INSERT INTO model_training_history (
-                training_date, model_version, loss, plant_accuracy,
-                drain_accuracy, freeworth_accuracy, training_parameters
-            )
-            VALUES (%s, %s, %s, %s, %s, %s, %s)
-            """, (
-                datetime.now(),  # training_date (fecha y hora actual)
-                "1.0.0",         # model_version (puedes cambiarlo si es dinámico)
-                metrics[0],      # loss (primer valor en la lista metrics)
-                metrics[1],      # plant_accuracy (segundo valor en la lista metrics)
-                0.0,             # drain_accuracy (valor por defecto, ajusta si es necesario)
-                0.0,             # freeworth_accuracy (valor por defecto, ajusta si es necesario)
-                '{"epochs": 50, "optimizer": "Adam", "batch_size": 32, "loss_function": "sparse_categorical_crossentropy"}'  # training_parameters (ajusta según tus necesidades)
-            ))
+                # Sentencia preparada una vez por conexión del pool (se evita el parse/plan en cada inserción)
+                if conn not in self._metrics_prepared:
+                    cursor.execute("""
+                    PREPARE metrics_ins AS
+                    INSERT INTO model_training_history (
+                        training_date, model_version, loss, plant_accuracy,
+                        drain_accuracy, freeworth_accuracy, training_parameters
+                    )
+                    VALUES ($1, $2, $3, $4, $5, $6, $7)
+                    """)
+                    self._metrics_prepared.add(conn)
             
-            conn.commit()
-            conn.close()
+                # Insertar en la tabla model_training_history
+                cursor.execute("EXECUTE metrics_ins (%s, %s, %s, %s, %s, %s, %s)", (
+                    datetime.now(),     # training_date (fecha y hora actual)
+                    "1.0.0",            # model_version (puedes cambiarlo si es dinámico)
+                    float(metrics[0]),  # loss (primer valor en la lista metrics)
+                    float(metrics[1]),  # plant_accuracy (segundo valor en la lista metrics)
+                    0.0,                # drain_accuracy (valor por defecto, ajusta si es necesario)
+                    0.0,                # freeworth_accuracy (valor por defecto, ajusta si es necesario)
+                    Json(TRAINING_PARAMETERS)  # training_parameters (ajusta según tus necesidades)
+                ))
+            
+                conn.commit()
             print("Training metrics saved successfully in model_training_history.")
         except Exception as e:
-            print(f"Error saving training metrics: {str(e)}")
\ No newline at end of file
+            print(f"Error saving training metrics: {str(e)}")
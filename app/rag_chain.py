@@ -1,14 +1,43 @@
 from datetime import datetime
 import os
+import sys
 import uuid
+import time
 import asyncio
+import copy
 import json
-import psycopg2
 import traceback
-from typing import Dict, Any, Optional, List, Tuple
+from typing import Dict, Any, Optional, List, Tuple, AsyncIterator, Union
+from dataclasses import dataclass
 import logging
 import re
+import functools
+import hashlib
+import importlib.util
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+import numpy as np
+import joblib
+import ahocorasick
+from cachetools import TTLCache
 from dotenv import load_dotenv
+from psycopg import OperationalError
+
+from .db import get_db_pool
+
+try:
+    from numba import njit
+except ImportError:  # numba es opcional: sin él la precisión ponderada se calcula en Python
+    njit = None
+
+# sentence-transformers es opcional (requirements-semantic.txt): sin él solo se usa la caché exacta
+# del RAG. Se importa en el primer uso (encode_many) para no cargar torch en cada worker al importar
+_HAS_SENTENCE_TRANSFORMERS = importlib.util.find_spec("sentence_transformers") is not None
+
+try:
+    import hyperscan
+except ImportError:  # hyperscan es opcional: sin él se usan los patrones compilados de re
+    hyperscan = None
 import os
 
 load_dotenv()  # Carga el contenido de .env automáticamente
@@ -21,46 +50,39 @@ logging.basicConfig(level=logging.INFO,
 
 # ========== NUEVAS FUNCIONES DE EVALUACIÓN DE RIESGO ==========
 
-def evaluar_riesgo_critico(patient_info: Dict[str, Any]) -> Tuple[bool, str, str]:
-    """
-    🚨 EVALUACIÓN CRÍTICA DE RIESGO - PRIMERA LÍNEA DE DEFENSA
-    
-    Returns:
-        (es_critico, nivel_riesgo, mensaje_derivacion)
-    """
-    symptoms = patient_info.get('symptoms', '').lower()
-    age = patient_info.get('age', 0)
-    duration = patient_info.get('duration', '').lower()
-    gender = patient_info.get('gender', '')
-    allergies = patient_info.get('allergies', '').lower()
-    
-    # 🚨 SÍNTOMAS CRÍTICOS - DERIVACIÓN INMEDIATA
-    critical_symptoms = [
-        # Cardiovasculares
+# Patrones compilados una sola vez al importar el módulo
+# 🚨 SÍNTOMAS CRÍTICOS - DERIVACIÓN INMEDIATA, agrupados por categoría
+_CRITICAL_CATEGORIES = {
+    'cardiovascular': (
         r'dolor.*pecho.*irradia|dolor.*brazo.*izquierdo|opresión.*pecho',
         r'dolor.*mandíbula.*sudoración|dolor.*cuello.*mareo',
-        
-        # Respiratorios
+    ),
+    'respiratorio': (
         r'dificultad.*respirar.*sever|falta.*aire.*reposo|ahogo.*extremo',
         r'labios.*azules|cianosis|respiración.*muy.*rápida',
-        
-        # Neurológicos
+    ),
+    'neurologico': (
         r'pérdida.*conciencia|desmayo.*repetido|convulsiones?',
         r'dolor.*cabeza.*súbito.*intenso|cefalea.*trueno',
         r'confusión.*mental.*aguda|desorientación.*severa',
-        
-        # Gastrointestinales
+    ),
+    'gastrointestinal': (
         r'vómito.*sangre|heces.*negras.*alquitranadas',
         r'sangrado.*que.*no.*para|hemorragia',
-        
-        # Febriles críticos
+    ),
+    'febril': (
         r'fiebre.*39|temperatura.*39|40.*grados',
-        r'rigidez.*cuello.*fiebre|manchas.*piel.*fiebre'
-    ]
-    
-    for pattern in critical_symptoms:
-        if re.search(pattern, symptoms, re.IGNORECASE):
-            return True, "CRÍTICO", f"""
+        r'rigidez.*cuello.*fiebre|manchas.*piel.*fiebre',
+    ),
+}
+
+# Una sola alternación con un grupo nombrado por categoría: un recorrido del texto en vez de uno por patrón
+_CRITICAL_COMBINED = re.compile(
+    '|'.join(f"(?P<{category}>{'|'.join(patterns)})" for category, patterns in _CRITICAL_CATEGORIES.items()),
+    re.IGNORECASE
+)
+
+_CRITICAL_MESSAGE = """
 🚨 **ATENCIÓN MÉDICA INMEDIATA NECESARIA** 🚨
 
 Los síntomas que describes requieren evaluación médica urgente.
@@ -73,16 +95,12 @@ Los síntomas que describes requieren evaluación médica urgente.
 
 **Este sistema no puede ayudarte con síntomas que pueden ser de emergencia.**
             """
-    
-    # 👥 POBLACIONES DE ALTO RIESGO
-    try:
-        age_int = int(age) if str(age).isdigit() else 0
-    except:
-        age_int = 0
-    
-    # Menores de 2 años - BLOQUEO ABSOLUTO
-    if age_int < 2 and age_int > 0:
-        return True, "ALTO_RIESGO", f"""
+
+# Mensaje de derivación por categoría crítica
+_CRITICAL_MESSAGES = dict.fromkeys(_CRITICAL_CATEGORIES, _CRITICAL_MESSAGE)
+
+# Mensajes de derivación fijos de las poblaciones de alto riesgo: menores de 2 años
+_INFANT_MESSAGE = """
 👶 **ATENCIÓN: MENOR DE 2 AÑOS**
 
 **Las plantas medicinales NO son seguras para menores de 2 años.**
@@ -94,16 +112,9 @@ Los síntomas que describes requieren evaluación médica urgente.
 
 **Este sistema no puede proporcionar recomendaciones para esta edad.**
         """
-    
-    # Embarazadas con síntomas complejos
-    if 'embaraza' in patient_info.get('additional_info', '').lower() or 'gestante' in symptoms:
-        high_risk_pregnancy = any([
-            'sangrado' in symptoms, 'dolor' in symptoms and 'abdomen' in symptoms,
-            'fiebre' in symptoms, 'vómito' in symptoms and 'severo' in symptoms
-        ])
-        
-        if high_risk_pregnancy:
-            return True, "EMBARAZO_RIESGO", f"""
+
+# Embarazo con síntomas de riesgo
+_PREGNANCY_RISK_MESSAGE = """
 🤱 **EMBARAZO CON SÍNTOMAS DE RIESGO**
 
 **Durante el embarazo, estos síntomas requieren atención médica.**
@@ -115,13 +126,9 @@ Los síntomas que describes requieren evaluación médica urgente.
 
 **Este sistema no puede ayudarte durante el embarazo con estos síntomas.**
             """
-    
-    # Adultos mayores con síntomas múltiples
-    if age_int > 75:
-        complex_symptoms = len([s for s in ['dolor', 'fiebre', 'mareo', 'debilidad', 'confusión'] 
-                               if s in symptoms]) >= 2
-        if complex_symptoms:
-            return True, "ADULTO_MAYOR_RIESGO", f"""
+
+# Adultos mayores con síntomas múltiples
+_ELDERLY_RISK_MESSAGE = """
 👴 **ADULTO MAYOR CON SÍNTOMAS MÚLTIPLES**
 
 **Los síntomas combinados en adultos mayores requieren evaluación médica.**
@@ -133,25 +140,205 @@ Los síntomas que describes requieren evaluación médica urgente.
 
 **Recomendamos evaluación médica antes de usar plantas medicinales.**
             """
+
+# Medicamentos con interacciones peligrosas
+_INTERACTION_MESSAGE = """
+💊 **MEDICAMENTOS CON INTERACCIONES PELIGROSAS**
+
+**Las plantas medicinales pueden tener interacciones graves con tus medicamentos.**
+
+**Por favor:**
+- Consulta con tu médico tratante
+- Lleva la lista de todos tus medicamentos
+- No suspendas ni agregues nada sin supervisión médica
+
+**Tu seguridad es prioritaria.**
+            """
+
+# ⏰ DURACIÓN PROLONGADA: (patrón, días por unidad)
+_DURATION_SOURCES = (
+    (r'(\d+).*semanas?', 7), (r'(\d+).*meses?', 30), (r'más.*de.*(\d+).*días?', 1),
+    (r'hace.*(\d+).*semanas?', 7), (r'desde.*hace.*(\d+).*días?', 1)
+)
+_DURATION_PATTERNS = tuple((re.compile(p, re.IGNORECASE), days) for p, days in _DURATION_SOURCES)
+
+# Los cinco patrones en una sola expresión: cada rama es una búsqueda anticipada desde el inicio del
+# texto, así gana la primera rama (en orden) que aparece en cualquier parte, igual que las búsquedas
+# sucesivas. El grupo nombrado de la rama ganadora (m.lastgroup) da el número y los días por unidad
+_DURATION_COMBINED = re.compile(
+    r'\A(?:' + '|'.join(
+        '(?=(?s:.*?)' + p.replace(r'(\d+)', r'(?P<d%d>\d+)' % i) + ')' for i, (p, _) in enumerate(_DURATION_SOURCES)
+    ) + ')',
+    re.IGNORECASE
+)
+_DURATION_UNIT_DAYS = {f'd{i}': days for i, (_, days) in enumerate(_DURATION_SOURCES)}
+
+# 💊 INTERACCIONES PELIGROSAS
+_DANGEROUS_INTERACTIONS = tuple(re.compile(p, re.IGNORECASE) for p in (
+    r'anticoagulante|warfarina|sintrom',
+    r'medicamento.*corazón|digoxina|cardiotónico',
+    r'quimioterapia|tratamiento.*cáncer',
+    r'inmunosupresor|transplante'
+))
+
+def _build_hyperscan_db(expressions) -> Optional[Any]:
+    """
+    Compila las expresiones en una base Hyperscan (DFA con SIMD); el id de cada
+    expresión es su posición. Retorna None si hyperscan no está disponible.
+    """
+    if hyperscan is None:
+        return None
+    try:
+        flags = hyperscan.HS_FLAG_CASELESS | hyperscan.HS_FLAG_SINGLEMATCH | hyperscan.HS_FLAG_UTF8
+        db = hyperscan.Database()
+        db.compile(
+            expressions=[e.encode('utf-8') for e in expressions],
+            ids=list(range(len(expressions))),
+            elements=len(expressions),
+            flags=[flags] * len(expressions)
+        )
+        return db
+    except Exception as e:
+        logger.warning(f"Could not compile Hyperscan database, using re: {e}")
+        return None
+
+def _hyperscan_mask(db, text: str) -> int:
+    """Bitset con los ids de las expresiones que aparecen en el texto"""
+    fired = 0
+    def on_match(expr_id, start, end, flags, context):
+        nonlocal fired
+        fired |= 1 << expr_id
+    db.scan(text.encode('utf-8'), match_event_handler=on_match)
+    return fired
+
+def _lowest_id(mask: int) -> int:
+    return (mask & -mask).bit_length() - 1
+
+# Una expresión por categoría crítica, otra por duración y otra por interacción, en el orden de evaluación
+_CRITICAL_NAMES = tuple(_CRITICAL_CATEGORIES)
+_CRITICAL_HS = _build_hyperscan_db(['|'.join(p) for p in _CRITICAL_CATEGORIES.values()])
+_DURATION_HS = _build_hyperscan_db([p.pattern for p, _ in _DURATION_PATTERNS])
+_INTERACTIONS_HS = _build_hyperscan_db([p.pattern for p in _DANGEROUS_INTERACTIONS])
+
+def _critical_category(symptoms: str) -> Optional[str]:
+    """Categoría crítica presente en los síntomas, o None"""
+    if _CRITICAL_HS is not None:
+        fired = _hyperscan_mask(_CRITICAL_HS, symptoms)
+        return _CRITICAL_NAMES[_lowest_id(fired)] if fired else None
+    match = _CRITICAL_COMBINED.search(symptoms)
+    return match.lastgroup if match else None
+
+def _duration_days(duration: str) -> int:
+    """Duración en días según el primer patrón (en orden) que coincide; 0 si ninguno"""
+    if _DURATION_HS is not None:
+        fired = _hyperscan_mask(_DURATION_HS, duration)
+        if not fired:
+            return 0
+        # Hyperscan no captura grupos: re extrae el número solo del patrón ganador
+        pattern, days_per_unit = _DURATION_PATTERNS[_lowest_id(fired)]
+        match = pattern.search(duration)
+        return int(match.group(1)) * days_per_unit if match else 0
+    match = _DURATION_COMBINED.match(duration)
+    if match:
+        return int(match.group(match.lastgroup)) * _DURATION_UNIT_DAYS[match.lastgroup]
+    return 0
+
+def _has_dangerous_interaction(medications: str) -> bool:
+    if _INTERACTIONS_HS is not None:
+        return _hyperscan_mask(_INTERACTIONS_HS, medications) != 0
+    return any(pattern.search(medications) for pattern in _DANGEROUS_INTERACTIONS)
+
+# Palabras clave de riesgo: un autómata Aho-Corasick las localiza todas en una sola pasada
+_RISK_KEYWORDS = ahocorasick.Automaton()
+for _keyword in ('embaraza', 'gestante', 'sangrado', 'dolor', 'abdomen', 'fiebre', 'vómito',
+                 'severo', 'mareo', 'debilidad', 'confusión', 'ninguna', 'no'):
+    _RISK_KEYWORDS.add_word(_keyword, _keyword)
+_RISK_KEYWORDS.make_automaton()
+
+_ELDERLY_RISK_KEYWORDS = frozenset(('dolor', 'fiebre', 'mareo', 'debilidad', 'confusión'))
+
+def _keyword_hits(text: str) -> set:
+    """Conjunto de palabras clave de riesgo presentes en el texto (ya en minúsculas)"""
+    return {keyword for _, keyword in _RISK_KEYWORDS.iter(text)} if text else set()
+
+@dataclass(frozen=True)
+class NormalizedPatient:
+    """Campos de patient_info en minúsculas y la edad ya convertida, calculados una sola vez"""
+    symptoms_lc: str
+    duration_lc: str
+    allergies_lc: str
+    meds_lc: str
+    additional_lc: str
+    age_int: int
+
+def _normalize(patient_info: Dict[str, Any]) -> NormalizedPatient:
+    """Normaliza patient_info para las evaluaciones de riesgo"""
+    age = patient_info.get('age', 0)
+    try:
+        age_int = int(age) if str(age).isdigit() else 0
+    except:
+        age_int = 0
+    # additional_info se pasa a minúsculas una sola vez y se reutiliza en meds_lc
+    additional_lc = patient_info.get('additional_info', '').lower()
+    return NormalizedPatient(
+        symptoms_lc=patient_info.get('symptoms', '').lower(),
+        duration_lc=patient_info.get('duration', '').lower(),
+        allergies_lc=patient_info.get('allergies', '').lower(),
+        meds_lc=patient_info.get('medications', '').lower() + ' ' + additional_lc,
+        additional_lc=additional_lc,
+        age_int=age_int
+    )
+
+def evaluar_riesgo_critico(patient: NormalizedPatient) -> Tuple[bool, str, str]:
+    """
+    🚨 EVALUACIÓN CRÍTICA DE RIESGO - PRIMERA LÍNEA DE DEFENSA
+    
+    Returns:
+        (es_critico, nivel_riesgo, mensaje_derivacion)
+    """
+    # La evaluación se cachea; el registro va fuera de la caché para que cada caso crítico quede en el log
+    is_critical, risk_level, message, category = _evaluar_riesgo_critico(patient)
+    if category:
+        logger.info("Síntoma crítico detectado: %s", category)
+    return is_critical, risk_level, message
+
+@functools.lru_cache(maxsize=2048)
+def _evaluar_riesgo_critico(patient: NormalizedPatient) -> Tuple[bool, str, str, Optional[str]]:
+    """Evaluación pura de riesgo; retorna además la categoría crítica detectada (o None)"""
+    symptoms = patient.symptoms_lc
+    age_int = patient.age_int
+    
+    # El orden de las comprobaciones es la prioridad de la derivación: un síntoma de emergencia
+    # debe devolver el mensaje de emergencias aunque el paciente también sea menor de 2 años,
+    # gestante o adulto mayor, por eso el patrón crítico se evalúa antes que las compuertas baratas
+    category = _critical_category(symptoms)
+    if category:
+        return True, "CRÍTICO", _CRITICAL_MESSAGES[category], category
+    
+    # 👥 POBLACIONES DE ALTO RIESGO
+    # Menores de 2 años - BLOQUEO ABSOLUTO
+    if age_int < 2 and age_int > 0:
+        return True, "ALTO_RIESGO", _INFANT_MESSAGE, None
+    
+    # Embarazadas con síntomas complejos
+    symptom_hits = _keyword_hits(symptoms)
+    if 'embaraza' in _keyword_hits(patient.additional_lc) or 'gestante' in symptom_hits:
+        high_risk_pregnancy = (
+            'sangrado' in symptom_hits or {'dolor', 'abdomen'} <= symptom_hits
+            or 'fiebre' in symptom_hits or {'vómito', 'severo'} <= symptom_hits
+        )
+        
+        if high_risk_pregnancy:
+            return True, "EMBARAZO_RIESGO", _PREGNANCY_RISK_MESSAGE, None
+    
+    # Adultos mayores con síntomas múltiples
+    if age_int > 75:
+        complex_symptoms = len(_ELDERLY_RISK_KEYWORDS & symptom_hits) >= 2
+        if complex_symptoms:
+            return True, "ADULTO_MAYOR_RIESGO", _ELDERLY_RISK_MESSAGE, None
     
     # ⏰ DURACIÓN PROLONGADA SIN MEJORA
-    duration_patterns = [
-        r'(\d+).*semanas?', r'(\d+).*meses?', r'más.*de.*(\d+).*días?',
-        r'hace.*(\d+).*semanas?', r'desde.*hace.*(\d+).*días?'
-    ]
-    
-    days_duration = 0
-    for pattern in duration_patterns:
-        match = re.search(pattern, duration)
-        if match:
-            num = int(match.group(1))
-            if 'semana' in pattern:
-                days_duration = num * 7
-            elif 'mes' in pattern:  
-                days_duration = num * 30
-            else:
-                days_duration = num
-            break
+    days_duration = _duration_days(patient.duration_lc)
     
     if days_duration > 14:
         return True, "CRONICO", f"""
@@ -165,46 +352,20 @@ Los síntomas que describes requieren evaluación médica urgente.
 - Necesidad de diagnóstico preciso
 
 **Por favor consulta con un médico antes de continuar con plantas medicinales.**
-        """
+        """, None
     
     # 💊 INTERACCIONES PELIGROSAS
-    dangerous_interactions = [
-        r'anticoagulante|warfarina|sintrom',
-        r'medicamento.*corazón|digoxina|cardiotónico',
-        r'quimioterapia|tratamiento.*cáncer',
-        r'inmunosupresor|transplante'
-    ]
-    
-    medications = patient_info.get('medications', '') + ' ' + patient_info.get('additional_info', '')
-    for pattern in dangerous_interactions:
-        if re.search(pattern, medications.lower()):
-            return True, "INTERACCION_PELIGROSA", f"""
-💊 **MEDICAMENTOS CON INTERACCIONES PELIGROSAS**
-
-**Las plantas medicinales pueden tener interacciones graves con tus medicamentos.**
-
-**Por favor:**
-- Consulta con tu médico tratante
-- Lleva la lista de todos tus medicamentos
-- No suspendas ni agregues nada sin supervisión médica
-
-**Tu seguridad es prioritaria.**
-            """
+    if _has_dangerous_interaction(patient.meds_lc):
+        return True, "INTERACCION_PELIGROSA", _INTERACTION_MESSAGE, None
     
-    return False, "BAJO_RIESGO", ""
+    return False, "BAJO_RIESGO", "", None
 
-def evaluar_riesgo_moderado(patient_info: Dict[str, Any]) -> Tuple[bool, str]:
+@functools.lru_cache(maxsize=2048)
+def evaluar_riesgo_moderado(patient: NormalizedPatient) -> Tuple[bool, str]:
     """
     ⚠️ EVALUACIÓN DE RIESGO MODERADO - PRECAUCIONES ADICIONALES
     """
-    symptoms = patient_info.get('symptoms', '').lower()
-    age = patient_info.get('age', 0)
-    
-    try:
-        age_int = int(age) if str(age).isdigit() else 0
-    except:
-        age_int = 0
-    
+    age_int = patient.age_int
     warnings = []
     
     # Niños pequeños (2-12 años)
@@ -212,7 +373,7 @@ def evaluar_riesgo_moderado(patient_info: Dict[str, Any]) -> Tuple[bool, str]:
         warnings.append("👶 **NIÑO:** Usar solo plantas muy suaves, dosis reducidas")
     
     # Embarazo (sin síntomas críticos)
-    if 'embaraza' in patient_info.get('additional_info', '').lower():
+    if 'embaraza' in _keyword_hits(patient.additional_lc):
         warnings.append("🤱 **EMBARAZO:** Evitar plantas emenagogas, consultar dosis")
     
     # Adultos mayores
@@ -220,8 +381,9 @@ def evaluar_riesgo_moderado(patient_info: Dict[str, Any]) -> Tuple[bool, str]:
         warnings.append("👴 **ADULTO MAYOR:** Vigilar interacciones, empezar con dosis bajas")
     
     # Alergias conocidas
-    allergies = patient_info.get('allergies', '').lower()
-    if allergies and 'ninguna' not in allergies and 'no' not in allergies:
+    allergies = patient.allergies_lc
+    allergy_hits = _keyword_hits(allergies)
+    if allergies and 'ninguna' not in allergy_hits and 'no' not in allergy_hits:
         warnings.append("⚠️ **ALERGIAS:** Verificar reacciones cruzadas con plantas")
     
     if warnings:
@@ -236,6 +398,16 @@ def evaluar_riesgo_moderado(patient_info: Dict[str, Any]) -> Tuple[bool, str]:
     
     return False, ""
 
+# Respuestas de la evaluación dual por paciente normalizado; expiran para no servir recomendaciones viejas
+_RESPONSE_CACHE_TTL = 600
+_response_cache = TTLCache(maxsize=1024, ttl=_RESPONSE_CACHE_TTL)
+
+def _response_cache_key(patient: NormalizedPatient, patient_info: Dict[str, Any]) -> str:
+    """sha1 de los campos que determinan la respuesta (los síntomas sin espacios en los extremos)"""
+    fields = (patient.symptoms_lc.strip(), patient.duration_lc, patient.allergies_lc, patient.meds_lc,
+              patient.additional_lc, str(patient.age_int), str(patient_info.get('gender', '')).lower())
+    return hashlib.sha1('\x1f'.join(fields).encode('utf-8')).hexdigest()
+
 async def process_consultation_with_safety(
     patient_info: Dict[str, Any],
     selected_plant: Optional[str] = None
@@ -246,8 +418,10 @@ async def process_consultation_with_safety(
     try:
         logger.info("\n=== INICIANDO EVALUACIÓN DE SEGURIDAD ===")
         
+        normalized = _normalize(patient_info)
+        
         # 🚨 FASE 0: EVALUACIÓN CRÍTICA DE RIESGO
-        is_critical, risk_level, critical_message = evaluar_riesgo_critico(patient_info)
+        is_critical, risk_level, critical_message = evaluar_riesgo_critico(normalized)
         
         if is_critical:
             logger.warning(f"RIESGO CRÍTICO DETECTADO: {risk_level}")
@@ -256,16 +430,16 @@ async def process_consultation_with_safety(
                 "risk_level": risk_level,
                 "medical_referral_required": True,
                 "plant_recommendation_blocked": True,
-                "session_id": patient_info.get('session_id', str(uuid.uuid4()))
+                "session_id": patient_info.get('session_id') or str(uuid.uuid4())
             }
         
         # ⚠️ EVALUACIÓN DE RIESGO MODERADO
-        has_moderate_risk, moderate_warning = evaluar_riesgo_moderado(patient_info)
+        has_moderate_risk, moderate_warning = evaluar_riesgo_moderado(normalized)
         
         logger.info("=== EVALUACIÓN DE SEGURIDAD COMPLETADA - CONTINUANDO ===")
         
         # Continuar con la lógica de evaluación dual
-        session_id = patient_info.get('session_id', str(uuid.uuid4()))
+        session_id = patient_info.get('session_id') or str(uuid.uuid4())
         symptoms = patient_info.get('symptoms', '')
         
         has_selected_plant = selected_plant is not None and selected_plant.strip() != ""
@@ -274,7 +448,7 @@ async def process_consultation_with_safety(
             # FASE 6 con advertencias de seguridad
             result = await get_plant_preparation_safe(selected_plant, patient_info, moderate_warning)
             
-            # Guardar consulta
+            # Guardar consulta: solo la encola, el INSERT lo hace el escritor por lotes en segundo plano
             await save_consultation(
                 user_id=patient_info.get('user_id', 'anonymous'),
                 session_id=session_id,
@@ -290,9 +464,19 @@ async def process_consultation_with_safety(
             # FASES 1-5 con evaluación de seguridad
             logger.info("=== CONTINUANDO CON EVALUACIÓN DUAL ===")
             
-            # Evaluación dual RNA/RAG
-            rna_recommendations, rna_precision = await evaluate_rna_system(symptoms)
-            rag_recommendations, rag_precision = await evaluate_rag_system(patient_info)
+            cache_key = _response_cache_key(normalized, patient_info)
+            cached = _response_cache.get(cache_key)
+            if cached is not None:
+                logger.info("Respuesta de evaluación dual servida desde caché")
+                # Copia profunda: el llamador puede modificar las listas y dicts anidados de la respuesta
+                return {**copy.deepcopy(cached), "session_id": session_id}
+            
+            # Evaluación dual RNA/RAG en paralelo: la llamada del RAG a OpenAI queda en vuelo
+            # mientras la RNA calcula en su hilo, sin bloquear otras peticiones
+            (rag_recommendations, rag_precision), (rna_recommendations, rna_precision) = await asyncio.gather(
+                evaluate_rag_system(patient_info),
+                evaluate_rna_system(symptoms)
+            )
             
             selected_system, selection_reason = select_optimal_system(
                 rna_precision, rag_precision, symptoms
@@ -309,7 +493,7 @@ async def process_consultation_with_safety(
                 moderate_warning
             )
             
-            return {
+            response = {
                 "answer": formatted_response,
                 "selected_system": selected_system,
                 "rna_recommendations": rna_recommendations,
@@ -323,6 +507,10 @@ async def process_consultation_with_safety(
                 "medical_referral_required": False,
                 "plant_recommendation_blocked": False
             }
+            # No cachear respuestas degradadas por un fallo transitorio del RAG
+            if rag_recommendations:
+                _response_cache[cache_key] = copy.deepcopy(response)
+            return response
         
     except Exception as e:
         logger.error(f"Error in process_consultation_with_safety: {str(e)}")
@@ -361,6 +549,78 @@ async def get_plant_preparation_safe(plant_name: str, patient_info: Dict[str, An
         logger.error(f"Error generating safe plant preparation: {str(e)}")
         return {"answer": f"Error al procesar la preparación: {str(e)}"}
 
+async def stream_plant_preparation_safe(plant_name: str, patient_info: Dict[str, Any],
+                                        moderate_warning: str = "") -> AsyncIterator[str]:
+    """
+    FASE 6 en streaming: el mismo texto que get_plant_preparation_safe, entregado por fragmentos
+    """
+    logger.info(f"Generando preparación SEGURA (streaming) para: {plant_name}")
+    prompt = prepare_safe_rag_prompt(patient_info, plant_name, moderate_warning)
+    
+    if moderate_warning:
+        yield f"{moderate_warning}\n\n"
+    async for text in get_completion_stream(prompt):
+        yield text
+    # Disclaimer legal obligatorio al final
+    yield f"\n\n{generate_safety_disclaimer()}"
+
+async def stream_consultation_with_safety(
+    patient_info: Dict[str, Any],
+    selected_plant: Optional[str] = None
+) -> AsyncIterator[str]:
+    """
+    Variante en streaming de process_consultation_with_safety.
+    Solo la preparación de una planta seleccionada se transmite por fragmentos; las derivaciones
+    y la evaluación dual (que necesita la respuesta RAG completa para puntuarla) salen en un fragmento.
+    """
+    has_selected_plant = selected_plant is not None and selected_plant.strip() != ""
+    if not has_selected_plant:
+        response = await process_consultation_with_safety(patient_info, selected_plant)
+        yield response.get("answer") or response.get("error", "")
+        return
+    
+    normalized = _normalize(patient_info)
+    is_critical, risk_level, critical_message = evaluar_riesgo_critico(normalized)
+    if is_critical:
+        logger.warning(f"RIESGO CRÍTICO DETECTADO: {risk_level}")
+        yield critical_message
+        return
+    
+    _, moderate_warning = evaluar_riesgo_moderado(normalized)
+    async for text in stream_plant_preparation_safe(selected_plant, patient_info, moderate_warning):
+        yield text
+    
+    await save_consultation(
+        user_id=patient_info.get('user_id', 'anonymous'),
+        session_id=patient_info.get('session_id') or str(uuid.uuid4()),
+        symptoms=patient_info.get('symptoms', ''),
+        symptoms_duration=patient_info.get('duration', ''),
+        allergies=patient_info.get('allergies', 'ninguna'),
+        recommended_plant=selected_plant,
+        risk_level=risk_level
+    )
+
+# Plantilla fija de la respuesta dual; solo la sección de recomendaciones depende del sistema elegido
+_RESPONSE_TEMPLATE = """{warning}🌿 **RECOMENDACIONES DE PLANTAS MEDICINALES** 🌿
+
+**Sistema elegido:** {system}
+**Precisión estimada:** {precision:.1f}%
+**Motivo de selección:** {reason}
+
+{section}
+📊 **Comparativa de sistemas:**
+- Precisión RNA: {rna_precision:.1f}%
+- Precisión RAG: {rag_precision:.1f}%
+
+---
+{disclaimer}
+
+📋 **Por favor, elija una de estas plantas para recibir la preparación detallada.**"""
+
+def _confidence_level(confidence: float) -> str:
+    """Etiqueta de efectividad según la confianza de la RNA"""
+    return "Alta" if confidence > 0.7 else "Media" if confidence > 0.4 else "Baja"
+
 def format_user_response_safe(
     selected_system: str, 
     rna_recommendations: List[Dict], 
@@ -373,50 +633,30 @@ def format_user_response_safe(
     """
     FASE 4 MEJORADA: Formateo con advertencias de seguridad y manteniendo la información de precisión
     """
-    lines = []
-    
-    # Advertencias de seguridad moderada al inicio
-    if moderate_warning:
-        lines.append(moderate_warning)
-        lines.append("")
-    
-    # Encabezado con información de precisión
-    lines.append("🌿 **RECOMENDACIONES DE PLANTAS MEDICINALES** 🌿")
-    lines.append("")
-    lines.append(f"**Sistema elegido:** {selected_system}")
-    lines.append(f"**Precisión estimada:** {(rna_precision if selected_system == 'RNA' else rag_precision)*100:.1f}%")
-    lines.append(f"**Motivo de selección:** {reason}")
-    lines.append("")
-    
     if selected_system == "RNA":
-        # Mostrar recomendaciones RNA estructuradas
-        lines.append("🤖 **Recomendaciones basadas en patrones aprendidos (RNA):**")
-        for i, plant in enumerate(rna_recommendations, 1):
-            confidence_level = "Alta" if plant['confidence'] > 0.7 else "Media" if plant['confidence'] > 0.4 else "Baja"
-            
-            lines.append(f"**PLANTA_{i}: {plant['name'].title()} ({plant['scientific_name']})**")
-            lines.append(f"- Efectividad: {confidence_level} (Confianza: {plant['confidence']:.2f})")
-            lines.append(f"- Descripción: Recomendada para sus síntomas específicos")
-            lines.append("")
+        # Recomendaciones RNA estructuradas, un bloque por planta
+        section = "\n".join([
+            "🤖 **Recomendaciones basadas en patrones aprendidos (RNA):**",
+            *(f"**PLANTA_{i}: {plant['name'].title()} ({plant['scientific_name']})**\n"
+              f"- Efectividad: {_confidence_level(plant['confidence'])} (Confianza: {plant['confidence']:.2f})\n"
+              f"- Descripción: Recomendada para sus síntomas específicos\n"
+              for i, plant in enumerate(rna_recommendations, 1))
+        ])
     else:
-        # Mostrar recomendaciones RAG
-        lines.append("📚 **Recomendaciones basadas en conocimiento médico (RAG):**")
-        lines.append(rag_recommendations)
-        lines.append("")
+        section = f"📚 **Recomendaciones basadas en conocimiento médico (RAG):**\n{rag_recommendations}\n"
     
-    # Comparativa de sistemas
-    lines.append("📊 **Comparativa de sistemas:**")
-    lines.append(f"- Precisión RNA: {rna_precision*100:.1f}%")
-    lines.append(f"- Precisión RAG: {rag_precision*100:.1f}%")
-    lines.append("")
-    
-    # Disclaimer de seguridad obligatorio
-    lines.append("---")
-    lines.append(generate_safety_disclaimer())
-    lines.append("")
-    lines.append("📋 **Por favor, elija una de estas plantas para recibir la preparación detallada.**")
-    
-    return "\n".join(lines)
+    return _RESPONSE_TEMPLATE.format(
+        # Advertencias de seguridad moderada al inicio
+        warning=f"{moderate_warning}\n\n" if moderate_warning else "",
+        system=selected_system,
+        precision=(rna_precision if selected_system == 'RNA' else rag_precision)*100,
+        reason=reason,
+        section=section,
+        rna_precision=rna_precision*100,
+        rag_precision=rag_precision*100,
+        # Disclaimer de seguridad obligatorio
+        disclaimer=generate_safety_disclaimer()
+    )
 
 def prepare_safe_rag_prompt(patient_info: Dict[str, Any], selected_plant: str, 
                            moderate_warning: str = "") -> str:
@@ -428,7 +668,7 @@ def prepare_safe_rag_prompt(patient_info: Dict[str, Any], selected_plant: str,
     allergies = patient_info.get('allergies', 'Ninguna')
     age = patient_info.get('age', 'No especificado')
     
-    plant_name = selected_plant.split('(')[0].strip() if '(' in selected_plant else selected_plant
+    plant_name = selected_plant.partition('(')[0].strip() if '(' in selected_plant else selected_plant
     
     safety_considerations = ""
     if moderate_warning:
@@ -459,11 +699,8 @@ def prepare_safe_rag_prompt(patient_info: Dict[str, Any], selected_plant: str,
     
     return prompt
 
-def generate_safety_disclaimer() -> str:
-    """
-    Genera disclaimer legal obligatorio
-    """
-    return """
+# Disclaimer legal constante, construido una sola vez al importar el módulo
+_SAFETY_DISCLAIMER = """
 🏥 **IMPORTANTE - DISCLAIMER MÉDICO:**
 
 ⚠️ **Este sistema NO sustituye la consulta médica profesional.**
@@ -475,83 +712,247 @@ def generate_safety_disclaimer() -> str:
 **🔒 Tu seguridad es nuestra prioridad principal.**
     """
 
+def generate_safety_disclaimer() -> str:
+    """
+    Genera disclaimer legal obligatorio
+    """
+    return _SAFETY_DISCLAIMER
+
+_INSERT_CONSULTATION_SQL = """
+INSERT INTO patient_consultations 
+    (user_id, session_id, symptoms, symptoms_duration, allergies, 
+     recommended_plant, consultation_date, risk_level)
+VALUES 
+    (%s, %s, %s, %s, %s, %s, CURRENT_TIMESTAMP, %s)
+"""
+
+# Tareas de guardado pendientes; la referencia evita que el recolector las descarte antes de terminar
+_background_tasks: set = set()
+
+def _log_save_errors(task: asyncio.Task) -> None:
+    """Libera la tarea y registra fallos que save_consultation no haya capturado"""
+    _background_tasks.discard(task)
+    if task.cancelled():
+        logger.warning("Guardado de consulta cancelado")
+    elif task.exception() is not None:
+        logger.error(f"Error saving consultation: {str(task.exception())}")
+
+def _spawn_background(coro) -> asyncio.Task:
+    """Lanza la corrutina sin esperarla y conserva la tarea hasta que termine"""
+    task = asyncio.create_task(coro)
+    _background_tasks.add(task)
+    task.add_done_callback(_log_save_errors)
+    return task
+
+# Las consultas se encolan y un único escritor las inserta por lotes: hasta 50 filas o cada 50 ms
+_CONSULTATION_BATCH_SIZE = 50
+_CONSULTATION_FLUSH_INTERVAL = 0.05
+
+_consultation_queue: Optional[asyncio.Queue] = None
+_consultation_writer: Optional[asyncio.Task] = None
+
+# Filas que no se pudieron insertar por un fallo de conexión: se reintentan con los lotes siguientes.
+# La reserva es acotada; si se llena, las filas más antiguas se pierden y se cuentan como descartadas
+_CONSULTATION_RETRY_LIMIT = 1000
+_CONSULTATION_RETRY_DELAY = 1.0
+_CONSULTATION_RETRY_MAX_DELAY = 60.0
+_consultation_retry: deque = deque()
+_consultation_retry_at = 0.0
+_consultation_retry_delay = _CONSULTATION_RETRY_DELAY
+
+# Contadores de filas perdidas: rechazadas por la base de datos o descartadas de la reserva
+_consultation_failures = {"rejected": 0, "dropped": 0}
+
+def consultation_write_stats() -> Dict[str, int]:
+    """Filas rechazadas, descartadas y pendientes de reintento del escritor de consultas"""
+    return {**_consultation_failures, "pending_retry": len(_consultation_retry)}
+
+def _spill_consultations(rows: List[Tuple]) -> None:
+    """Guarda filas para reintentarlas más tarde, con espera creciente entre reintentos"""
+    global _consultation_retry_at, _consultation_retry_delay
+    _consultation_retry.extend(rows)
+    overflow = len(_consultation_retry) - _CONSULTATION_RETRY_LIMIT
+    for _ in range(max(0, overflow)):
+        _consultation_retry.popleft()
+    if overflow > 0:
+        _consultation_failures["dropped"] += overflow
+        logger.error("Reserva de consultas llena: %d consultas descartadas", overflow)
+    _consultation_retry_at = time.monotonic() + _consultation_retry_delay
+    _consultation_retry_delay = min(_consultation_retry_delay * 2, _CONSULTATION_RETRY_MAX_DELAY)
+
+def _take_retry_rows(limit: int, force: bool = False) -> List[Tuple]:
+    """Filas de la reserva listas para reintentar (todas las que quepan si force)"""
+    if not _consultation_retry or (not force and time.monotonic() < _consultation_retry_at):
+        return []
+    return [_consultation_retry.popleft() for _ in range(min(limit, len(_consultation_retry)))]
+
+async def _execute_consultations(rows: List[Tuple]) -> None:
+    pool = await get_db_pool()
+    # La conexión sale del pool compartido; el bloque hace commit al salir o rollback si falla
+    async with pool.connection() as conn:
+        async with conn.cursor() as cursor:
+            await cursor.executemany(_INSERT_CONSULTATION_SQL, rows)
+
+async def _insert_consultations(batch: List[Tuple]) -> None:
+    """
+    Inserta un lote de consultas; psycopg envía el executemany en modo pipeline (un solo viaje).
+    Un fallo de conexión devuelve el lote a la reserva de reintentos; si el lote lo rechaza la base
+    de datos, se reintenta fila a fila para perder solo las filas inválidas
+    """
+    global _consultation_retry_delay
+    try:
+        await _execute_consultations(batch)
+        _consultation_retry_delay = _CONSULTATION_RETRY_DELAY
+        return
+    except OperationalError as e:
+        logger.error("Error saving %d consultations, will retry: %s", len(batch), e)
+        _spill_consultations(batch)
+        return
+    except Exception as e:
+        if len(batch) == 1:
+            _consultation_failures["rejected"] += 1
+            logger.error("Consultation rejected by the database: %s", e)
+            return
+        logger.error("Error saving %d consultations, retrying one by one: %s", len(batch), e)
+    for i, row in enumerate(batch):
+        try:
+            await _execute_consultations([row])
+        except OperationalError as e:
+            logger.error("Error saving %d consultations, will retry: %s", len(batch) - i, e)
+            _spill_consultations(batch[i:])
+            return
+        except Exception as e:
+            _consultation_failures["rejected"] += 1
+            logger.error("Consultation rejected by the database: %s", e)
+
+async def _write_consultations(queue: asyncio.Queue) -> None:
+    """Agrupa las filas encoladas y las inserta; un None en la cola vacía el lote y termina"""
+    loop = asyncio.get_running_loop()
+    while True:
+        row = await queue.get()
+        if row is None:
+            return
+        # Las filas pendientes de un fallo anterior viajan con el lote nuevo
+        batch = _take_retry_rows(_CONSULTATION_BATCH_SIZE - 1) + [row]
+        deadline = loop.time() + _CONSULTATION_FLUSH_INTERVAL
+        while len(batch) < _CONSULTATION_BATCH_SIZE:
+            timeout = deadline - loop.time()
+            if timeout <= 0:
+                break
+            try:
+                row = await asyncio.wait_for(queue.get(), timeout)
+            except asyncio.TimeoutError:
+                break
+            if row is None:
+                await _insert_consultations(batch)
+                return
+            batch.append(row)
+        await _insert_consultations(batch)
+
+def _consultation_queue_for_writer() -> asyncio.Queue:
+    """Cola de consultas pendientes; arranca el escritor si no está corriendo"""
+    global _consultation_queue, _consultation_writer
+    if _consultation_queue is None:
+        _consultation_queue = asyncio.Queue()
+    if _consultation_writer is None or _consultation_writer.done():
+        _consultation_writer = _spawn_background(_write_consultations(_consultation_queue))
+    return _consultation_queue
+
+async def flush_consultations() -> None:
+    """Inserta las consultas pendientes y detiene el escritor (al apagar el servidor)"""
+    global _consultation_writer
+    if _consultation_writer is not None and not _consultation_writer.done():
+        _consultation_queue.put_nowait(None)
+        await _consultation_writer
+    _consultation_writer = None
+    # Último intento con la reserva; lo que siga sin guardarse se pierde al apagar
+    pending = _take_retry_rows(len(_consultation_retry), force=True)
+    if pending:
+        await _insert_consultations(pending)
+    if _consultation_retry:
+        _consultation_failures["dropped"] += len(_consultation_retry)
+        _consultation_retry.clear()
+    if _consultation_failures["rejected"] or _consultation_failures["dropped"]:
+        logger.error("Consultas no guardadas: %s", consultation_write_stats())
+
+def _as_uuid(value) -> uuid.UUID:
+    """UUID sin reparsear si ya lo es; cadena vacía o inválida se reemplaza por uno nuevo"""
+    if isinstance(value, uuid.UUID):
+        return value
+    if not value:
+        return uuid.uuid4()
+    try:
+        return uuid.UUID(value)
+    except (ValueError, TypeError, AttributeError) as e:
+        logger.error(f"Error converting UUIDs: {e}")
+        return uuid.uuid4()
+
 # Modificar la función save_consultation para incluir risk_level
+
 async def save_consultation(
-    user_id: str,
-    session_id: str,
+    user_id: Union[str, uuid.UUID],
+    session_id: Union[str, uuid.UUID],
     symptoms: str,
     symptoms_duration: str,
     allergies: str,
     recommended_plant: str = None,
     risk_level: str = "BAJO_RIESGO"
 ) -> bool:
-    conn = None
-    cursor = None
+    """
+    Encola la consulta para el escritor por lotes; True si quedó encolada (aún no guardada).
+    Los fallos de escritura posteriores se reintentan y se cuentan en consultation_write_stats()
+    """
     try:
-        conn = psycopg2.connect(
-            dbname=os.getenv("DATABASE_URL") or os.getenv("DB_NAME"), 
-            user=os.getenv("DB_USER"),            
-            password=os.getenv("DB_PASSWORD"),    
-            host=os.getenv("DB_HOST"),            
-            port=os.getenv("DB_PORT", "5432")         
-        )
-        register_uuid()
-        cursor = conn.cursor()
-        
-        # Query modificada para incluir risk_level
-        insert_query = """
-        INSERT INTO patient_consultations 
-            (user_id, session_id, symptoms, symptoms_duration, allergies, 
-             recommended_plant, consultation_date, risk_level)
-        VALUES 
-            (%s, %s, %s, %s, %s, %s, CURRENT_TIMESTAMP, %s)
-        """
-        
-        if not user_id:
-            user_id = str(uuid.uuid4())
-            
-        try:
-            user_id_uuid = uuid.UUID(user_id)
-            session_id_uuid = uuid.UUID(session_id)
-        except ValueError as e:
-            logger.error(f"Error converting UUIDs: {e}")
-            user_id_uuid = uuid.uuid4()
-            session_id_uuid = uuid.uuid4()
-        
-        cursor.execute(insert_query, (
-            user_id_uuid,
-            session_id_uuid,
+        _consultation_queue_for_writer().put_nowait((
+            _as_uuid(user_id),
+            _as_uuid(session_id),
             symptoms,
             symptoms_duration,
             allergies,
             recommended_plant,
             risk_level  # Nueva columna
         ))
-        
-        conn.commit()
         return True
         
     except Exception as e:
         logger.error(f"Error saving consultation: {str(e)}")
-        if conn is not None:
-            conn.rollback()
         return False
-    finally:
-        if cursor is not None:
-            cursor.close()
-        if conn is not None:
-            conn.close()
 
 # ========== FUNCIONES DE EVALUACIÓN DUAL ==========
 
+# Pesos de los factores de precisión de cada sistema
+_RNA_WEIGHTS = np.array([0.4, 0.25, 0.2, 0.15])
+_RAG_WEIGHTS = np.array([0.35, 0.3, 0.2, 0.15])
+
+def _weighted_precision(factors, weights, floor):
+    """Suma ponderada de los factores acotada a [floor, 1.0]"""
+    acc = 0.0
+    for i in range(factors.shape[0]):
+        acc += factors[i] * weights[i]
+    return min(1.0, max(floor, acc))
+
+if njit is not None:
+    _weighted_precision = njit(cache=True)(_weighted_precision)
+
+# La inferencia RNA corre fuera del event loop, en un único hilo: el recomendador guarda estado
+# mutable (reserva de ruido) y un solo hilo evita además competir por núcleos con NumPy
+_rna_executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix="rna")
+
+def _recommend(symptoms: str) -> List[Dict]:
+    return get_recommender().recommend(symptoms, top_n=3)
+
+async def load_recommender() -> None:
+    """Construye el recomendador compartido en el hilo de la RNA (al iniciar el servidor)"""
+    await asyncio.get_running_loop().run_in_executor(_rna_executor, get_recommender)
+
 async def evaluate_rna_system(symptoms: str) -> tuple[List[Dict], float]:
     """FASE 2.1: Evaluación del sistema RNA con manejo de casos límite mejorado"""
     try:
         if not symptoms.strip():
             return [], 0.0
             
-        # Obtener recomendaciones del sistema híbrido (RNA)
-        recommendations = hybrid_recommender.recommend(symptoms, top_n=3)
+        # Obtener recomendaciones del sistema híbrido (RNA) mientras la evaluación RAG espera a OpenAI
+        recommendations = await asyncio.get_running_loop().run_in_executor(_rna_executor, _recommend, symptoms)
         
         if not recommendations or len(recommendations) == 0:
             logger.warning(f"El sistema RNA no devolvió recomendaciones para: '{symptoms}'")
@@ -566,20 +967,18 @@ async def evaluate_rna_system(symptoms: str) -> tuple[List[Dict], float]:
         precision_factors.append(avg_confidence)
         
         # Resto de factores (mantén los mismos)
-        historical_similarity = max(0.2, calculate_historical_similarity(symptoms))
+        scoring = _scoring_context(symptoms)
+        historical_similarity = max(0.2, calculate_historical_similarity(scoring))
         precision_factors.append(historical_similarity)
         
-        symptom_frequency = max(0.2, calculate_symptom_frequency(symptoms))
+        symptom_frequency = max(0.2, calculate_symptom_frequency(scoring))
         precision_factors.append(symptom_frequency)
         
         recommendation_coherence = max(0.2, calculate_recommendation_coherence(recommendations))
         precision_factors.append(recommendation_coherence)
         
-        # Pesos para cada factor
-        weights = [0.4, 0.25, 0.2, 0.15]
-        
         # Calcular precisión ponderada (asegurar mínimo 0.2)
-        rna_precision = min(1.0, max(0.2, sum(f*w for f,w in zip(precision_factors, weights))))
+        rna_precision = float(_weighted_precision(np.array(precision_factors), _RNA_WEIGHTS, 0.2))
         
         logger.info(f"Factores RNA: {precision_factors} → Precisión: {rna_precision:.3f}")
         return recommendations, rna_precision
@@ -599,29 +998,13 @@ async def evaluate_rag_system(patient_info: Dict[str, Any]) -> tuple[str, float]
             logger.warning("Respuesta RAG demasiado corta o vacía")
             return "", 0.5  # Precisión base
         
-        # Calcular factores con valores mínimos
-        precision_factors = []
-        
-        # Factor 1: Relevancia semántica (mínimo 0.3)
-        semantic_relevance = max(0.3, calculate_semantic_relevance(
-            patient_info.get('symptoms', ''), rag_response
-        ))
-        precision_factors.append(semantic_relevance)
-        
-        # Factor 2: Calidad literaria (mínimo 0.3)
-        literature_quality = max(0.3, calculate_literature_quality(rag_response))
-        precision_factors.append(literature_quality)
-        
-        # Factor 3: Cobertura (mínimo 0.3)
-        information_coverage = max(0.3, calculate_information_coverage(rag_response))
-        precision_factors.append(information_coverage)
+        # Síntomas y respuesta se pasan a minúsculas, tokenizan y escanean una sola vez para los cuatro factores
+        scoring = _scoring_context(patient_info.get('symptoms', ''), rag_response)
         
-        # Factor 4: Coherencia (mínimo 0.3)
-        information_coherence = max(0.3, calculate_information_coherence(rag_response))
-        precision_factors.append(information_coherence)
+        # Relevancia semántica, calidad literaria, cobertura y coherencia (mínimo 0.3 cada una)
+        precision_factors = list(_rag_precision_factors(scoring))
         
-        weights = [0.35, 0.3, 0.2, 0.15]
-        rag_precision = min(1.0, max(0.3, sum(f*w for f,w in zip(precision_factors, weights))))
+        rag_precision = float(_weighted_precision(np.array(precision_factors), _RAG_WEIGHTS, 0.3))
         
         logger.info(f"Factores RAG: {precision_factors} → Precisión: {rag_precision:.3f}")
         return rag_response, rag_precision
@@ -650,12 +1033,168 @@ def select_optimal_system(rna_precision: float, rag_precision: float, symptoms:
     else:
         return "RAG", f"RAG superior (RAG: {rag_precision:.3f} > RNA: {rna_precision:.3f}) - Casos complejos/inusuales"
 
+# Caché de respuestas RAG en dos niveles: L1 exacta por sha1 del prompt y L2 semántica por embedding
+# de los síntomas. La L2 solo compara consultas con la misma duración, alergias, edad y género,
+# para no reutilizar una recomendación hecha para otro perfil de paciente
+_RAG_CACHE_TTL = 3600
+_rag_exact_cache = TTLCache(maxsize=1024, ttl=_RAG_CACHE_TTL)
+
+# Modelo multilingüe: los síntomas llegan en español. El umbral es configurable para ajustarlo con
+# pares reales de consultas (RAG_SEMANTIC_THRESHOLD)
+_SEMANTIC_MODEL_NAME = "sentence-transformers/paraphrase-multilingual-MiniLM-L12-v2"
+_SEMANTIC_THRESHOLD = float(os.getenv("RAG_SEMANTIC_THRESHOLD", "0.95"))
+_SEMANTIC_MAX_ENTRIES = 256
+# Si el modelo no se puede cargar (sin red, sin torch), la capa semántica se omite durante este tiempo
+_SEMANTIC_RETRY_SECONDS = 600
+
+# Los embeddings de peticiones concurrentes se calculan juntos: hasta 16 textos o 10 ms de espera
+_EMBED_BATCH_SIZE = 16
+_EMBED_BATCH_WAIT = 0.01
+
+# Textos que extract_answer devuelve cuando no hay respuesta útil; nunca se cachean
+_UNCACHEABLE_ANSWERS = frozenset((
+    "No se pudo generar una respuesta.", "No se encontraron recomendaciones adecuadas.",
+    "La respuesta generada está vacía.", "Error procesando la respuesta."
+))
+
+class SemanticCache:
+    """
+    Respuestas indexadas por embeddings normalizados: el producto punto con la matriz de cada
+    contexto es la similitud coseno, y la mejor por encima del umbral es un acierto
+    """
+    
+    def __init__(self, model_name: str, threshold: float, max_entries: int):
+        self.model_name = model_name
+        self.threshold = threshold
+        self.max_entries = max_entries
+        self._model = None
+        self._retry_at = 0.0
+        # contexto -> (matriz (n, dim) de embeddings, respuestas en el mismo orden)
+        self._entries = TTLCache(maxsize=1024, ttl=_RAG_CACHE_TTL)
+        self._queue: Optional[asyncio.Queue] = None
+        self._batcher: Optional[asyncio.Task] = None
+    
+    def encode_many(self, texts: List[str]) -> np.ndarray:
+        """Embeddings normalizados (uno por fila) en una sola pasada del modelo, que se carga en el primer uso"""
+        if self._model is None:
+            try:
+                from sentence_transformers import SentenceTransformer
+                self._model = SentenceTransformer(self.model_name)
+            except Exception:
+                self._retry_at = time.monotonic() + _SEMANTIC_RETRY_SECONDS
+                raise
+        return self._model.encode(texts, batch_size=len(texts), normalize_embeddings=True).astype(np.float32)
+    
+    @property
+    def available(self) -> bool:
+        """False mientras dura la espera tras un fallo al cargar el modelo"""
+        return self._model is not None or time.monotonic() >= self._retry_at
+    
+    async def embed(self, text: str) -> np.ndarray:
+        """Embedding del texto, calculado junto con los de otras peticiones concurrentes"""
+        if self._queue is None:
+            self._queue = asyncio.Queue()
+        if self._batcher is None or self._batcher.done():
+            self._batcher = asyncio.create_task(self._encode_batches())
+        future = asyncio.get_running_loop().create_future()
+        self._queue.put_nowait((text, future))
+        return await future
+    
+    async def _encode_batches(self) -> None:
+        """Agrupa los textos encolados, los codifica en un hilo y entrega cada fila a su petición"""
+        loop = asyncio.get_running_loop()
+        while True:
+            batch = [await self._queue.get()]
+            deadline = loop.time() + _EMBED_BATCH_WAIT
+            while len(batch) < _EMBED_BATCH_SIZE:
+                timeout = deadline - loop.time()
+                if timeout <= 0:
+                    break
+                try:
+                    batch.append(await asyncio.wait_for(self._queue.get(), timeout))
+                except asyncio.TimeoutError:
+                    break
+            try:
+                vectors = await asyncio.to_thread(self.encode_many, [text for text, _ in batch])
+            except Exception as e:
+                for _, future in batch:
+                    if not future.done():
+                        future.set_exception(e)
+                continue
+            # Una petición cancelada deja su futuro resuelto; su fila simplemente se descarta
+            for (_, future), vector in zip(batch, vectors):
+                if not future.done():
+                    future.set_result(vector)
+    
+    def lookup(self, context: str, vector: np.ndarray) -> Optional[str]:
+        entry = self._entries.get(context)
+        if entry is None:
+            return None
+        vectors, answers = entry
+        similarities = vectors @ vector
+        best = int(np.argmax(similarities))
+        return answers[best] if similarities[best] >= self.threshold else None
+    
+    def add(self, context: str, vector: np.ndarray, answer: str) -> None:
+        entry = self._entries.get(context)
+        if entry is None:
+            self._entries[context] = (vector[np.newaxis, :], [answer])
+            return
+        vectors, answers = entry
+        # Se descartan las entradas más antiguas al superar el máximo por contexto
+        self._entries[context] = (
+            np.vstack((vectors, vector))[-self.max_entries:], (answers + [answer])[-self.max_entries:]
+        )
+
+_semantic_cache = (
+    SemanticCache(_SEMANTIC_MODEL_NAME, _SEMANTIC_THRESHOLD, _SEMANTIC_MAX_ENTRIES)
+    if _HAS_SENTENCE_TRANSFORMERS else None
+)
+
+# Intensidad y negación cambian el sentido clínico pero apenas mueven el embedding ("dolor leve"
+# frente a "dolor intenso"): forman parte del contexto, así que solo se comparan consultas que coinciden
+_SYMPTOM_QUALIFIERS_RE = re.compile(
+    r'\b(leve|ligero|ligera|moderado|moderada|intenso|intensa|fuerte|severo|severa|grave|'
+    r'agudo|aguda|crónico|crónica|insoportable|extremo|extrema|persistente|ocasional|no|sin)\b'
+)
+
+def _rag_context_key(patient_info: Dict[str, Any]) -> str:
+    """Campos del prompt RAG distintos de los síntomas y calificadores de los síntomas, en minúsculas"""
+    qualifiers = sorted(set(_SYMPTOM_QUALIFIERS_RE.findall(str(patient_info.get('symptoms', '')).lower())))
+    return '\x1f'.join([str(patient_info.get(field, '')).strip().lower()
+                         for field in ('duration', 'allergies', 'age', 'gender')] + [' '.join(qualifiers)])
+
 async def get_rag_recommendations(patient_info: Dict[str, Any]) -> str:
     """Obtiene recomendaciones usando el sistema RAG"""
     try:
         prompt = prepare_rag_prompt(patient_info, plant_selected=False)
+        prompt_key = hashlib.sha1(prompt.encode('utf-8')).hexdigest()
+        cached = _rag_exact_cache.get(prompt_key)
+        if cached is not None:
+            logger.info("Respuesta RAG servida desde la caché exacta")
+            return cached
+        
+        context = vector = None
+        if _semantic_cache is not None and _semantic_cache.available:
+            try:
+                context = _rag_context_key(patient_info)
+                vector = await _semantic_cache.embed(patient_info.get('symptoms', '').lower())
+                cached = _semantic_cache.lookup(context, vector)
+            except Exception as e:
+                logger.error(f"Error en la caché semántica del RAG: {str(e)}")
+                vector = None
+            if cached is not None:
+                logger.info("Respuesta RAG servida desde la caché semántica")
+                _rag_exact_cache[prompt_key] = cached
+                return cached
+        
         response = await get_completion(prompt)
-        return extract_answer(response)
+        answer = extract_answer(response)
+        if response is not None and answer not in _UNCACHEABLE_ANSWERS:
+            _rag_exact_cache[prompt_key] = answer
+            if vector is not None:
+                _semantic_cache.add(context, vector, answer)
+        return answer
     except Exception as e:
         logger.error(f"Error getting RAG recommendations: {str(e)}")
         return ""
@@ -671,7 +1210,7 @@ def prepare_rag_prompt(patient_info: Dict[str, Any], selected_plant: Optional[st
     plant_name = selected_plant
     if selected_plant and plant_selected:
         if '(' in selected_plant:
-            plant_name = selected_plant.split('(')[0].strip()
+            plant_name = selected_plant.partition('(')[0].strip()
         logger.info(f"Nombre de planta normalizado para el prompt: {plant_name}")
     
     if plant_selected:
@@ -714,7 +1253,8 @@ async def get_completion(prompt: str) -> Dict:
         if not api_key:
             logger.error("ERROR: No OpenAI API key available")
             return None
-            
+        
+        client, use_new_client = get_openai_client()
         if use_new_client:
             response = await client.chat.completions.create(
                 model="gpt-4-turbo",
@@ -728,7 +1268,7 @@ async def get_completion(prompt: str) -> Dict:
             logger.info('HTTP Request: OpenAI chat completions API call successful')
             return response
         else:
-            response = await openai.ChatCompletion.acreate(
+            response = await client.ChatCompletion.acreate(
                 model="gpt-4-turbo",
                 messages=[
                     {"role": "system", "content": "Eres un experto en medicina tradicional peruana especializado en plantas medicinales. Tu objetivo es proporcionar información precisa y útil sobre remedios herbales para síntomas específicos."},
@@ -743,12 +1283,53 @@ async def get_completion(prompt: str) -> Dict:
         logger.error(f"Error obteniendo completion: {str(e)}")
         return None
 
+async def get_completion_stream(prompt: str) -> AsyncIterator[str]:
+    """Igual que get_completion pero entrega el texto por fragmentos a medida que OpenAI los genera"""
+    try:
+        if not api_key:
+            logger.error("ERROR: No OpenAI API key available")
+            return
+        
+        client, use_new_client = get_openai_client()
+        messages = [
+            {"role": "system", "content": "Eres un experto en medicina tradicional peruana especializado en plantas medicinales. Tu objetivo es proporcionar información precisa y útil sobre remedios herbales para síntomas específicos."},
+            {"role": "user", "content": prompt}
+        ]
+        if use_new_client:
+            response = await client.chat.completions.create(
+                model="gpt-4-turbo",
+                messages=messages,
+                temperature=0.5,
+                max_tokens=800,
+                stream=True
+            )
+            async for chunk in response:
+                if chunk.choices and chunk.choices[0].delta.content:
+                    yield chunk.choices[0].delta.content
+        else:
+            response = await client.ChatCompletion.acreate(
+                model="gpt-4-turbo",
+                messages=messages,
+                temperature=0.5,
+                max_tokens=800,
+                stream=True
+            )
+            async for chunk in response:
+                content = chunk['choices'][0]['delta'].get('content') if chunk['choices'] else None
+                if content:
+                    yield content
+        logger.info('HTTP Request: OpenAI chat completions stream finished')
+    except Exception as e:
+        logger.error(f"Error obteniendo completion en streaming: {str(e)}")
+        yield "Error procesando la respuesta."
+
 def extract_answer(completion_response) -> str:
     """Extrae y formatea la respuesta del RAG"""
     if not completion_response:
         return "No se pudo generar una respuesta."
     
     try:
+        _, use_new_client = get_openai_client()
         if use_new_client:
             if not hasattr(completion_response, 'choices') or not completion_response.choices:
                 return "No se encontraron recomendaciones adecuadas."
@@ -767,34 +1348,76 @@ def extract_answer(completion_response) -> str:
         return "Error procesando la respuesta."
 
 # Funciones auxiliares para cálculo de precisión
-def calculate_historical_similarity(symptoms: str) -> float:
+
+# Conjuntos de síntomas fijos, construidos una sola vez al importar el módulo
+_HISTORICAL_SYMPTOMS = frozenset(("dolor", "fiebre", "tos", "digestión", "cabeza", "estómago"))
+_SYMPTOM_FREQUENCIES = {
+    "dolor": 0.8, "cabeza": 0.7, "estómago": 0.75, "fiebre": 0.6,
+    "tos": 0.65, "digestión": 0.7, "piel": 0.4, "respiratorio": 0.5
+}
+_COMMON_SYMPTOMS = frozenset((
+    "dolor de cabeza", "dolor", "fiebre", "tos", "resfriado", "gripe",
+    "digestión", "estómago", "malestar", "cansancio", "fatiga"
+))
+
+# Cada palabra de síntoma es un bit; las del mapa de frecuencias ocupan los bits bajos, en su orden
+_SYMPTOM_KEYWORD_LIST = tuple(_SYMPTOM_FREQUENCIES) + tuple(sorted(
+    (_HISTORICAL_SYMPTOMS | _COMMON_SYMPTOMS) - _SYMPTOM_FREQUENCIES.keys()
+))
+_SYMPTOM_BITS = {keyword: 1 << i for i, keyword in enumerate(_SYMPTOM_KEYWORD_LIST)}
+_HISTORICAL_MASK = sum(_SYMPTOM_BITS[keyword] for keyword in _HISTORICAL_SYMPTOMS)
+_COMMON_MASK = sum(_SYMPTOM_BITS[keyword] for keyword in _COMMON_SYMPTOMS)
+_FREQUENCY_MASK = (1 << len(_SYMPTOM_FREQUENCIES)) - 1
+
+def _frequency_table() -> Tuple[float, ...]:
+    """Frecuencia media para cada combinación posible de los bits de frecuencia (0.3 si ninguno)"""
+    frequencies = tuple(_SYMPTOM_FREQUENCIES.values())
+    table = []
+    for mask in range(_FREQUENCY_MASK + 1):
+        # Misma suma, en el mismo orden, que el promedio de las frecuencias presentes
+        found = [freq for i, freq in enumerate(frequencies) if mask >> i & 1]
+        table.append(sum(found) / len(found) if found else 0.3)
+    return tuple(table)
+
+# Las 2^8 medias se calculan al importar: en cada consulta la frecuencia es un índice en la tabla
+_SYMPTOM_FREQUENCY_BY_MASK = _frequency_table()
+
+# Un autómata con todas las palabras anteriores: una pasada sobre los síntomas sirve a las tres funciones
+_SYMPTOM_KEYWORDS = ahocorasick.Automaton()
+for _keyword, _bit in _SYMPTOM_BITS.items():
+    _SYMPTOM_KEYWORDS.add_word(_keyword, _bit)
+_SYMPTOM_KEYWORDS.make_automaton()
+
+@functools.lru_cache(maxsize=1024)
+def _symptom_mask(symptoms_lower: str) -> int:
+    """Bits de las palabras de síntomas presentes en el texto ya en minúsculas (como subcadena)"""
+    mask = 0
+    for _, bit in _SYMPTOM_KEYWORDS.iter(symptoms_lower):
+        mask |= bit
+    return mask
+
+@functools.lru_cache(maxsize=2048)
+def calculate_historical_similarity(scoring: 'ScoringContext') -> float:
     """Simula similitud con casos históricos exitosos"""
-    common_symptoms = ["dolor", "fiebre", "tos", "digestión", "cabeza", "estómago"]
-    symptoms_lower = symptoms.lower()
-    matches = sum(1 for symptom in common_symptoms if symptom in symptoms_lower)
-    return min(0.9, matches / len(common_symptoms) + 0.3)
+    matches = (scoring.symptom_mask & _HISTORICAL_MASK).bit_count()
+    return min(0.9, matches / len(_HISTORICAL_SYMPTOMS) + 0.3)
 
-def calculate_symptom_frequency(symptoms: str) -> float:
+@functools.lru_cache(maxsize=2048)
+def calculate_symptom_frequency(scoring: 'ScoringContext') -> float:
     """Simula frecuencia de síntomas en dataset de entrenamiento"""
-    symptom_frequencies = {
-        "dolor": 0.8, "cabeza": 0.7, "estómago": 0.75, "fiebre": 0.6,
-        "tos": 0.65, "digestión": 0.7, "piel": 0.4, "respiratorio": 0.5
-    }
-    symptoms_lower = symptoms.lower()
-    total_frequency = 0
-    count = 0
-    for symptom, freq in symptom_frequencies.items():
-        if symptom in symptoms_lower:
-            total_frequency += freq
-            count += 1
-    return total_frequency / count if count > 0 else 0.3
+    return _SYMPTOM_FREQUENCY_BY_MASK[scoring.symptom_mask & _FREQUENCY_MASK]
 
 def calculate_recommendation_coherence(recommendations: List[Dict]) -> float:
     """Calcula coherencia entre recomendaciones"""
-    if len(recommendations) < 2:
+    return _confidence_coherence(tuple(plant['confidence'] for plant in recommendations))
+
+@functools.lru_cache(maxsize=2048)
+def _confidence_coherence(confidences: Tuple[float, ...]) -> float:
+    """Coherencia a partir de las confianzas en orden (tupla para poder memoizar)"""
+    if len(confidences) < 2:
         return 0.5
-    confidences = [plant['confidence'] for plant in recommendations]
-    is_ordered = all(confidences[i] >= confidences[i+1] for i in range(len(confidences)-1))
+    # Con top-3 el costo de despachar a NumPy supera al de comparar pares adyacentes en Python
+    is_ordered = all(a >= b for a, b in zip(confidences, confidences[1:]))
     confidence_range = max(confidences) - min(confidences)
     good_range = 0.2 <= confidence_range <= 0.5
     coherence = 0.5
@@ -804,47 +1427,114 @@ def calculate_recommendation_coherence(recommendations: List[Dict]) -> float:
         coherence += 0.2
     return min(1.0, coherence)
 
-def calculate_semantic_relevance(symptoms: str, rag_response: str) -> float:
+_MEDICAL_KEYWORDS = frozenset((
+    "dolor", "fiebre", "inflamación", "tos", "digestión", "cabeza", "estómago",
+    "piel", "respiratorio", "tratamiento", "medicinal", "planta", "hierba"
+))
+_QUALITY_INDICATORS = frozenset((
+    "nombre científico", "propiedades", "preparación", "dosis",
+    "efectos", "contraindicaciones", "infusión", "decocción"
+))
+_COVERAGE_ASPECTS = frozenset((
+    "planta", "síntoma", "preparación", "uso", "cantidad", "tiempo"
+))
+
+# Cada palabra clave es un bit: la presencia de un grupo de palabras es un entero y los conteos
+# de coincidencias son int.bit_count() sobre el AND de máscaras, sin construir conjuntos
+# Claves internadas, como los nombres de plantas en hybrid_recommender
+_MEDICAL_BITS = {sys.intern(keyword): 1 << i for i, keyword in enumerate(sorted(_MEDICAL_KEYWORDS))}
+
+_RESPONSE_KEYWORD_LIST = tuple(sorted(_QUALITY_INDICATORS | _COVERAGE_ASPECTS))
+_RESPONSE_BITS = {keyword: 1 << i for i, keyword in enumerate(_RESPONSE_KEYWORD_LIST)}
+_QUALITY_MASK = sum(_RESPONSE_BITS[keyword] for keyword in _QUALITY_INDICATORS)
+_COVERAGE_MASK = sum(_RESPONSE_BITS[keyword] for keyword in _COVERAGE_ASPECTS)
+
+# Indicadores de calidad y aspectos de cobertura en un autómata: una pasada sobre la respuesta RAG
+_RESPONSE_KEYWORDS = ahocorasick.Automaton()
+for _keyword, _bit in _RESPONSE_BITS.items():
+    _RESPONSE_KEYWORDS.add_word(_keyword, _bit)
+_RESPONSE_KEYWORDS.make_automaton()
+
+# Con hyperscan, las mismas palabras como literales en una base: un escaneo DFA de la respuesta larga.
+# El id de cada expresión es su posición, así la máscara de Hyperscan usa los mismos bits
+_RESPONSE_HS = _build_hyperscan_db([re.escape(keyword) for keyword in _RESPONSE_KEYWORD_LIST])
+
+def _medical_mask(text_lower: str) -> int:
+    """Bits de las palabras médicas que aparecen como token en el texto"""
+    mask = 0
+    for token in text_lower.split():
+        mask |= _MEDICAL_BITS.get(token, 0)
+    return mask
+
+def _response_mask(response_lower: str) -> int:
+    """Bits de los indicadores y aspectos presentes en la respuesta ya en minúsculas (como subcadena)"""
+    if not response_lower:
+        return 0
+    if _RESPONSE_HS is not None:
+        return _hyperscan_mask(_RESPONSE_HS, response_lower)
+    mask = 0
+    for _, bit in _RESPONSE_KEYWORDS.iter(response_lower):
+        mask |= bit
+    return mask
+
+@dataclass(frozen=True)
+class ScoringContext:
+    """Síntomas y respuesta RAG en minúsculas, tokenizados y escaneados una sola vez por consulta"""
+    symptoms_lower: str
+    response_lower: str
+    symptom_mask: int
+    symptom_medical_mask: int
+    response_medical_mask: int
+    response_mask: int
+    response_line_count: int
+    response_length: int
+
+# Inicio de cada línea con algún carácter que no es espacio: contar coincidencias = contar líneas no vacías
+_NON_EMPTY_LINE = re.compile(r'^[^\S\n]*\S', re.MULTILINE)
+
+def _scoring_context(symptoms: str, rag_response: str = "") -> ScoringContext:
+    """Prepara las entradas de los calculadores de precisión"""
+    symptoms_lower = symptoms.lower()
+    response_lower = rag_response.lower()
+    return ScoringContext(
+        symptoms_lower=symptoms_lower,
+        response_lower=response_lower,
+        symptom_mask=_symptom_mask(symptoms_lower),
+        symptom_medical_mask=_medical_mask(symptoms_lower),
+        response_medical_mask=_medical_mask(response_lower),
+        response_mask=_response_mask(response_lower),
+        response_line_count=sum(1 for _ in _NON_EMPTY_LINE.finditer(rag_response)),
+        response_length=len(rag_response)
+    )
+
+@functools.lru_cache(maxsize=2048)
+def calculate_semantic_relevance(scoring: ScoringContext) -> float:
     """Simula relevancia semántica entre síntomas y respuesta RAG"""
-    symptoms_words = set(symptoms.lower().split())
-    response_words = set(rag_response.lower().split())
-    medical_keywords = {
-        "dolor", "fiebre", "inflamación", "tos", "digestión", "cabeza", "estómago",
-        "piel", "respiratorio", "tratamiento", "medicinal", "planta", "hierba"
-    }
-    symptom_medical = symptoms_words.intersection(medical_keywords)
-    response_medical = response_words.intersection(medical_keywords)
+    symptom_medical = scoring.symptom_medical_mask
     if not symptom_medical:
         return 0.4
-    overlap = len(symptom_medical.intersection(response_medical))
-    return min(0.95, overlap / len(symptom_medical) + 0.3)
+    overlap = (symptom_medical & scoring.response_medical_mask).bit_count()
+    return min(0.95, overlap / symptom_medical.bit_count() + 0.3)
 
-def calculate_literature_quality(rag_response: str) -> float:
+@functools.lru_cache(maxsize=2048)
+def calculate_literature_quality(scoring: ScoringContext) -> float:
     """Simula calidad de matches en literatura médica/botánica"""
-    quality_indicators = [
-        "nombre científico", "propiedades", "preparación", "dosis",
-        "efectos", "contraindicaciones", "infusión", "decocción"
-    ]
-    response_lower = rag_response.lower()
-    matches = sum(1 for indicator in quality_indicators if indicator in response_lower)
-    return min(0.9, matches / len(quality_indicators) + 0.2)
+    matches = (scoring.response_mask & _QUALITY_MASK).bit_count()
+    return min(0.9, matches / len(_QUALITY_INDICATORS) + 0.2)
 
-def calculate_information_coverage(rag_response: str) -> float:
+@functools.lru_cache(maxsize=2048)
+def calculate_information_coverage(scoring: ScoringContext) -> float:
     """Calcula cobertura de información en la respuesta"""
-    coverage_aspects = [
-        "planta", "síntoma", "preparación", "uso", "cantidad", "tiempo"
-    ]
-    response_lower = rag_response.lower()
-    covered = sum(1 for aspect in coverage_aspects if aspect in response_lower)
-    return covered / len(coverage_aspects)
+    covered = (scoring.response_mask & _COVERAGE_MASK).bit_count()
+    return covered / len(_COVERAGE_ASPECTS)
 
-def calculate_information_coherence(rag_response: str) -> float:
+@functools.lru_cache(maxsize=2048)
+def calculate_information_coherence(scoring: ScoringContext) -> float:
     """Calcula coherencia de la información recuperada"""
-    lines = rag_response.split('\n')
-    non_empty_lines = [line.strip() for line in lines if line.strip()]
-    has_structure = len(non_empty_lines) >= 3
-    good_length = 100 <= len(rag_response) <= 1000
-    has_plant_format = "PLANTA_" in rag_response or "planta" in rag_response.lower()
+    has_structure = scoring.response_line_count >= 3
+    good_length = 100 <= scoring.response_length <= 1000
+    # "PLANTA_" en la respuesta original implica "planta" en minúsculas
+    has_plant_format = "planta" in scoring.response_lower
     coherence = 0.3
     if has_structure:
         coherence += 0.25
@@ -854,19 +1544,86 @@ def calculate_information_coherence(rag_response: str) -> float:
         coherence += 0.2
     return min(1.0, coherence)
 
+@functools.lru_cache(maxsize=2048)
+def _rag_precision_factors(scoring: ScoringContext) -> Tuple[float, float, float, float]:
+    """
+    Los cuatro factores RAG con su mínimo de 0.3 en una sola llamada memoizada: el contexto se
+    hashea una vez por consulta en lugar de una vez por calculador
+    """
+    return (
+        max(0.3, calculate_semantic_relevance.__wrapped__(scoring)),
+        max(0.3, calculate_literature_quality.__wrapped__(scoring)),
+        max(0.3, calculate_information_coverage.__wrapped__(scoring)),
+        max(0.3, calculate_information_coherence.__wrapped__(scoring))
+    )
+
+# Columnas de la matriz que devuelve score_batch
+SCORE_COLUMNS = (
+    "historical_similarity", "symptom_frequency", "semantic_relevance",
+    "literature_quality", "information_coverage", "information_coherence"
+)
+
+# Versión de los puntajes guardados por score_batch: subirla al cambiar cualquier función de puntaje
+# o sus tablas (p. ej. _SYMPTOM_FREQUENCY_BY_MASK) invalida las cachés en disco de versiones anteriores
+SCORING_VERSION = 1
+
+def _score_pair(symptoms: str, rag_response: str) -> Tuple[float, ...]:
+    """Fila de score_batch para un par, con las funciones sin memoizar"""
+    scoring = _scoring_context(symptoms, rag_response)
+    return (
+        calculate_historical_similarity.__wrapped__(scoring),
+        calculate_symptom_frequency.__wrapped__(scoring),
+        calculate_semantic_relevance.__wrapped__(scoring),
+        calculate_literature_quality.__wrapped__(scoring),
+        calculate_information_coverage.__wrapped__(scoring),
+        calculate_information_coherence.__wrapped__(scoring)
+    )
+
+def _pair_key(symptoms: str, rag_response: str) -> str:
+    """BLAKE2b del par; la longitud de los síntomas como prefijo evita ambigüedad entre pares"""
+    return hashlib.blake2b(f"{len(symptoms)}:{symptoms}{rag_response}".encode('utf-8'), digest_size=16).hexdigest()
+
+def score_batch(pairs: List[Tuple[str, str]], cache_path: Optional[str] = None) -> np.ndarray:
+    """
+    Puntajes de precisión (sin mínimos) de muchos pares (síntomas, respuesta RAG), para evaluaciones offline.
+    Retorna una matriz (len(pairs), 6) ordenada según SCORE_COLUMNS. Los pares repetidos se preparan una
+    sola vez y se usan las funciones sin memoizar para no desplazar de las cachés las consultas en línea.
+    Con cache_path, las filas se guardan en ese archivo (joblib) por hash del par y se reutilizan entre
+    ejecuciones mientras SCORING_VERSION no cambie; un archivo de otra versión se descarta entero.
+    """
+    cached = joblib.load(cache_path) if cache_path and os.path.exists(cache_path) else None
+    stored = cached['rows'] if isinstance(cached, dict) and cached.get('version') == SCORING_VERSION else {}
+    stored_size = len(stored)
+    scores = np.empty((len(pairs), len(SCORE_COLUMNS)))
+    rows = {}
+    for i, pair in enumerate(pairs):
+        row = rows.get(pair)
+        if row is None:
+            key = _pair_key(*pair)
+            row = stored.get(key)
+            if row is None:
+                row = stored[key] = _score_pair(*pair)
+            rows[pair] = row
+        scores[i] = row
+    if cache_path and len(stored) > stored_size:
+        joblib.dump({'version': SCORING_VERSION, 'rows': stored}, cache_path)
+    return scores
+
+@functools.lru_cache(maxsize=2048)
 def is_common_symptom(symptoms: str) -> bool:
     """Determina si los síntomas son comunes o específicos"""
-    common_symptoms = [
-        "dolor de cabeza", "dolor", "fiebre", "tos", "resfriado", "gripe",
-        "digestión", "estómago", "malestar", "cansancio", "fatiga"
-    ]
-    symptoms_lower = symptoms.lower()
-    return any(common in symptoms_lower for common in common_symptoms)
+    return bool(_symptom_mask(symptoms.lower()) & _COMMON_MASK)
+
+_uuid_registered = False
 
 def register_uuid():
-    """Register UUID type with psycopg2"""
+    """Register UUID type with psycopg2 (only the first call does any work)"""
+    global _uuid_registered
+    if _uuid_registered:
+        return
     import psycopg2.extras
     psycopg2.extras.register_uuid()
+    _uuid_registered = True
 
 # Configuración de la base de datos
 """
@@ -877,27 +1634,29 @@ db_config = {
     'host': 'localhost'
 }
 """
-# Inicialización del recomendador híbrido y cliente OpenAI
-try:
-    from hybrid_recommender import HybridRecommender
-    hybrid_recommender = HybridRecommender()
-except ImportError:
-    class HybridRecommender:
-        def recommend(self, symptoms, top_n=3):
-            return []
-    hybrid_recommender = HybridRecommender()
+# Recomendador híbrido y cliente OpenAI: se crean en el primer uso, no al importar el módulo
+@functools.lru_cache(maxsize=1)
+def get_recommender():
+    """Recomendador híbrido compartido"""
+    from .hybrid_recommender import HybridRecommender
+    return HybridRecommender()
 
-try:
-    from openai import AsyncOpenAI as OpenAIClient
-    use_new_client = True
-    client = OpenAIClient(api_key=os.getenv("OPENAI_API_KEY"))
-except ImportError:
+@functools.lru_cache(maxsize=1)
+def get_openai_client() -> Tuple[Any, bool]:
+    """
+    (cliente, use_new_client): AsyncOpenAI con la librería nueva, el módulo openai con la
+    antigua, o None si no está instalada
+    """
     try:
-        import openai
-        use_new_client = False
-        openai.api_key = os.getenv("OPENAI_API_KEY")
+        from openai import AsyncOpenAI as OpenAIClient
+        return OpenAIClient(api_key=os.getenv("OPENAI_API_KEY")), True
     except ImportError:
-        print("ERROR: OpenAI library not installed")
-        use_new_client = False
+        try:
+            import openai
+            openai.api_key = os.getenv("OPENAI_API_KEY")
+            return openai, False
+        except ImportError:
+            print("ERROR: OpenAI library not installed")
+            return None, False
 
 api_key = os.getenv("OPENAI_API_KEY")
\ No newline at end of file
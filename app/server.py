@@ -3,115 +3,177 @@ from fastapi.middleware.cors import CORSMiddleware
 from pydantic import BaseModel
 from typing import Dict, Any, Optional
 from contextlib import asynccontextmanager
-import psycopg2
 from datetime import datetime, timedelta
 import traceback
+import asyncio
+import hashlib
+import time
 import uuid
-import importlib.util
 import sys
 import os
 import logging
-from fastapi.responses import HTMLResponse
+import atexit
+import queue
+from logging.handlers import QueueHandler, QueueListener
+from fastapi.responses import HTMLResponse, ORJSONResponse
+from sse_starlette.sse import EventSourceResponse
 from fastapi.security import OAuth2PasswordBearer
+from cachetools import TTLCache
+import bcrypt
+import jwt
+# InvalidTokenError es la base de token expirado, firma inválida, etc.
+from jwt import InvalidTokenError as JWTError
 
 
-# Configurar logging más detallado
+# Configurar logging más detallado. Los registros pasan por una cola y un hilo aparte
+# los escribe en consola, así las peticiones no esperan la escritura en la terminal
+_log_queue = queue.SimpleQueue()
+_log_listener = QueueListener(_log_queue, logging.StreamHandler())  # Para mostrar en consola
 logging.basicConfig(
     level=logging.INFO, 
     format='%(asctime)s - %(name)s - %(levelname)s - %(message)s',
     handlers=[
-        logging.StreamHandler(),  # Para mostrar en consola
+        QueueHandler(_log_queue),
     ]
 )
+_log_listener.start()
+atexit.register(_log_listener.stop)
 logger = logging.getLogger(__name__)
 
-# Comprobar las rutas del proyecto para los imports
+# La raíz del proyecto en sys.path permite importar el paquete app también con python app/server.py
 current_dir = os.path.dirname(os.path.abspath(__file__))
 parent_dir = os.path.dirname(current_dir)
 if parent_dir not in sys.path:
     sys.path.append(parent_dir)
 
-# Importar dependencias con try/except para manejar errores
-try:
-    from app.rag_chain import process_consultation_with_safety
-    from app.hybrid_recommender import HybridRecommender
-except ImportError:
-    # Si falla, intentar importar de manera relativa
-    try:
-        from .rag_chain import process_consultation_with_safety
-        from .hybrid_recommender import HybridRecommender
-    except ImportError:
-        # Si ambos fallan, importar directamente (considerando que estamos en el directorio app)
-        try:
-            import rag_chain
-            from hybrid_recommender import HybridRecommender
-            process_consultation_with_safety = rag_chain.process_consultation_with_safety
-        except ImportError as e:
-            print(f"Error de importación crítico: {e}")
-            raise
-
-# Importar bcrypt para el hash de contraseñas
-try:
-    import bcrypt
-except ImportError:
-    print("WARNING: bcrypt not installed. Installing...")
-    import pip
-    pip.main(['install', 'bcrypt'])
-    import bcrypt
-
-# Importar passlib.hash para compatibilidad
-try:
-    from passlib.hash import bcrypt as passlib_bcrypt
-except ImportError:
-    print("WARNING: passlib not installed. Some functionality may be limited.")
-    passlib_bcrypt = None
-
-# Importar jose para JWT
-try:
-    from jose import JWTError, jwt
-except ImportError:
-    print("WARNING: python-jose not installed. Installing...")
-    import pip
-    pip.main(['install', 'python-jose[cryptography]'])
-    from jose import JWTError, jwt
-
-# Inicializar el recomendador híbrido
-hybrid_recommender = HybridRecommender()
+from app.rag_chain import (
+    process_consultation_with_safety, stream_consultation_with_safety, flush_consultations, load_recommender
+)
+from app.db import open_db_pool, close_db_pool, get_db_pool
 
 # Configuración del JWT
 SECRET_KEY = os.getenv("SECRET_KEY", "GROF*_*09")
 ALGORITHM = "HS256"
 ACCESS_TOKEN_EXPIRE_MINUTES = 30 * 8  # 4 horas de validez (ajustable)
 
+# Tokens ya verificados, por SHA-256 del token (nunca el token en claro) -> (username, exp).
+# El TTL acota cuánto tarda en notarse un cambio de SECRET_KEY; configurable por entorno
+JWT_CACHE_TTL = int(os.getenv("JWT_CACHE_TTL", "30"))
+_jwt_cache = TTLCache(maxsize=10000, ttl=JWT_CACHE_TTL)
+
+# Datos de perfil por username (edad, género, zona...): cambian poco y se leen en cada consulta
+USER_CACHE_TTL = 60
+_user_cache = TTLCache(maxsize=5000, ttl=USER_CACHE_TTL)
+
+# Recomendaciones previas por session_id: la selección de planta las relee durante toda la consulta
+SESSION_RECS_CACHE_TTL = 3600
+_session_recs_cache = TTLCache(maxsize=5000, ttl=SESSION_RECS_CACHE_TTL)
+
 oauth2_scheme = OAuth2PasswordBearer(tokenUrl="token")
 
+# Qué campos únicos del registro ya están en uso (NULL en todos si no hay coincidencias)
+USER_CONFLICTS_SQL = """
+SELECT bool_or(username = %(username)s),
+       bool_or(email = %(email)s),
+       bool_or(dni = %(dni)s),
+       bool_or(phone_number = %(phone_number)s)
+FROM personal_information
+WHERE username = %(username)s OR email = %(email)s
+   OR dni = %(dni)s OR phone_number = %(phone_number)s
+"""
+
+# ON CONFLICT necesita el índice único que crea migrations/001_treatment_feedback_session_unique.sql;
+# al iniciar solo se comprueba si existe
+FEEDBACK_SESSION_INDEX_EXISTS_SQL = """
+SELECT EXISTS (
+    SELECT 1 FROM pg_indexes
+    WHERE tablename = 'treatment_feedback'
+      AND indexname = 'treatment_feedback_session_id_key'
+)
+"""
+
+# Un solo viaje a la base de datos: inserta el feedback o actualiza el de la misma sesión
+UPSERT_FEEDBACK_SQL = """
+INSERT INTO treatment_feedback 
+    (session_id, effectiveness_rating, side_effects, improvement_time, 
+     additional_comments, created_at)
+VALUES 
+    (%s, %s, %s, %s, %s, CURRENT_TIMESTAMP)
+ON CONFLICT (session_id) DO UPDATE
+SET effectiveness_rating = EXCLUDED.effectiveness_rating,
+    side_effects = EXCLUDED.side_effects,
+    improvement_time = EXCLUDED.improvement_time,
+    additional_comments = EXCLUDED.additional_comments,
+    updated_at = CURRENT_TIMESTAMP
+"""
+
+# Respaldo si el índice único no existe: UPDATE y, si no afectó filas, INSERT
+UPDATE_FEEDBACK_SQL = """
+UPDATE treatment_feedback 
+SET effectiveness_rating = %s,
+    side_effects = %s,
+    improvement_time = %s,
+    additional_comments = %s,
+    updated_at = CURRENT_TIMESTAMP
+WHERE session_id = %s
+"""
+INSERT_FEEDBACK_SQL = """
+INSERT INTO treatment_feedback 
+    (session_id, effectiveness_rating, side_effects, improvement_time, 
+     additional_comments, created_at)
+VALUES 
+    (%s, %s, %s, %s, %s, CURRENT_TIMESTAMP)
+"""
+
+# Se decide al iniciar según exista o no treatment_feedback_session_id_key
+_feedback_upsert_ready = False
+
+
+async def check_feedback_upsert(pool) -> None:
+    """Consulta (solo lectura) si existe el índice único que necesita UPSERT_FEEDBACK_SQL"""
+    global _feedback_upsert_ready
+    async with pool.connection() as conn:
+        cursor = await conn.execute(FEEDBACK_SESSION_INDEX_EXISTS_SQL)
+        (_feedback_upsert_ready,) = await cursor.fetchone()
+    if not _feedback_upsert_ready:
+        logger.warning("⚠️ Sin índice único en treatment_feedback.session_id; feedback con UPDATE/INSERT")
+
 
 @asynccontextmanager
 async def lifespan(app: FastAPI):
+    # El pool asíncrono se abre una vez al iniciar y se cierra al apagar el servidor
+    try:
+        pool = await open_db_pool()
+        await check_feedback_upsert(pool)
+    except Exception as e:
+        logger.error("❌ No se pudo preparar la base de datos: %s", e)
+    # El recomendador híbrido se construye una vez, fuera del event loop, antes de aceptar peticiones
+    try:
+        await load_recommender()
+    except Exception as e:
+        logger.error("❌ No se pudo cargar el recomendador híbrido: %s", e)
     yield
+    # Las consultas aún en cola se insertan antes de cerrar el pool
+    await flush_consultations()
+    await close_db_pool()
 
-app = FastAPI(lifespan=lifespan)
+# Las respuestas JSON se codifican con orjson (C) en lugar del módulo json estándar
+app = FastAPI(lifespan=lifespan, default_response_class=ORJSONResponse)
 
 # Configurar CORS
 origins = [
     "http://localhost:3000",  # Para desarrollo local
     "http://localhost:3001",  # Para desarrollo local alternativo
-    "https://plant-medicator-project-red.vercel.app",  # Tu dominio de Vercel
-    "https://plant-medicator-project-pvin1pbxd-richard97chzs-projects.vercel.app",  # Tu dominio de deployment
-    "https://*.vercel.app",  # Permitir todos los subdominios de Vercel
 ]
 
-# Si estás en producción, agregar dinámicamente los dominios de Vercel
-if os.getenv("NODE_ENV") == "production":
-    # Agregar dominios de preview de Vercel
-    origins.extend([
-        "https://plant-medicator-project-git-main-richard97chzs-projects.vercel.app",
-        # Puedes agregar más dominios aquí según sea necesario
-    ])
+# Dominios de Vercel del proyecto: producción, deployments y previews por rama
+# (CORSMiddleware compara allow_origins literalmente, así que "*.vercel.app" nunca coincidía)
+VERCEL_ORIGIN_REGEX = r"^https://plant-medicator-project(-[a-z0-9-]+)?\.vercel\.app$"
 
 app.add_middleware(
     CORSMiddleware,
     allow_origins=origins,  # Usar 'origins' en lugar de 'CORS_ORIGINS'
+    allow_origin_regex=VERCEL_ORIGIN_REGEX,
     allow_credentials=True,
     allow_methods=["GET", "POST", "PUT", "DELETE", "OPTIONS"],
     allow_headers=["*"],
@@ -164,9 +226,12 @@ def create_access_token(data: dict, expires_delta: Optional[timedelta] = None):
     encoded_jwt = jwt.encode(to_encode, SECRET_KEY, algorithm=ALGORITHM)
     return encoded_jwt
 
-def print_terminal_separator():
-    """Imprime un separador visual en la terminal"""
-    print("\n" + "="*80)
+TERMINAL_SEPARATOR = "=" * 80
+
+def log_banner(*lines: str):
+    """Registra un bloque de líneas entre separadores visuales con una sola llamada al logger"""
+    if logger.isEnabledFor(logging.INFO):
+        logger.info("\n".join(("", TERMINAL_SEPARATOR, *lines, TERMINAL_SEPARATOR)))
 
 def detect_consultation_state(selected_plant: Optional[str], session_id: Optional[str]) -> tuple[str, str]:
     """
@@ -177,22 +242,14 @@ def detect_consultation_state(selected_plant: Optional[str], session_id: Optiona
     else:
         return "INITIAL_CONSULTATION", "Nueva consulta iniciada - Análisis y recomendaciones"
 
-def get_previous_recommendations_from_session(session_id: str) -> Dict[str, Any]:
+async def get_previous_recommendations_from_session(session_id: str) -> Dict[str, Any]:
     """
     Recupera las recomendaciones previas de una sesión para validar la planta seleccionada
     """
-    conn = None
-    cursor = None
+    previous_recs = _session_recs_cache.get(session_id)
+    if previous_recs is not None:
+        return previous_recs
     try:
-        conn = psycopg2.connect(
-            dbname=os.getenv("DATABASE_URL") or os.getenv("DB_NAME"), 
-            user=os.getenv("DB_USER"),            
-            password=os.getenv("DB_PASSWORD"),    
-            host=os.getenv("DB_HOST"),            
-            port=os.getenv("DB_PORT", "5432")           
-        )
-        cursor = conn.cursor()
-        
         # Buscar recomendaciones previas en la sesión
         query = """
         SELECT rna_recommendations, rag_recommendations, selected_system
@@ -202,169 +259,169 @@ def get_previous_recommendations_from_session(session_id: str) -> Dict[str, Any]
         LIMIT 1
         """
         
-        cursor.execute(query, (session_id,))
-        result = cursor.fetchone()
+        pool = await get_db_pool()
+        async with pool.connection() as conn:
+            # Consultas de cada petición: prepare=True deja el plan preparado en la conexión del
+            # pool desde la primera ejecución, sin esperar al umbral automático de psycopg
+            cursor = await conn.execute(query, (session_id,), prepare=True)
+            result = await cursor.fetchone()
         
         if result:
-            return {
+            # Solo se guardan sesiones con recomendaciones; una sesión vacía puede llenarse después
+            # Los textos en minúsculas se calculan una vez por sesión y no en cada validación
+            previous_recs = _session_recs_cache[session_id] = {
                 'rna_recommendations': result[0],
                 'rag_recommendations': result[1], 
-                'selected_system': result[2]
+                'selected_system': result[2],
+                'rna_lower': (result[0] or '').lower(),
+                'rag_lower': (result[1] or '').lower()
             }
+            return previous_recs
         else:
             return {}
             
     except Exception as e:
-        logger.error(f"❌ Error recuperando recomendaciones previas: {str(e)}")
+        logger.error("❌ Error recuperando recomendaciones previas: %s", e)
         return {}
-    finally:
-        if cursor:
-            cursor.close()
-        if conn:
-            conn.close()
 
-def validate_plant_selection(selected_plant: str, session_id: str) -> tuple[bool, str]:
+async def validate_plant_selection(selected_plant: str, session_id: str) -> tuple[bool, str]:
     """
     Valida que la planta seleccionada esté en las opciones previas
     """
     if not session_id:
         return False, "Session ID requerido para validación"
     
-    previous_recs = get_previous_recommendations_from_session(session_id)
+    previous_recs = await get_previous_recommendations_from_session(session_id)
     
     if not previous_recs:
-        logger.warning(f"⚠️  No se encontraron recomendaciones previas para session: {session_id}")
+        logger.warning("⚠️  No se encontraron recomendaciones previas para session: %s", session_id)
         return True, "Validación omitida - no hay recomendaciones previas"
     
+    selected_lower = selected_plant.lower()
+    
     # Verificar en recomendaciones RAG (formato texto)
-    rag_recs = previous_recs.get('rag_recommendations', '')
-    if selected_plant.lower() in rag_recs.lower():
+    if selected_lower in previous_recs['rag_lower']:
         return True, f"Planta '{selected_plant}' encontrada en recomendaciones RAG previas"
     
     # Verificar en recomendaciones RNA (si están disponibles)
-    rna_recs = previous_recs.get('rna_recommendations', '')
-    if selected_plant.lower() in rna_recs.lower():
+    if selected_lower in previous_recs['rna_lower']:
         return True, f"Planta '{selected_plant}' encontrada en recomendaciones RNA previas"
     
     return False, f"Planta '{selected_plant}' no encontrada en opciones previas"
 
 def print_consultation_header(state: str, session_id: str, selected_plant: Optional[str] = None):
     """
-    Imprime el encabezado apropiado según el estado de la consulta
+    Registra el encabezado apropiado según el estado de la consulta
     """
-    print_terminal_separator()
-    
     if state == "PLANT_SELECTION":
-        print("🔄 CONTINUANDO CONSULTA EXISTENTE")
-        print_terminal_separator()
-        print("=== FASE 6: PREPARACIÓN DETALLADA ===")
-        print(f"📋 Contexto: Continuación de Session ID: {session_id}")
-        print(f"🌱 Usuario seleccionó: {selected_plant}")
-        print("📄 Generando preparación personalizada...")
+        log_banner(
+            "🔄 CONTINUANDO CONSULTA EXISTENTE",
+            TERMINAL_SEPARATOR,
+            "=== FASE 6: PREPARACIÓN DETALLADA ===",
+            f"📋 Contexto: Continuación de Session ID: {session_id}",
+            f"🌱 Usuario seleccionó: {selected_plant}",
+            "📄 Generando preparación personalizada..."
+        )
     else:
-        print("🌿 NUEVA CONSULTA INICIADA")
-        print_terminal_separator()
-        print("=== FASES 1-5: ANÁLISIS Y RECOMENDACIONES ===")
-        print(f"📋 Session ID: {session_id}")
-        print("🔄 Iniciando evaluación dual RNA + RAG...")
+        log_banner(
+            "🌿 NUEVA CONSULTA INICIADA",
+            TERMINAL_SEPARATOR,
+            "=== FASES 1-5: ANÁLISIS Y RECOMENDACIONES ===",
+            f"📋 Session ID: {session_id}",
+            "🔄 Iniciando evaluación dual RNA + RAG..."
+        )
+
+# Bloque fijo del análisis de precisión; las secciones de recomendaciones llegan ya armadas
+PRECISION_ANALYSIS_TEMPLATE = "\n".join((
+    "🧠 ANÁLISIS DE PRECISIÓN DEL SISTEMA",
+    TERMINAL_SEPARATOR,
+    "📊 Session ID: {session_id}",
+    "🎯 Sistema Elegido: {selected_system}",
+    "💡 Razón de Selección: {selection_reason}",
+    "",
+    "📈 PRECISIÓN DE SISTEMAS:",
+    "   🤖 RNA (Red Neuronal): {rna:.4f} ({rna_percent:.2f}%)",
+    "   📚 RAG (Retrieval-Aug): {rag:.4f} ({rag_percent:.2f}%)",
+    "   📊 Diferencia: {difference:.4f}",
+    "   🏆 Ganador: {winner}{margin}",
+    "",
+    "{rna_section}{rag_section}"
+))
 
 def print_precision_analysis(response: Dict[str, Any]):
-    """Imprime análisis detallado de precisión en la terminal"""
-    print_terminal_separator()
-    print("🧠 ANÁLISIS DE PRECISIÓN DEL SISTEMA")
-    print_terminal_separator()
+    """Registra análisis detallado de precisión en un solo bloque"""
+    if not logger.isEnabledFor(logging.INFO):
+        return
     
-    # Información básica
-    print(f"📊 Session ID: {response.get('session_id', 'N/A')}")
-    print(f"🎯 Sistema Elegido: {response.get('selected_system', 'N/A')}")
-    print(f"💡 Razón de Selección: {response.get('selection_reason', 'N/A')}")
-    print()
-    
-    # Precisiones
+    # Precisiones y ganador, calculados una sola vez
     rna_precision = response.get('rna_precision', 0)
     rag_precision = response.get('rag_precision', 0)
-    
-    print("📈 PRECISIÓN DE SISTEMAS:")
-    print(f"   🤖 RNA (Red Neuronal): {rna_precision:.4f} ({rna_precision*100:.2f}%)")
-    print(f"   📚 RAG (Retrieval-Aug): {rag_precision:.4f} ({rag_precision*100:.2f}%)")
-    print(f"   📊 Diferencia: {abs(rna_precision - rag_precision):.4f}")
-    
-    # Determinar ganador
-    if rna_precision > rag_precision:
-        winner = "RNA"
-        margin = rna_precision - rag_precision
-    elif rag_precision > rna_precision:
-        winner = "RAG"
-        margin = rag_precision - rna_precision
-    else:
-        winner = "EMPATE"
-        margin = 0
-    
-    print(f"   🏆 Ganador: {winner}" + (f" (margen: {margin:.4f})" if margin > 0 else ""))
-    print()
+    difference = rna_precision - rag_precision
+    winner = "RNA" if difference > 0 else "RAG" if difference < 0 else "EMPATE"
     
     # Recomendaciones RNA
     rna_recs = response.get('rna_recommendations', [])
-    if rna_recs:
-        print("🤖 RECOMENDACIONES RNA:")
-        for i, plant in enumerate(rna_recs, 1):
-            print(f"   {i}. {plant.get('name', 'N/A')} ({plant.get('scientific_name', 'N/A')})")
-            print(f"      Confianza: {plant.get('confidence', 0):.3f}")
+    rna_section = "".join(
+        f"   {i}. {plant.get('name', 'N/A')} ({plant.get('scientific_name', 'N/A')})\n"
+        f"      Confianza: {plant.get('confidence', 0):.3f}\n"
+        for i, plant in enumerate(rna_recs, 1)
+    )
+    if rna_section:
+        rna_section = "🤖 RECOMENDACIONES RNA:\n" + rna_section
     
-    print()
-    
-    # Recomendaciones RAG
+    # Recomendaciones RAG: solo las primeras líneas para no saturar (sin partir todo el texto)
     rag_recs = response.get('rag_recommendations', '')
+    rag_section = ""
     if rag_recs:
-        print("📚 RECOMENDACIONES RAG:")
-        # Mostrar solo las primeras líneas para no saturar
-        rag_lines = rag_recs.split('\n')[:3]
-        for line in rag_lines:
-            if line.strip():
-                print(f"   {line.strip()}")
-        if len(rag_lines) > 3:
-            print("   ...")
+        rag_section = "\n📚 RECOMENDACIONES RAG:" + "".join(
+            f"\n   {line.strip()}" for line in rag_recs.split('\n', 3)[:3] if line.strip()
+        )
     
-    print_terminal_separator()
+    log_banner(PRECISION_ANALYSIS_TEMPLATE.format(
+        session_id=response.get('session_id', 'N/A'),
+        selected_system=response.get('selected_system', 'N/A'),
+        selection_reason=response.get('selection_reason', 'N/A'),
+        rna=rna_precision,
+        rna_percent=rna_precision * 100,
+        rag=rag_precision,
+        rag_percent=rag_precision * 100,
+        difference=abs(difference),
+        winner=winner,
+        margin=f" (margen: {abs(difference):.4f})" if difference else "",
+        rna_section=rna_section,
+        rag_section=rag_section
+    ))
 
 def print_detailed_preparation_summary(selected_plant: str, response: Dict[str, Any], session_id: str):
     """
-    Imprime resumen de la preparación detallada generada
+    Registra resumen de la preparación detallada generada
     """
-    print_terminal_separator()
-    print("💊 PREPARACIÓN DETALLADA COMPLETADA")
-    print_terminal_separator()
-    print(f"🌱 Planta seleccionada: {selected_plant.title()}")
-    print(f"📋 Session ID: {session_id}")
-    print(f"📄 Método utilizado: RAG (Preparación detallada)")
-    print(f"📝 Longitud de respuesta: {len(response.get('answer', ''))} caracteres")
-    print(f"✅ Estado: Preparación generada exitosamente")
-    print()
-    print("📋 Contenido incluye:")
-    print("   • Nombre científico y propiedades")
-    print("   • Parte de la planta a utilizar")  
-    print("   • Forma de preparación detallada")
-    print("   • Dosis y frecuencia recomendada")
-    print("   • Duración del tratamiento")
-    print("   • Precauciones y efectos secundarios")
-    print_terminal_separator()
+    log_banner(
+        "💊 PREPARACIÓN DETALLADA COMPLETADA",
+        TERMINAL_SEPARATOR,
+        f"🌱 Planta seleccionada: {selected_plant.title()}",
+        f"📋 Session ID: {session_id}",
+        f"📄 Método utilizado: RAG (Preparación detallada)",
+        f"📝 Longitud de respuesta: {len(response.get('answer', ''))} caracteres",
+        f"✅ Estado: Preparación generada exitosamente",
+        "",
+        "📋 Contenido incluye:",
+        "   • Nombre científico y propiedades",
+        "   • Parte de la planta a utilizar",
+        "   • Forma de preparación detallada",
+        "   • Dosis y frecuencia recomendada",
+        "   • Duración del tratamiento",
+        "   • Precauciones y efectos secundarios"
+    )
 
 async def get_user_data_from_db(username: str) -> Optional[Dict[str, Any]]:
     """
     Recupera los datos del usuario desde la base de datos usando el username
     """
-    conn = None
-    cursor = None
+    user_data = _user_cache.get(username)
+    if user_data is not None:
+        return user_data
     try:
-        conn = psycopg2.connect(
-            dbname=os.getenv("DATABASE_URL") or os.getenv("DB_NAME"),
-            user=os.getenv("DB_USER"),            
-            password=os.getenv("DB_PASSWORD"),    
-            host=os.getenv("DB_HOST"),            
-            port=os.getenv("DB_PORT", "5432")          
-        )
-        cursor = conn.cursor()
-        
         # Consulta para obtener datos del usuario
         query = """
         SELECT full_name, email, username, dni, phone_number, age, gender, 
@@ -373,8 +430,10 @@ async def get_user_data_from_db(username: str) -> Optional[Dict[str, Any]]:
         WHERE username = %s
         """
         
-        cursor.execute(query, (username,))
-        result = cursor.fetchone()
+        pool = await get_db_pool()
+        async with pool.connection() as conn:
+            cursor = await conn.execute(query, (username,), prepare=True)
+            result = await cursor.fetchone()
         
         if result:
             # Mapear resultado a diccionario
@@ -392,22 +451,26 @@ async def get_user_data_from_db(username: str) -> Optional[Dict[str, Any]]:
                 'occupation': result[10],
                 'education_level': result[11]
             }
-            logger.info(f"📋 Datos del usuario {username} recuperados exitosamente")
+            logger.info("📋 Datos del usuario %s recuperados exitosamente", username)
+            _user_cache[username] = user_data
             return user_data
         else:
-            logger.warning(f"⚠️  Usuario {username} no encontrado en la base de datos")
+            logger.warning("⚠️  Usuario %s no encontrado en la base de datos", username)
             return None
             
     except Exception as e:
-        logger.error(f"❌ Error consultando datos del usuario {username}: {str(e)}")
+        logger.error("❌ Error consultando datos del usuario %s: %s", username, e)
         return None
-    finally:
-        if cursor:
-            cursor.close()
-        if conn:
-            conn.close()
             
 async def get_current_user(token: str = Depends(oauth2_scheme)):
+    key = hashlib.sha256(token.encode('utf-8')).digest()
+    cached = _jwt_cache.get(key)
+    if cached is not None:
+        username, expires_at = cached
+        if expires_at is None or expires_at > time.time():
+            return username
+        # Expiró dentro de la ventana del caché: se descarta y jwt.decode lo rechaza abajo
+        _jwt_cache.pop(key, None)
     try:
         payload = jwt.decode(token, SECRET_KEY, algorithms=[ALGORITHM])
         username: str = payload.get("sub")
@@ -417,6 +480,7 @@ async def get_current_user(token: str = Depends(oauth2_scheme)):
                 detail="Invalid authentication credentials",
                 headers={"WWW-Authenticate": "Bearer"},
             )
+        _jwt_cache[key] = (username, payload.get("exp"))
         return username
     except JWTError:
         raise HTTPException(
@@ -425,6 +489,41 @@ async def get_current_user(token: str = Depends(oauth2_scheme)):
             headers={"WWW-Authenticate": "Bearer"},
         )
             
+async def apply_user_context(consultation: PatientConsultation) -> None:
+    """Completa patient_info con los datos del usuario en la base de datos y la session_id"""
+    # Recuperar información del usuario desde la base de datos
+    user_id = consultation.patient_info.get('user_id')
+    if user_id:
+        user_data = await get_user_data_from_db(user_id)
+        if user_data:
+            # Actualizar patient_info con datos reales del usuario
+            consultation.patient_info.update({
+                'age': user_data.get('age', 30),
+                'gender': user_data.get('gender', 'Not specified'),
+                'zone': user_data.get('zone', 'Lima'),
+                'weight': user_data.get('weight'),
+                'height': user_data.get('height'),
+                'full_name': user_data.get('full_name'),
+                'phone_number': user_data.get('phone_number')
+            })
+            logger.info("✅ Datos del usuario recuperados: Edad: %s, Género: %s, Zona: %s", user_data.get('age'), user_data.get('gender'), user_data.get('zone'))
+        else:
+            logger.warning("⚠️  No se encontraron datos para el usuario: %s", user_id)
+            # Solo asignar defaults si no se encontró el usuario
+            consultation.patient_info.setdefault('age', 30)
+            consultation.patient_info.setdefault('gender', 'Not specified')
+            consultation.patient_info.setdefault('zone', 'Lima')
+    else:
+        logger.warning("⚠️  No se proporcionó user_id, usando valores por defecto")
+        # Solo asignar defaults si no hay user_id
+        consultation.patient_info.setdefault('age', 30)
+        consultation.patient_info.setdefault('gender', 'Not specified')
+        consultation.patient_info.setdefault('zone', 'Lima')
+    
+    # Si hay una session_id, asegurarse de que esté incluida en patient_info
+    if consultation.session_id:
+        consultation.patient_info['session_id'] = consultation.session_id
+
 @app.post("/rag/chat")
 async def chat_endpoint(
     consultation: PatientConsultation,
@@ -447,65 +546,37 @@ async def chat_endpoint(
         )
         
         # LOGGING CONTEXTUAL
-        logger.info(f"📥 Session ID: {consultation.session_id}")
-        logger.info(f"🔄 Estado: {consultation_state}")
-        logger.info(f"👤 User ID: {consultation.patient_info.get('user_id', 'N/A')}")
-        logger.info(f"🩺 Síntomas: {consultation.patient_info.get('symptoms', 'N/A')}")
+        logger.info("📥 Session ID: %s", consultation.session_id)
+        logger.info("🔄 Estado: %s", consultation_state)
+        logger.info("👤 User ID: %s", consultation.patient_info.get('user_id', 'N/A'))
+        logger.info("🩺 Síntomas: %s", consultation.patient_info.get('symptoms', 'N/A'))
         
         if consultation_state == "PLANT_SELECTION":
-            logger.info(f"🌱 Planta seleccionada: {consultation.selected_plant}")
+            logger.info("🌱 Planta seleccionada: %s", consultation.selected_plant)
             
-            # VALIDAR PLANTA SELECCIONADA
-            is_valid, validation_msg = validate_plant_selection(
-                consultation.selected_plant, 
-                consultation.session_id
+            # VALIDAR PLANTA SELECCIONADA, a la vez que se recuperan los datos del usuario
+            # (son consultas independientes a la base de datos)
+            (is_valid, validation_msg), _ = await asyncio.gather(
+                validate_plant_selection(
+                    consultation.selected_plant, 
+                    consultation.session_id
+                ),
+                apply_user_context(consultation)
             )
             
             if not is_valid:
-                logger.error(f"❌ Validación falló: {validation_msg}")
+                logger.error("❌ Validación falló: %s", validation_msg)
                 raise HTTPException(
                     status_code=400, 
                     detail=f"Planta inválida: {validation_msg}"
                 )
             else:
-                logger.info(f"✅ Validación exitosa: {validation_msg}")
+                logger.info("✅ Validación exitosa: %s", validation_msg)
         else:
             logger.info("🔍 Iniciando análisis dual RNA + RAG")
+            await apply_user_context(consultation)
         
-        # Recuperar información del usuario desde la base de datos
-        user_id = consultation.patient_info.get('user_id')
-        if user_id:
-            user_data = await get_user_data_from_db(user_id)
-            if user_data:
-                # Actualizar patient_info con datos reales del usuario
-                consultation.patient_info.update({
-                    'age': user_data.get('age', 30),
-                    'gender': user_data.get('gender', 'Not specified'),
-                    'zone': user_data.get('zone', 'Lima'),
-                    'weight': user_data.get('weight'),
-                    'height': user_data.get('height'),
-                    'full_name': user_data.get('full_name'),
-                    'phone_number': user_data.get('phone_number')
-                })
-                logger.info(f"✅ Datos del usuario recuperados: Edad: {user_data.get('age')}, Género: {user_data.get('gender')}, Zona: {user_data.get('zone')}")
-            else:
-                logger.warning(f"⚠️  No se encontraron datos para el usuario: {user_id}")
-                # Solo asignar defaults si no se encontró el usuario
-                consultation.patient_info.setdefault('age', 30)
-                consultation.patient_info.setdefault('gender', 'Not specified')
-                consultation.patient_info.setdefault('zone', 'Lima')
-        else:
-            logger.warning("⚠️  No se proporcionó user_id, usando valores por defecto")
-            # Solo asignar defaults si no hay user_id
-            consultation.patient_info.setdefault('age', 30)
-            consultation.patient_info.setdefault('gender', 'Not specified')
-            consultation.patient_info.setdefault('zone', 'Lima')
-        
-        # Si hay una session_id, asegurarse de que esté incluida en patient_info
-        if consultation.session_id:
-            consultation.patient_info['session_id'] = consultation.session_id
-        
-        print("\n🔄 INICIANDO PROCESAMIENTO...")
+        logger.info("🔄 INICIANDO PROCESAMIENTO...")
         
         # Llamar directamente a process_consultation_with_safety con la planta seleccionada
         response = await process_consultation_with_safety(
@@ -514,7 +585,7 @@ async def chat_endpoint(
         )
         
         if "error" in response:
-            logger.error(f"❌ Error en process_consultation_with_safety: {response['error']}")
+            logger.error("❌ Error en process_consultation_with_safety: %s", response['error'])
             raise HTTPException(status_code=500, detail=response["error"])
         
         # Asegurarse de que la respuesta contiene todos los campos necesarios
@@ -537,97 +608,108 @@ async def chat_endpoint(
         return response
         
     except HTTPException as e:
-        logger.error(f"❌ HTTPException: {e.detail}")
-        print_terminal_separator()
-        print(f"❌ ERROR HTTP: {e.detail}")
-        print_terminal_separator()
+        logger.error("❌ HTTPException: %s", e.detail)
+        log_banner(f"❌ ERROR HTTP: {e.detail}")
         raise e
     except Exception as e:
-        logger.error(f"❌ Error inesperado: {str(e)}")
-        print_terminal_separator()
-        print(f"❌ ERROR INESPERADO: {str(e)}")
-        print_terminal_separator()
+        logger.error("❌ Error inesperado: %s", e)
+        log_banner(f"❌ ERROR INESPERADO: {str(e)}")
         traceback.print_exc()
         raise HTTPException(status_code=500, detail=str(e))
 
+@app.post("/rag/chat/stream")
+async def chat_stream_endpoint(
+    consultation: PatientConsultation,
+    current_user: str = Depends(get_current_user)
+):
+    """
+    Igual que /rag/chat pero como Server-Sent Events: la preparación de la planta llega
+    por fragmentos a medida que OpenAI la genera, y un evento "end" cierra la respuesta
+    """
+    consultation.patient_info['user_id'] = current_user
+    consultation_state, _ = detect_consultation_state(
+        consultation.selected_plant, 
+        consultation.session_id
+    )
+    
+    if consultation_state == "PLANT_SELECTION":
+        (is_valid, validation_msg), _ = await asyncio.gather(
+            validate_plant_selection(
+                consultation.selected_plant, 
+                consultation.session_id
+            ),
+            apply_user_context(consultation)
+        )
+        if not is_valid:
+            logger.error("❌ Validación falló: %s", validation_msg)
+            raise HTTPException(
+                status_code=400, 
+                detail=f"Planta inválida: {validation_msg}"
+            )
+    else:
+        await apply_user_context(consultation)
+    
+    async def events():
+        try:
+            async for text in stream_consultation_with_safety(
+                patient_info=consultation.patient_info,
+                selected_plant=consultation.selected_plant
+            ):
+                yield {"event": "message", "data": text}
+        except Exception as e:
+            logger.error("❌ Error en streaming: %s", e)
+            yield {"event": "error", "data": str(e)}
+        yield {"event": "end", "data": consultation.patient_info.get('session_id', '')}
+    
+    return EventSourceResponse(events())
+
 @app.post("/feedback")
 async def save_feedback(feedback: FeedbackRequest):
     try:
-        print_terminal_separator()
-        print("📝 GUARDANDO FEEDBACK")
-        print_terminal_separator()
+        log_banner("📝 GUARDANDO FEEDBACK")
         
         # Validar que session_id es un UUID válido
         try:
             session_uuid = uuid.UUID(feedback.session_id)
-            logger.info(f"📋 Session ID válido: {session_uuid}")
+            logger.info("📋 Session ID válido: %s", session_uuid)
         except ValueError:
-            logger.error(f"❌ Session ID inválido: {feedback.session_id}")
+            logger.error("❌ Session ID inválido: %s", feedback.session_id)
             raise HTTPException(
                 status_code=400,
                 detail="Invalid session_id format"
             )
         
-        conn = psycopg2.connect(
-            dbname=os.getenv("DATABASE_URL") or os.getenv("DB_NAME"),
-            user=os.getenv("DB_USER"),            
-            password=os.getenv("DB_PASSWORD"),    
-            host=os.getenv("DB_HOST"),            
-            port=os.getenv("DB_PORT", "5432")        
-        )
-        cursor = conn.cursor()
-        
-        # Modificar la consulta para usar UUID
-        cursor.execute(
-            """
-            SELECT id FROM treatment_feedback 
-            WHERE CAST(session_id AS VARCHAR) = %s
-            """,
-            (str(session_uuid),)
-        )
-        existing_feedback = cursor.fetchone()
-        
-        if existing_feedback:
-            logger.info("🔄 Actualizando feedback existente")
-            update_query = """
-            UPDATE treatment_feedback 
-            SET effectiveness_rating = %s,
-                side_effects = %s,
-                improvement_time = %s,
-                additional_comments = %s,
-                updated_at = CURRENT_TIMESTAMP
-            WHERE CAST(session_id AS VARCHAR) = %s
-            """
-            cursor.execute(update_query, (
-                feedback.effectiveness_rating,
-                feedback.side_effects,
-                feedback.improvement_time,
-                feedback.additional_comments,
-                str(session_uuid)
-            ))
-        else:
-            logger.info("➕ Creando nuevo feedback")
-            insert_query = """
-            INSERT INTO treatment_feedback 
-                (session_id, effectiveness_rating, side_effects, improvement_time, 
-                 additional_comments, created_at)
-            VALUES 
-                (%s, %s, %s, %s, %s, CURRENT_TIMESTAMP)
-            """
-            cursor.execute(insert_query, (
-                str(session_uuid),
-                feedback.effectiveness_rating,
-                feedback.side_effects,
-                feedback.improvement_time,
-                feedback.additional_comments
-            ))
+        pool = await get_db_pool()
+        # La conexión vuelve al pool al salir del bloque, con commit si no hubo errores
+        async with pool.connection() as conn:
+            if _feedback_upsert_ready:
+                await conn.execute(UPSERT_FEEDBACK_SQL, (
+                    str(session_uuid),
+                    feedback.effectiveness_rating,
+                    feedback.side_effects,
+                    feedback.improvement_time,
+                    feedback.additional_comments
+                ), prepare=True)
+            else:
+                cursor = await conn.execute(UPDATE_FEEDBACK_SQL, (
+                    feedback.effectiveness_rating,
+                    feedback.side_effects,
+                    feedback.improvement_time,
+                    feedback.additional_comments,
+                    str(session_uuid)
+                ))
+                if cursor.rowcount == 0:
+                    await conn.execute(INSERT_FEEDBACK_SQL, (
+                        str(session_uuid),
+                        feedback.effectiveness_rating,
+                        feedback.side_effects,
+                        feedback.improvement_time,
+                        feedback.additional_comments
+                    ))
         
-        conn.commit()
         logger.info("✅ Feedback guardado correctamente")
         
-        print_terminal_separator()
-        print("✅ FEEDBACK GUARDADO EXITOSAMENTE")
-        print_terminal_separator()
+        log_banner("✅ FEEDBACK GUARDADO EXITOSAMENTE")
         
         return {
             "status": "success",
@@ -635,169 +717,150 @@ async def save_feedback(feedback: FeedbackRequest):
             "session_id": str(session_uuid)
         }
     except HTTPException as e:
-        logger.error(f"❌ Error HTTP en feedback: {e.detail}")
+        logger.error("❌ Error HTTP en feedback: %s", e.detail)
         raise e
     except Exception as e:
-        logger.error(f"❌ Error guardando feedback: {str(e)}")
-        print(f"❌ Error saving feedback: {str(e)}")
+        logger.error("❌ Error guardando feedback: %s", e)
         raise HTTPException(
             status_code=500,
             detail=f"Error al guardar el feedback: {str(e)}"
         )
-    finally:
-        if 'conn' in locals() and conn is not None:
-            if 'cursor' in locals() and cursor is not None:
-                cursor.close()
-            conn.close()
 
 @app.post("/api/register")
 async def register_user(user: UserRegistration):
-    connection = None
-    cursor = None
     try:
-        print_terminal_separator()
-        print("👤 REGISTRO DE NUEVO USUARIO")
-        print_terminal_separator()
+        log_banner("👤 REGISTRO DE NUEVO USUARIO")
         
-        connection = get_db_connection()
-        cursor = connection.cursor()
+        logger.info("📝 Registrando usuario: %s (%s)", user.username, user.email)
         
-        logger.info(f"📝 Registrando usuario: {user.username} ({user.email})")
-        
-        # Verificaciones de usuario existente
-        cursor.execute("SELECT username FROM personal_information WHERE username = %s", (user.username,))
-        if cursor.fetchone():
-            logger.warning(f"⚠️  Username ya existe: {user.username}")
-            raise HTTPException(status_code=400, detail="El nombre de usuario ya está en uso")
-            
-        cursor.execute("SELECT email FROM personal_information WHERE email = %s", (user.email,))
-        if cursor.fetchone():
-            logger.warning(f"⚠️  Email ya existe: {user.email}")
-            raise HTTPException(status_code=400, detail="El correo electrónico ya está registrado")
-            
-        cursor.execute("SELECT dni FROM personal_information WHERE dni = %s", (user.dni,))
-        if cursor.fetchone():
-            logger.warning(f"⚠️  DNI ya existe: {user.dni}")
-            raise HTTPException(status_code=400, detail="El DNI ya está registrado")
-            
-        cursor.execute("SELECT phone_number FROM personal_information WHERE phone_number = %s", (user.phoneNumber,))
-        if cursor.fetchone():
-            logger.warning(f"⚠️  Teléfono ya existe: {user.phoneNumber}")
-            raise HTTPException(status_code=400, detail="El número de teléfono ya está registrado")
-
-        # Hash de la contraseña
+        # Hash de la contraseña antes de tomar una conexión: bcrypt es lento a propósito,
+        # así que corre en un hilo para no bloquear el event loop
         password_bytes = user.password.encode('utf-8')
         salt = bcrypt.gensalt()
-        hashed_password = bcrypt.hashpw(password_bytes, salt).decode('utf-8')
-
-        INSERT_USER = """
-        INSERT INTO personal_information (
-            full_name, email, username, password_hash, dni, phone_number,
-            age, gender, weight, height, zone, education_level,
-            occupation, created_at, last_login
-        ) VALUES (
-            %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s
-        )
-        """
+        hashed_password = (await asyncio.to_thread(bcrypt.hashpw, password_bytes, salt)).decode('utf-8')
+
+        pool = await get_db_pool()
+        async with pool.connection() as conn:
+            # Verificaciones de usuario existente en una sola consulta; bool_or cubre
+            # coincidencias repartidas entre varios usuarios y se respeta el orden de los mensajes
+            cursor = await conn.execute(USER_CONFLICTS_SQL, {
+                'username': user.username,
+                'email': user.email,
+                'dni': user.dni,
+                'phone_number': user.phoneNumber
+            })
+            username_taken, email_taken, dni_taken, phone_taken = await cursor.fetchone()
+            if username_taken:
+                logger.warning("⚠️  Username ya existe: %s", user.username)
+                raise HTTPException(status_code=400, detail="El nombre de usuario ya está en uso")
+            if email_taken:
+                logger.warning("⚠️  Email ya existe: %s", user.email)
+                raise HTTPException(status_code=400, detail="El correo electrónico ya está registrado")
+            if dni_taken:
+                logger.warning("⚠️  DNI ya existe: %s", user.dni)
+                raise HTTPException(status_code=400, detail="El DNI ya está registrado")
+            if phone_taken:
+                logger.warning("⚠️  Teléfono ya existe: %s", user.phoneNumber)
+                raise HTTPException(status_code=400, detail="El número de teléfono ya está registrado")
+
+            INSERT_USER = """
+            INSERT INTO personal_information (
+                full_name, email, username, password_hash, dni, phone_number,
+                age, gender, weight, height, zone, education_level,
+                occupation, created_at, last_login
+            ) VALUES (
+                %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s
+            )
+            """
 
-        cursor.execute(INSERT_USER, (
-            user.fullName,
-            user.email,
-            user.username,
-            hashed_password,
-            user.dni,
-            user.phoneNumber,
-            user.age,
-            user.gender,
-            user.weight,
-            user.height,
-            user.zone,
-            user.occupation or 'No especificada',
-            'No especificada',
-            datetime.now(),
-            None
-        ))
-
-        connection.commit()
-        logger.info(f"✅ Usuario registrado exitosamente: {user.username}")
+            await conn.execute(INSERT_USER, (
+                user.fullName,
+                user.email,
+                user.username,
+                hashed_password,
+                user.dni,
+                user.phoneNumber,
+                user.age,
+                user.gender,
+                user.weight,
+                user.height,
+                user.zone,
+                user.occupation or 'No especificada',
+                'No especificada',
+                datetime.now(),
+                None
+            ))
+
+        _user_cache.pop(user.username, None)
+        logger.info("✅ Usuario registrado exitosamente: %s", user.username)
         
-        print_terminal_separator()
-        print(f"✅ USUARIO REGISTRADO: {user.username}")
-        print_terminal_separator()
+        log_banner(f"✅ USUARIO REGISTRADO: {user.username}")
         
         return {"message": "Usuario registrado exitosamente"}
 
     except HTTPException as e:
-        logger.error(f"❌ Error en registro: {e.detail}")
+        logger.error("❌ Error en registro: %s", e.detail)
         raise e
     except Exception as e:
-        logger.error(f"❌ Error registrando usuario: {str(e)}")
-        print(f"❌ Error registering user: {str(e)}")
+        logger.error("❌ Error registrando usuario: %s", e)
         traceback.print_exc()
         raise HTTPException(status_code=500, detail=f"Error al registrar usuario: {str(e)}")
-    finally:
-        if cursor is not None:
-            cursor.close()
-        if connection is not None:
-            connection.close()
 
 @app.post("/api/login")
 async def login(credentials: LoginCredentials):
-    connection = None
-    cursor = None
     try:
-        print_terminal_separator()
-        print("🔐 INTENTO DE LOGIN")
-        print_terminal_separator()
+        log_banner("🔐 INTENTO DE LOGIN")
         
-        connection = get_db_connection()
-        cursor = connection.cursor()
+        logger.info("👤 Intento de login para: %s", credentials.identifier)
 
-        logger.info(f"👤 Intento de login para: {credentials.identifier}")
-
-        cursor.execute(
-            "SELECT username, password_hash FROM personal_information WHERE username = %s",
-            (credentials.identifier,)
-        )
-        user = cursor.fetchone()
+        pool = await get_db_pool()
+        async with pool.connection() as conn:
+            cursor = await conn.execute(
+                "SELECT password_hash FROM personal_information WHERE username = %s",
+                (credentials.identifier,),
+                prepare=True
+            )
+            user = await cursor.fetchone()
 
         if not user:
-            logger.warning(f"⚠️  Usuario no encontrado: {credentials.identifier}")
+            logger.warning("⚠️  Usuario no encontrado: %s", credentials.identifier)
             raise HTTPException(
                 status_code=status.HTTP_401_UNAUTHORIZED,
                 detail="Usuario o contraseña incorrectos"
             )
 
-        username, stored_hash = user
+        # El username es el identificador con el que se encontró la fila
+        username = credentials.identifier
+        stored_hash, = user
 
         # Check if password matches using bcrypt
         password_bytes = credentials.password.encode('utf-8')
         stored_hash_bytes = stored_hash.encode('utf-8')
         
-        # Check if password matches
-        if not bcrypt.checkpw(password_bytes, stored_hash_bytes):
-            logger.warning(f"⚠️  Contraseña incorrecta para: {credentials.identifier}")
+        # Check if password matches (en un hilo y sin retener una conexión del pool mientras bcrypt calcula)
+        if not await asyncio.to_thread(bcrypt.checkpw, password_bytes, stored_hash_bytes):
+            logger.warning("⚠️  Contraseña incorrecta para: %s", credentials.identifier)
             raise HTTPException(
                 status_code=status.HTTP_401_UNAUTHORIZED,
                 detail="Usuario o contraseña incorrectos"
             )
 
-        cursor.execute(
-            "UPDATE personal_information SET last_login = %s WHERE username = %s",
-            (datetime.now(), username)
-        )
-        connection.commit()
+        async with pool.connection() as conn:
+            await conn.execute(
+                "UPDATE personal_information SET last_login = %s WHERE username = %s",
+                (datetime.now(), username),
+                prepare=True
+            )
+        _user_cache.pop(username, None)
 
         access_token_expires = timedelta(minutes=ACCESS_TOKEN_EXPIRE_MINUTES)
         access_token = create_access_token(
             data={"sub": username}, expires_delta=access_token_expires
         )
 
-        logger.info(f"✅ Login exitoso para: {username}")
+        logger.info("✅ Login exitoso para: %s", username)
         
-        print_terminal_separator()
-        print(f"✅ LOGIN EXITOSO: {username}")
-        print_terminal_separator()
+        log_banner(f"✅ LOGIN EXITOSO: {username}")
 
         return {
             "access_token": access_token,
@@ -806,21 +869,15 @@ async def login(credentials: LoginCredentials):
         }
 
     except HTTPException as e:
-        logger.error(f"❌ Error en login: {e.detail}")
+        logger.error("❌ Error en login: %s", e.detail)
         raise e
     except Exception as e:
-        logger.error(f"❌ Error inesperado en login: {str(e)}")
-        print(f"❌ Error in login: {str(e)}")
+        logger.error("❌ Error inesperado en login: %s", e)
         traceback.print_exc()
         raise HTTPException(
             status_code=status.HTTP_500_INTERNAL_SERVER_ERROR,
             detail=f"Error en el servidor: {str(e)}"
         )
-    finally:
-        if cursor is not None:
-            cursor.close()
-        if connection is not None:
-            connection.close()
 
 # Agregar este endpoint para verificar el estado del servidor
 @app.get("/health")
@@ -830,13 +887,12 @@ async def health_check():
     """
     try:
         # Probar conexión a la base de datos
-        connection = None
         try:
-            connection = get_db_connection()
-            cursor = connection.cursor()
-            cursor.execute("SELECT 1")
-            cursor.fetchone()
-            cursor.close()
+            pool = await get_db_pool()
+            # Sacar una conexión ya la verifica: el check del pool (app/db.py) hace un viaje al
+            # servidor al entregarla, así que no hace falta un SELECT 1 adicional
+            async with pool.connection():
+                pass
             
             return {
                 "status": "healthy",
@@ -844,82 +900,43 @@ async def health_check():
                 "message": "Server and database are running correctly"
             }
         except Exception as db_error:
-            logger.error(f"Database connection error: {db_error}")
+            logger.error("Database connection error: %s", db_error)
             return {
                 "status": "healthy",
                 "database": "disconnected",
                 "message": "Server is running but database connection failed",
                 "error": str(db_error)
-            }, 200
+            }
     except Exception as e:
-        logger.error(f"Health check failed: {e}")
-        return {
+        logger.error("Health check failed: %s", e)
+        # Una tupla (contenido, código) se serializaría como lista JSON con estado 200
+        return ORJSONResponse({
             "status": "unhealthy",
             "error": str(e)
-        }, 503
-    finally:
-        if connection:
-            connection.close()
+        }, status_code=503)
+
+# El entorno no cambia durante la vida del proceso: la respuesta se arma una vez al importar
+DEBUG_ENV = {
+    "DB_HOST": os.getenv("DB_HOST"),
+    "DB_NAME": os.getenv("DB_NAME"),
+    "DB_USER": os.getenv("DB_USER"),
+    "DB_PORT": os.getenv("DB_PORT"),
+    "NODE_ENV": os.getenv("NODE_ENV"),
+    "PORT": os.getenv("PORT"),
+    "DATABASE_URL_SET": bool(os.getenv("DATABASE_URL")),
+    # No mostrar valores sensibles como passwords
+}
 
-def get_db_connection():
-    """Establece conexión con la base de datos PostgreSQL"""
-    try:
-        database_url = os.getenv("DATABASE_URL")
-        
-        if database_url:
-            # Render usa URLs en formato postgres:// que psycopg2 no soporta directamente
-            if database_url.startswith("postgres://"):
-                database_url = database_url.replace("postgres://", "postgresql://", 1)
-            
-            # Parsear la URL para extraer los componentes
-            import urllib.parse
-            parsed = urllib.parse.urlparse(database_url)
-            
-            # Extraer componentes de la URL
-            return psycopg2.connect(
-                host=parsed.hostname,
-                port=parsed.port or 5432,
-                user=parsed.username,
-                password=parsed.password,
-                database=parsed.path.lstrip('/')  # Remover el '/' inicial
-            )
-        
-        # Fallback para desarrollo local
-        return psycopg2.connect(
-            dbname=os.getenv("DB_NAME", "postgres"),
-            user=os.getenv("DB_USER", "postgres"),
-            password=os.getenv("DB_PASSWORD", ""),
-            host=os.getenv("DB_HOST", "localhost"),
-            port=os.getenv("DB_PORT", "5432")
-        )
-    except Exception as e:
-        logger.error(f"❌ Error conectando a la base de datos: {str(e)}")
-        logger.error(f"DATABASE_URL: {os.getenv('DATABASE_URL')}")
-        raise
-        
 # Endpoint para verificar variables de entorno (útil para debugging)
 @app.get("/debug/env")
 async def debug_env():
     """
     Endpoint para verificar las variables de entorno (solo para debugging)
     """
-    return {
-        "DB_HOST": os.getenv("DB_HOST"),
-        "DB_NAME": os.getenv("DB_NAME"),
-        "DB_USER": os.getenv("DB_USER"),
-        "DB_PORT": os.getenv("DB_PORT"),
-        "NODE_ENV": os.getenv("NODE_ENV"),
-        "PORT": os.getenv("PORT"),
-        "DATABASE_URL_SET": bool(os.getenv("DATABASE_URL")),
-        # No mostrar valores sensibles como passwords
-    }
+    return DEBUG_ENV
 
-@app.get("/", response_class=HTMLResponse)
-async def welcome_page():
-    """
-    Página de bienvenida HTML para el servidor
-    """
-    html_content = """
+# La página de bienvenida es estática: se codifica una vez y los navegadores la guardan una hora
+WELCOME_PAGE_HTML = """
     <!DOCTYPE html>
     <html>
     <head>
@@ -978,20 +995,35 @@ async def welcome_page():
         </div>
     </body>
     </html>
+    """.encode("utf-8")
+WELCOME_PAGE_HEADERS = {"Cache-Control": "public, max-age=3600"}
+
+@app.get("/", response_class=HTMLResponse)
+async def welcome_page():
+    """
+    Página de bienvenida HTML para el servidor
     """
-    return HTMLResponse(content=html_content)
+    return HTMLResponse(content=WELCOME_PAGE_HTML, headers=WELCOME_PAGE_HEADERS)
 
 def run():
     import uvicorn
-    print_terminal_separator()
-    print("🚀 INICIANDO SERVIDOR PlantMedicator")
-    print("🌿 Sistema de Recomendación de Plantas Medicinales")
-    print("📊 Con análisis dual RNA + RAG")
-    print_terminal_separator()
+    log_banner(
+        "🚀 INICIANDO SERVIDOR PlantMedicator",
+        "🌿 Sistema de Recomendación de Plantas Medicinales",
+        "📊 Con análisis dual RNA + RAG"
+    )
 
     # Para Render: usar puerto dinámico
     port = int(os.getenv("PORT", 8000))
-    uvicorn.run("app.server:app", host="0.0.0.0", port=port, reload=True)
+    # Recarga automática solo en desarrollo (DEV); en producción, WEB_CONCURRENCY procesos. Cada
+    # proceso abre su propio pool (hasta DB_POOL_MAX_SIZE conexiones) y carga su recomendador
+    reload = bool(os.getenv("DEV"))
+    workers = 1 if reload else int(os.getenv("WEB_CONCURRENCY", "1"))
+    # "auto" usa uvloop y httptools cuando están instalados (no en Windows) y asyncio/h11 si no
+    uvicorn.run(
+        "app.server:app", host="0.0.0.0", port=port, reload=reload, workers=workers,
+        loop="auto", http="auto"
+    )
 
 if __name__ == "__main__":
     run()
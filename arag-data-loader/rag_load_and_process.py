@@ -1,7 +1,15 @@
+import asyncio
 import os
+import uuid
+from concurrent.futures import ProcessPoolExecutor
+from pathlib import Path
+from typing import List
 
+import psycopg
+from psycopg.types.json import Json
 from dotenv import load_dotenv
-from langchain_community.document_loaders import DirectoryLoader, UnstructuredPDFLoader
+from tqdm import tqdm
+from langchain_community.document_loaders import UnstructuredPDFLoader
 from langchain_community.vectorstores.pgvector import PGVector
 from langchain_experimental.text_splitter import SemanticChunker
 from langchain_text_splitters import RecursiveCharacterTextSplitter
@@ -9,36 +17,102 @@ from langchain_openai import OpenAIEmbeddings
 from langchain.schema import Document
 
 
-load_dotenv()
+PDF_DIR = os.path.abspath("C:/Users/Fytli/OneDrive/Escritorio/plant_medicator_venv/plant-medicator/pdf-books")
 
-loader = DirectoryLoader(
-    os.path.abspath("C:/Users/Fytli/OneDrive/Escritorio/plant_medicator_venv/plant-medicator/pdf-books"),
-    glob="**/*.pdf",
-    use_multithreading=True,
-    show_progress=True,
-    max_concurrency=50,
-    loader_cls=UnstructuredPDFLoader,
-)
-docs = loader.load()
+# Textos por petición a la API de embeddings y peticiones simultáneas al vectorizar los chunks
+EMBED_BATCH_SIZE = 512
+EMBED_CONCURRENCY = 8
 
-embeddings = OpenAIEmbeddings(model='text-embedding-ada-002', )
+COLLECTION_NAME = "collection164"
 
-text_splitter = SemanticChunker(
-    embeddings=embeddings
-)
+# Columnas de la tabla de embeddings de PGVector (langchain-community) que llena el COPY
+COPY_EMBEDDINGS_SQL = """
+COPY langchain_pg_embedding (uuid, collection_id, embedding, document, cmetadata, custom_id)
+FROM STDIN
+"""
 
-#flattened_docs = [doc[0] for doc in docs if doc]
-#flattened_docs = [doc.page_content for doc in docs if doc.page_content]
-# Crear nuevamente objetos Document de cada contenido textual
-flattened_docs = [Document(page_content=doc.page_content) for doc in docs if doc.page_content]
 
+def load_pdf(path: str) -> List[Document]:
+    """Carga un PDF; se ejecuta en un proceso aparte porque el parseo de unstructured es CPU y retiene el GIL"""
+    return UnstructuredPDFLoader(path).load()
 
-chunks = text_splitter.split_documents(flattened_docs)
 
-PGVector.from_documents(
-    documents=chunks,
-    embedding=embeddings,
-    collection_name="collection164",
-    connection_string=f"postgresql+psycopg://{os.getenv('DB_USER')}:{os.getenv('DB_PASSWORD')}@{os.getenv('DB_HOST')}:{os.getenv('DB_PORT')}/{os.getenv('DB_NAME')}",
-    pre_delete_collection=True,
-)
\ No newline at end of file
+def load_pdfs(directory: str) -> List[Document]:
+    """Carga todos los PDF del directorio en paralelo, un proceso por núcleo, en orden de ruta"""
+    paths = sorted(str(path) for path in Path(directory).rglob("*.pdf"))
+    docs = []
+    with ProcessPoolExecutor(max_workers=os.cpu_count()) as executor:
+        for loaded in tqdm(executor.map(load_pdf, paths), total=len(paths)):
+            docs.extend(loaded)
+    return docs
+
+
+async def embed_texts(embeddings: OpenAIEmbeddings, texts: List[str]) -> List[List[float]]:
+    """Embeddings de los textos en lotes de EMBED_BATCH_SIZE, con varias peticiones en vuelo a la vez"""
+    semaphore = asyncio.Semaphore(EMBED_CONCURRENCY)
+
+    async def embed_batch(batch: List[str]) -> List[List[float]]:
+        async with semaphore:
+            return await embeddings.aembed_documents(batch)
+
+    batches = [texts[i:i + EMBED_BATCH_SIZE] for i in range(0, len(texts), EMBED_BATCH_SIZE)]
+    results = await asyncio.gather(*(embed_batch(batch) for batch in batches))
+    return [vector for batch in results for vector in batch]
+
+
+def copy_embeddings(texts: List[str], vectors: List[List[float]], metadatas: List[dict]) -> None:
+    """
+    Inserta todos los chunks de la colección con un solo COPY en lugar de un INSERT por chunk.
+    La colección y las tablas ya deben existir (las crea PGVector al inicializarse).
+    """
+    with psycopg.connect(
+        dbname=os.getenv('DB_NAME'), user=os.getenv('DB_USER'), password=os.getenv('DB_PASSWORD'),
+        host=os.getenv('DB_HOST'), port=os.getenv('DB_PORT')
+    ) as conn:
+        collection_id, = conn.execute(
+            "SELECT uuid FROM langchain_pg_collection WHERE name = %s", (COLLECTION_NAME,)
+        ).fetchone()
+        with conn.cursor().copy(COPY_EMBEDDINGS_SQL) as copy:
+            for text, vector, metadata in zip(texts, vectors, metadatas):
+                # Formato de texto de pgvector: [x1,x2,...]
+                copy.write_row((
+                    uuid.uuid4(), collection_id, "[" + ",".join(map(str, vector)) + "]",
+                    text, Json(metadata), str(uuid.uuid4())
+                ))
+
+
+def main():
+    load_dotenv()
+
+    docs = load_pdfs(PDF_DIR)
+
+    embeddings = OpenAIEmbeddings(model='text-embedding-3-small', chunk_size=EMBED_BATCH_SIZE, max_retries=6)
+
+    text_splitter = SemanticChunker(
+        embeddings=embeddings
+    )
+
+    #flattened_docs = [doc[0] for doc in docs if doc]
+    #flattened_docs = [doc.page_content for doc in docs if doc.page_content]
+    # Crear nuevamente objetos Document de cada contenido textual
+    flattened_docs = [Document(page_content=doc.page_content) for doc in docs if doc.page_content]
+
+
+    chunks = text_splitter.split_documents(flattened_docs)
+
+    texts = [chunk.page_content for chunk in chunks]
+    vectors = asyncio.run(embed_texts(embeddings, texts))
+
+    # PGVector solo prepara el esquema y vacía la colección; las filas se cargan con COPY
+    PGVector(
+        embedding_function=embeddings,
+        collection_name=COLLECTION_NAME,
+        connection_string=f"postgresql+psycopg://{os.getenv('DB_USER')}:{os.getenv('DB_PASSWORD')}@{os.getenv('DB_HOST')}:{os.getenv('DB_PORT')}/{os.getenv('DB_NAME')}",
+        pre_delete_collection=True,
+    )
+    copy_embeddings(texts, vectors, [chunk.metadata for chunk in chunks])
+
+
+# Los procesos del pool reimportan este módulo (spawn en Windows): la carga solo corre en el principal
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,22 @@
+-- Índice único sobre treatment_feedback.session_id, necesario para el upsert de POST /feedback
+-- (INSERT ... ON CONFLICT (session_id)). Migración única, fuera del arranque del servidor:
+--
+--     psql "$DATABASE_URL" -v ON_ERROR_STOP=1 -f migrations/001_treatment_feedback_session_unique.sql
+--
+-- El antiguo SELECT-luego-INSERT pudo dejar varias filas por sesión; se conserva la más reciente.
+-- Todo ocurre en una transacción: si la creación del índice falla, no se borra ninguna fila.
+
+BEGIN;
+
+-- Bloquea escrituras concurrentes entre la deduplicación y la creación del índice
+LOCK TABLE treatment_feedback IN SHARE ROW EXCLUSIVE MODE;
+
+DELETE FROM treatment_feedback tf
+USING treatment_feedback newer
+WHERE tf.session_id = newer.session_id
+  AND tf.id < newer.id;
+
+CREATE UNIQUE INDEX IF NOT EXISTS treatment_feedback_session_id_key
+ON treatment_feedback (session_id);
+
+COMMIT;
@@ -0,0 +1,15 @@
+-- Índice de cobertura por username: el perfil que lee get_user_data_from_db se resuelve con Index Only Scan.
+-- Migración única, fuera del arranque del servidor:
+--
+--     psql "$DATABASE_URL" -v ON_ERROR_STOP=1 -f migrations/002_personal_information_username_profile_idx.sql
+--
+-- CONCURRENTLY no bloquea las escrituras en la tabla; por eso cada sentencia va fuera de una transacción.
+
+CREATE INDEX CONCURRENTLY IF NOT EXISTS personal_information_username_profile_idx
+ON personal_information (username)
+INCLUDE (full_name, email, dni, phone_number, age, gender,
+         weight, height, zone, occupation, education_level);
+
+-- Versiones anteriores del servidor creaban al iniciar un segundo índice sobre username solo para
+-- el login; el login lee una sola fila y el índice duplicaba el coste de escritura
+DROP INDEX CONCURRENTLY IF EXISTS personal_information_username_login_idx;
@@ -0,0 +1,28 @@
+import pytest
+
+np = pytest.importorskip("numpy")
+pytest.importorskip("scipy")
+pytest.importorskip("ahocorasick")
+
+from app.hybrid_recommender import SimpleNeuralNetwork
+
+
+@pytest.fixture(scope="module")
+def nn():
+    return SimpleNeuralNetwork()
+
+
+def test_network_receives_exact_age(nn):
+    features = nn.preprocess_symptoms("dolor de cabeza", {'age': 44})
+    assert features[-1] == pytest.approx(0.44)
+
+
+def test_nearby_ages_are_not_merged(nn):
+    # 36 y 44 caían en la misma decena con el redondeo anterior
+    younger = nn._predict_core("dolor de cabeza", nn._patient_age({'age': 36}))
+    older = nn._predict_core("dolor de cabeza", nn._patient_age({'age': 44}))
+    assert not np.array_equal(younger, older)
+
+
+def test_missing_age_uses_default(nn):
+    assert nn.preprocess_symptoms("fiebre")[-1] == pytest.approx(0.3)
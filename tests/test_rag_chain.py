@@ -0,0 +1,40 @@
+import asyncio
+
+import pytest
+
+for _module in ("numpy", "joblib", "ahocorasick", "cachetools", "dotenv", "psycopg_pool"):
+    pytest.importorskip(_module)
+
+from app import rag_chain
+
+PATIENT = {
+    'symptoms': 'dolor de cabeza leve',
+    'duration': '2 días',
+    'allergies': 'ninguna',
+    'age': '30',
+    'gender': 'F',
+}
+
+
+@pytest.fixture
+def cached_response():
+    key = rag_chain._response_cache_key(rag_chain._normalize(PATIENT), PATIENT)
+    rag_chain._response_cache[key] = {
+        "answer": "Infusión de manzanilla",
+        "rna_recommendations": [{"plant": "manzanilla", "score": 0.9}],
+        "rag_recommendations": "Manzanilla (Matricaria chamomilla)",
+        "session_id": "cached",
+    }
+    yield
+    rag_chain._response_cache.pop(key, None)
+
+
+def test_response_cache_hit_is_isolated_from_callers(cached_response):
+    first = asyncio.run(rag_chain.process_consultation_with_safety(dict(PATIENT, session_id="s1")))
+    assert first["session_id"] == "s1"
+    first["rna_recommendations"].append({"plant": "boldo", "score": 0.1})
+    first["rna_recommendations"][0]["plant"] = "modificada"
+
+    second = asyncio.run(rag_chain.process_consultation_with_safety(dict(PATIENT, session_id="s2")))
+    assert second["session_id"] == "s2"
+    assert second["rna_recommendations"] == [{"plant": "manzanilla", "score": 0.9}]
@@ -0,0 +1,38 @@
+import pytest
+
+pytest.importorskip("tensorflow")
+pd = pytest.importorskip("pandas")
+
+from app.ml.recommender_model import RecommenderModel
+
+PATIENT = {'age': 30, 'gender': 'F', 'zone': 'Lima', 'symptoms': 'dolor de cabeza'}
+
+
+@pytest.fixture
+def model(monkeypatch, tmp_path):
+    model = RecommenderModel(db_config={}, artifacts_path=str(tmp_path / 'artifacts.joblib'))
+    # Sin base de datos: la persistencia del feedback no hace nada
+    monkeypatch.setattr(model, 'bulk_add_training_data', lambda rows, page_size=500: None)
+    return model
+
+
+def test_feedback_is_not_buffered_while_untrained(model):
+    for _ in range(3):
+        assert model.add_new_training_data(PATIENT, 'manzanilla', 5)
+    assert model._pending_rows == []
+    assert model._pending_since == 0.0
+
+
+def test_fit_pending_clears_buffer_while_untrained(model):
+    model._pending_rows = [(PATIENT, 'manzanilla')]
+    model._fit_pending()
+    assert model._pending_rows == []
+
+
+def test_train_resets_pending_buffer(model, monkeypatch):
+    model._pending_rows = [(PATIENT, 'manzanilla')]
+    model._pending_since = 123.0
+    monkeypatch.setattr(model, 'get_data_from_db', lambda: pd.DataFrame())
+    assert model.train() == (None, None)
+    assert model._pending_rows == []
+    assert model._pending_since == 0.0